@@ -67,6 +67,13 @@ class Extractor:
                 return
             return self._files[:]
 
+    def get_extracted(self):
+        """Return a list of names of the files that have already been
+        extracted.
+        """
+        with self._condition:
+            return list(self._extracted)
+
     def get_directory(self):
         """Returns the root extraction directory of this extractor."""
         return self._dst
@@ -0,0 +1,208 @@
+"""archive_prefetcher.py - Prepares the next archive while reading."""
+from __future__ import with_statement
+
+import os
+import shutil
+import tempfile
+import threading
+
+from mcomix import archive_extractor
+from mcomix import archive_session_cache
+from mcomix import archive_tools
+from mcomix import image_tools
+from mcomix import log
+from mcomix.worker_thread import WorkerThread
+
+class ArchivePrefetcher(object):
+
+    """The ArchivePrefetcher prepares the archive that will be opened after
+    the current one, while the user is still reading the last pages.
+
+    Preparing an archive means sniffing its type, listing its contents,
+    extracting its first pages into a private temporary directory and
+    decoding them. When the archive is actually opened, the FileHandler
+    takes over the prepared extractor and pixbufs with take(), so that
+    switching to the next volume costs about as much as a page turn.
+    """
+
+    def __init__(self, filehandler):
+        #: Reference to the L{file_handler.FileHandler}.
+        self._filehandler = filehandler
+        #: Protects the prefetching state from the worker threads.
+        self._lock = threading.Lock()
+        #: Sniffs the archive type and sets up the extractor.
+        self._setup_thread = WorkerThread(self._setup_extractor,
+                                          name='prefetch')
+        #: Decodes the extracted pages.
+        self._decode_thread = WorkerThread(self._decode_page,
+                                           name='prefetch-decode')
+        self._reset()
+
+    def _reset(self):
+        #: Path to the archive being prefetched, or None.
+        self._path = None
+        #: Number of pages to extract and decode.
+        self._pages = 0
+        #: Archive type, once sniffed.
+        self._archive_type = None
+        #: Temporary directory the pages are extracted to.
+        self._tmp_dir = None
+        #: Extractor for the prefetched archive, set before its setup()
+        #: is started.
+        self._extractor = None
+        #: Condition returned by the extractor's setup(), once it is done.
+        self._condition = None
+        #: Complete archive listing, once available.
+        self._files = None
+        #: Archive names of the pages that should be decoded.
+        self._wanted = []
+        #: Decoded pages, archive name => pixbuf.
+        self._pixbufs = {}
+
+    def prefetch(self, path, pages):
+        """Start preparing the archive at <path>, extracting and decoding
+        its first <pages> images. Nothing happens if <path> is already
+        being prefetched.
+        """
+        with self._lock:
+            if path == self._path:
+                return
+
+        self.cancel()
+        log.debug(u'Prefetching next archive "%s"', path)
+        with self._lock:
+            self._path = path
+            self._pages = pages
+        self._setup_thread.append_order(path)
+
+    def get_archive_type(self, path):
+        """Return the archive type of <path> if it has already been
+        determined while prefetching, None otherwise.
+        """
+        with self._lock:
+            if path == self._path:
+                return self._archive_type
+            return None
+
+    def take(self, path):
+        """Hand over the prepared state for the archive at <path>.
+
+        Returns an L{archive_session_cache.ArchiveSession}, whose
+        extractor keeps running and belongs to the caller from now on.
+        If <path> is not the prefetched archive, or if it has not been set
+        up yet, prefetching is cancelled and None is returned.
+        """
+        self._decode_thread.stop()
+        with self._lock:
+            ready = path == self._path and self._condition is not None
+            if ready:
+                extractor = self._extractor
+                extractor.contents_listed -= self._contents_listed
+                extractor.file_extracted -= self._file_extracted
+                session = archive_session_cache.ArchiveSession(path,
+                    extractor, self._condition, self._tmp_dir,
+                    files=self._files, pixbufs=self._pixbufs)
+                self._reset()
+
+        if not ready:
+            self.cancel()
+            return None
+
+        log.debug(u'Using prefetched archive "%s" (%u pages decoded)',
+                  path, len(session.pixbufs))
+        return session
+
+    def cancel(self):
+        """Stop prefetching and discard everything prepared so far."""
+        self._setup_thread.stop()
+        self._decode_thread.stop()
+        with self._lock:
+            extractor = self._extractor
+            tmp_dir = self._tmp_dir
+            self._reset()
+
+        if extractor is not None:
+            extractor.close()
+            self._filehandler.thread_delete(tmp_dir)
+
+    def _setup_extractor(self, path):
+        """Determine the type of the archive at <path>, and start listing
+        its contents. Runs in the setup worker thread.
+        """
+        archive_type = archive_tools.archive_mime_type(path)
+        if archive_type is None:
+            return
+
+        tmp_dir = tempfile.mkdtemp(prefix=u'mcomix.', suffix=os.sep)
+        extractor = archive_extractor.Extractor()
+        extractor.contents_listed += self._contents_listed
+        extractor.file_extracted += self._file_extracted
+        # The extractor is registered before setup() starts listing the
+        # archive, since the listing may arrive before setup() returns.
+        with self._lock:
+            if path != self._path or self._setup_thread.must_stop():
+                shutil.rmtree(tmp_dir, True)
+                return
+            self._archive_type = archive_type
+            self._tmp_dir = tmp_dir
+            self._extractor = extractor
+
+        try:
+            condition = extractor.setup(path, tmp_dir, archive_type)
+        except Exception, ex:
+            log.debug(u'Could not prefetch "%s": %s', path, ex)
+            condition = None
+
+        with self._lock:
+            if (condition is not None and path == self._path and
+                not self._setup_thread.must_stop()):
+                self._condition = condition
+                return
+            if extractor is self._extractor:
+                self._reset()
+                # Keep prefetching <path> from starting again.
+                self._path = path
+
+        # Setup failed, or prefetching was cancelled in the meantime.
+        extractor.close()
+        shutil.rmtree(tmp_dir, True)
+
+    def _contents_listed(self, extractor, files):
+        """ Called when the prefetched archive has been listed. Only the
+        first pages are queued for extraction. """
+        with self._lock:
+            if extractor is not self._extractor:
+                return
+            self._files = files
+            images = self._filehandler._get_archive_images(files)
+            self._wanted = images[:self._pages]
+
+        extractor.set_files(self._wanted)
+        extractor.extract()
+
+    def _file_extracted(self, extractor, name):
+        """ Called when a page of the prefetched archive has been
+        extracted. Queues the page for decoding. """
+        with self._lock:
+            if extractor is not self._extractor or name not in self._wanted:
+                return
+        self._decode_thread.append_order(name)
+
+    def _decode_page(self, name):
+        """ Decode the extracted page <name>. Runs in the decode
+        worker thread. """
+        with self._lock:
+            if self._tmp_dir is None:
+                return
+            path = os.path.join(self._tmp_dir, name)
+
+        try:
+            pixbuf = image_tools.load_pixbuf(path)
+        except Exception, ex:
+            log.debug(u'Could not decode prefetched page "%s": %s', name, ex)
+            return
+
+        with self._lock:
+            self._pixbufs[name] = pixbuf
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,149 @@
+"""archive_session_cache.py - Keeps recently closed archives ready for use."""
+
+import os
+
+from mcomix.preferences import prefs
+from mcomix import log
+
+
+class ArchiveSession(object):
+
+    """The state of an opened archive that is needed to open it again
+    without extracting and decoding everything anew.
+    """
+
+    def __init__(self, path, extractor, condition, tmp_dir,
+                 files=None, pixbufs=None, thumbnails=None,
+                 thumbnail_size=None):
+        #: Path to the archive.
+        self.path = path
+        #: Modification time of the archive when the session was created.
+        self.mtime = _get_mtime(path)
+        #: Extractor that has been set up for the archive.
+        self.extractor = extractor
+        #: Condition returned by the extractor's setup().
+        self.condition = condition
+        #: Temporary directory the archive has been extracted to.
+        self.tmp_dir = tmp_dir
+        #: Complete archive listing, or None if not listed yet.
+        self.files = files
+        #: Decoded pages, archive name => pixbuf.
+        self.pixbufs = pixbufs or {}
+        #: Thumbnail bar images, archive name => pixbuf.
+        self.thumbnails = thumbnails or {}
+        #: Value of the 'thumbnail size' preference for C{thumbnails}.
+        self.thumbnail_size = thumbnail_size
+
+    def get_memory_usage(self):
+        """Return the number of bytes used by the pixbufs of this session."""
+        return sum([_get_pixbuf_size(pixbuf) for pixbuf in
+                    self.pixbufs.values() + self.thumbnails.values()])
+
+    def drop_pixbufs(self):
+        """Free the decoded pages and thumbnails, keeping the extracted
+        files.
+        """
+        self.pixbufs = {}
+        self.thumbnails = {}
+
+
+class ArchiveSessionCache(object):
+
+    """Keeps the sessions of the archives that have been closed most recently,
+    so that going back and forth between volumes does not require extracting
+    and decoding the same pages again.
+
+    At most 'max archive sessions' sessions are kept. Their decoded pages and
+    thumbnails share a memory budget of 'archive session cache size' MiB;
+    the least recently used sessions are evicted first when it is exceeded.
+    """
+
+    def __init__(self, filehandler):
+        #: Reference to the L{file_handler.FileHandler}.
+        self._filehandler = filehandler
+        #: Cached sessions, most recently used last.
+        self._sessions = []
+
+    def is_enabled(self):
+        """Return True if closed archives should be kept at all."""
+        return prefs['max archive sessions'] > 0
+
+    def __contains__(self, path):
+        return self._find(path) is not None
+
+    def store(self, session):
+        """Add <session> as the most recently used session, evicting older
+        sessions if the cache limits are exceeded.
+        """
+        old_session = self._find(session.path)
+        if old_session is not None:
+            self._sessions.remove(old_session)
+            self._close(old_session)
+
+        self._sessions.append(session)
+        log.debug(u'Keeping session for "%s"', session.path)
+        self._evict()
+
+    def take(self, path):
+        """Remove the session for <path> from the cache and return it, or
+        return None if there is no usable session for <path>.
+        """
+        session = self._find(path)
+        if session is None:
+            return None
+
+        self._sessions.remove(session)
+        if session.mtime != _get_mtime(path):
+            # The archive has been modified since.
+            self._close(session)
+            return None
+
+        log.debug(u'Reusing session for "%s"', path)
+        return session
+
+    def clear(self):
+        """Discard all sessions."""
+        while self._sessions:
+            self._close(self._sessions.pop(0))
+
+    def _find(self, path):
+        for session in self._sessions:
+            if session.path == path:
+                return session
+        return None
+
+    def _evict(self):
+        """Enforce the session count and memory limits."""
+        while len(self._sessions) > max(prefs['max archive sessions'], 0):
+            self._close(self._sessions.pop(0))
+
+        budget = prefs['archive session cache size'] * 1024 * 1024
+        usage = sum([session.get_memory_usage() for session in self._sessions])
+        for session in self._sessions[:]:
+            if usage <= budget:
+                break
+            usage -= session.get_memory_usage()
+            if session is self._sessions[-1]:
+                # Never evict the session that has just been stored,
+                # its extracted files remain useful.
+                session.drop_pixbufs()
+            else:
+                self._sessions.remove(session)
+                self._close(session)
+
+    def _close(self, session):
+        log.debug(u'Discarding session for "%s"', session.path)
+        session.extractor.close()
+        self._filehandler.thread_delete(session.tmp_dir)
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _get_pixbuf_size(pixbuf):
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+# vim: expandtab:sw=4:ts=4
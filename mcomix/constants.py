@@ -15,9 +15,16 @@ DATA_DIR = tools.get_data_directory()
 
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 THUMBNAIL_PATH = os.path.join(HOME_DIR, '.thumbnails/normal')
+THUMBNAIL_LARGE_PATH = os.path.join(HOME_DIR, '.thumbnails/large')
+THUMBNAIL_XLARGE_PATH = os.path.join(HOME_DIR, '.thumbnails/x-large')
+#: Sizes and directories of stored thumbnails, smallest first.
+THUMBNAIL_TIERS = ((128, THUMBNAIL_PATH), (256, THUMBNAIL_LARGE_PATH),
+                   (512, THUMBNAIL_XLARGE_PATH))
 LIBRARY_DATABASE_PATH = os.path.join(DATA_DIR, 'library.db')
 LASTPAGE_DATABASE_PATH = os.path.join(DATA_DIR, 'lastreadpage.db')
 LIBRARY_COVERS_PATH = os.path.join(DATA_DIR, 'library_covers')
+LIBRARY_COVERS_PACK_PATH = os.path.join(DATA_DIR, 'library_covers.db')
+THUMBNAIL_ATLAS_PATH = os.path.join(DATA_DIR, 'thumbnail_atlases')
 PREFERENCE_PATH = os.path.join(CONFIG_DIR, 'preferences.conf')
 KEYBINDINGS_CONF_PATH = os.path.join(CONFIG_DIR, 'keybindings.conf')
 
@@ -44,6 +51,8 @@ UNION_INDEX = -2
 ZIP, RAR, TAR, GZIP, BZIP2, PDF, SEVENZIP, LHA, ZIP_EXTERNAL = range(9)
 NORMAL_CURSOR, GRAB_CURSOR, WAIT_CURSOR, NO_CURSOR = range(4)
 LIBRARY_DRAG_EXTERNAL_ID, LIBRARY_DRAG_BOOK_ID, LIBRARY_DRAG_COLLECTION_ID = range(3)
+#: Identifies the 'Recent' collection that stores recently read books.
+COLLECTION_RECENT = -2
 AUTOROTATE_NEVER, AUTOROTATE_WIDTH_90, AUTOROTATE_WIDTH_270, \
     AUTOROTATE_HEIGHT_90, AUTOROTATE_HEIGHT_270 = range(5)
 
@@ -5,6 +5,9 @@ brightness etc.)
 from mcomix.preferences import prefs
 from mcomix import image_tools
 
+#: Number of enhanced pages that are kept in memory.
+MAX_CACHED_PAGES = 4
+
 class ImageEnhancer:
 
     """The ImageEnhancer keeps track of the "enhancement" values and performs
@@ -19,18 +22,44 @@ class ImageEnhancer:
         self.saturation = prefs['saturation']
         self.sharpness = prefs['sharpness']
         self.autocontrast = prefs['auto contrast']
+        #: Page key => enhanced pixbuf
+        self._cache = {}
+        #: Page keys, least recently used first
+        self._cache_order = []
+        #: Enhancement values the cached pixbufs were created with
+        self._cache_values = None
+
+    def enhance(self, pixbuf, key=None):
+        """Return an "enhanced" version of <pixbuf>. If <key> is given, it
+        must identify the page and everything that affects the contents
+        of <pixbuf>, e.g. its size. The result is then cached, so that
+        redrawing the page does not enhance it again."""
+
+        values = (self.brightness, self.contrast, self.saturation,
+                  self.sharpness, self.autocontrast)
+        if values == (1.0, 1.0, 1.0, 1.0, False):
+            return pixbuf
 
-    def enhance(self, pixbuf):
-        """Return an "enhanced" version of <pixbuf>."""
+        if key is None:
+            return image_tools.enhance(pixbuf, *values)
 
-        if (self.brightness != 1.0 or self.contrast != 1.0 or
-          self.saturation != 1.0 or self.sharpness != 1.0 or
-          self.autocontrast):
+        if values != self._cache_values:
+            self.clear_cache()
+            self._cache_values = values
 
-            return image_tools.enhance(pixbuf, self.brightness, self.contrast,
-                self.saturation, self.sharpness, self.autocontrast)
+        if key in self._cache:
+            self._cache_order.remove(key)
+        else:
+            self._cache[key] = image_tools.enhance(pixbuf, *values)
+            if len(self._cache_order) >= MAX_CACHED_PAGES:
+                del self._cache[self._cache_order.pop(0)]
+        self._cache_order.append(key)
+        return self._cache[key]
 
-        return pixbuf
+    def clear_cache(self):
+        """Forget all cached pages, e.g. when the file is closed."""
+        self._cache = {}
+        self._cache_order = []
 
     def signal_update(self):
         """Signal to the main window that a change in the enhancement
@@ -38,6 +38,10 @@ class _BaseFileChooserDialog(gtk.Dialog):
     def __init__(self, action=gtk.FILE_CHOOSER_ACTION_OPEN):
         self._action = action
         self._destroyed = False
+        #: Creates the preview thumbnails.
+        self._thumbnailer = thumbnail_tools.Thumbnailer()
+        self._thumbnailer.set_size(128, 128)
+        self._thumbnailer.thumbnail_finished += self._preview_thumbnail_finished
 
         if action == gtk.FILE_CHOOSER_ACTION_OPEN:
             title = _('Open')
@@ -256,6 +260,7 @@ class _BaseFileChooserDialog(gtk.Dialog):
         else:
             self.files_chosen([])
 
+        self._thumbnailer.cancel()
         self._destroyed = True
 
     def _update_preview(self, *args):
@@ -264,11 +269,11 @@ class _BaseFileChooserDialog(gtk.Dialog):
         else:
             path = None
 
+        # Only the latest preview is of interest.
+        self._thumbnailer.cancel()
+
         if path and os.path.isfile(path):
-            thumbnailer = thumbnail_tools.Thumbnailer()
-            thumbnailer.set_size(128, 128)
-            thumbnailer.thumbnail_finished += self._preview_thumbnail_finished
-            thumbnailer.thumbnail(path, async=True)
+            self._thumbnailer.thumbnail(path, async=True)
         else:
             self._preview_image.clear()
             self._namelabel.set_text('')
@@ -11,6 +11,8 @@ import gtk
 
 from mcomix.preferences import prefs
 from mcomix import archive_extractor
+from mcomix import archive_prefetcher
+from mcomix import archive_session_cache
 from mcomix import archive_tools
 from mcomix import image_tools
 from mcomix import icons
@@ -65,6 +67,14 @@ class FileHandler(object):
         self._condition = None
         #: Provides a list of available files/archives in the open directory.
         self._file_provider = None
+        #: Prepares the next archive when the end of the current one is near.
+        self._prefetcher = archive_prefetcher.ArchivePrefetcher(self)
+        #: Keeps recently closed archives ready to be opened again.
+        self._sessions = archive_session_cache.ArchiveSessionCache(self)
+        #: Pages decoded in advance, archive name => pixbuf.
+        self._restored_pixbufs = {}
+        #: Thumbnails generated in advance, archive name => pixbuf.
+        self._restored_thumbnails = {}
         #: Keeps track of the last read page in archives
         self.last_read_page = last_read_page.LastReadPage(backend.LibraryBackend())
         #: Regexp used for determining which archive files are images.
@@ -107,7 +117,8 @@ class FileHandler(object):
 
         if os.path.exists(path) and os.access(path, os.R_OK):
             filelist = self._file_provider.list_files()
-            archive_type = archive_tools.archive_mime_type(path)
+            archive_type = (self._prefetcher.get_archive_type(path) or
+                            archive_tools.archive_mime_type(path))
         else:
             filelist = []
             archive_type = None
@@ -138,6 +149,7 @@ class FileHandler(object):
 
         # Actually open the file(s)/archive passed in path.
         if self.archive_type is not None:
+            self.file_loading = True
             try:
                 self._open_archive(self._current_file, start_page)
             except Exception, ex:
@@ -147,8 +159,8 @@ class FileHandler(object):
                 self._window.osd.show(unicode(ex))
                 self._window.uimanager.set_sensitivities()
                 return False
-            self.file_loading = True
         else:
+            self._prefetcher.cancel()
             image_files, current_image_index = \
                 self._open_image_files(filelist, self._current_file)
             self._archive_opened(image_files, current_image_index)
@@ -199,6 +211,7 @@ class FileHandler(object):
 
             self._window.uimanager.set_sensitivities()
             self._window.thumbnailsidebar.load_thumbnails()
+            self._restore_thumbnails(image_files)
             self._window.uimanager.set_sensitivities()
 
             self.write_fileinfo_file()
@@ -226,6 +239,16 @@ class FileHandler(object):
     def close_file(self, *args):
         """Run tasks for "closing" the currently opened file(s)."""
         self.update_last_read_page()
+        if (self.archive_type is not None and self.file_loaded and
+            self._sessions.is_enabled()):
+            self._sessions.store(self._create_session())
+            self._set_extractor(archive_extractor.Extractor())
+        else:
+            self._extractor.stop()
+            self.thread_delete(self._tmp_dir)
+        self._tmp_dir = tempfile.mkdtemp(prefix=u'mcomix.', suffix=os.sep)
+        self._restored_pixbufs = {}
+        self._restored_thumbnails = {}
         self.file_loaded = False
         self.file_loading = False
         self.archive_type = None
@@ -236,9 +259,6 @@ class FileHandler(object):
         self._name_table.clear()
         self._window.clear()
         self._window.uimanager.set_sensitivities()
-        self._extractor.stop()
-        self.thread_delete(self._tmp_dir)
-        self._tmp_dir = tempfile.mkdtemp(prefix=u'mcomix.', suffix=os.sep)
         self._window.imagehandler.close()
         self._window.thumbnailsidebar.clear()
         self._window.set_icon_list(*icons.mcomix_icons())
@@ -310,6 +330,14 @@ class FileHandler(object):
 
 
         self._base_path = path
+
+        session = self._sessions.take(path)
+        if session is None:
+            session = self._prefetcher.take(path)
+        if session is not None:
+            self._restore_session(session)
+            return
+
         try:
             self._condition = self._extractor.setup(self._base_path,
                                                 self._tmp_dir,
@@ -318,19 +346,90 @@ class FileHandler(object):
             self._condition = None
             raise
 
-    def _listed_contents(self, archive, files):
+    def _create_session(self):
+        """ Returns an L{archive_session_cache.ArchiveSession} for the
+        currently opened archive, including the pages and thumbnails that
+        have already been decoded. """
+        imagehandler = self._window.imagehandler
+        pixbufs = {}
+        for index, pixbuf in imagehandler._raw_pixbufs.items():
+            if pixbuf is not constants.MISSING_IMAGE_ICON:
+                name = self._name_table[imagehandler._image_files[index]]
+                pixbufs[name] = pixbuf
+
+        thumbnails = {}
+        for index, pixbuf in \
+            self._window.thumbnailsidebar.get_thumbnails().items():
+            name = self._name_table[imagehandler._image_files[index]]
+            thumbnails[name] = pixbuf
 
-        if not self.file_loading:
-            return
-        self.file_loading = False
+        self._extractor.stop()
+        return archive_session_cache.ArchiveSession(self._base_path,
+            self._extractor, self._condition, self._tmp_dir,
+            files=self._name_table.values(), pixbufs=pixbufs,
+            thumbnails=thumbnails, thumbnail_size=prefs['thumbnail size'])
+
+    def _restore_session(self, session):
+        """ Opens the archive from a previously prepared
+        L{archive_session_cache.ArchiveSession}. """
+        # The temporary directory created by close_file is still empty.
+        shutil.rmtree(self._tmp_dir, True)
+        self._tmp_dir = session.tmp_dir
+        self._set_extractor(session.extractor)
+        self._condition = session.condition
+        self._restored_pixbufs = session.pixbufs
+        if session.thumbnail_size == prefs['thumbnail size']:
+            self._restored_thumbnails = session.thumbnails
+
+        files = session.files
+        if files is None:
+            files = self._extractor.get_files()
+        if files is not None:
+            # Contents have already been listed.
+            self._listed_contents(self._extractor, files)
+            if self.file_loaded:
+                self.file_available([os.path.join(self._tmp_dir, name)
+                    for name in self._extractor.get_extracted()])
+
+    def _restore_thumbnails(self, image_files):
+        """ Hands over thumbnails of a restored session to the
+        thumbnail bar. """
+        thumbnails = {}
+        for index, path in enumerate(image_files):
+            name = self._name_table[path]
+            if name in self._restored_thumbnails:
+                thumbnails[index] = self._restored_thumbnails[name]
+        self._restored_thumbnails = {}
+
+        if thumbnails:
+            self._window.thumbnailsidebar.set_thumbnails(thumbnails)
+
+    def _set_extractor(self, extractor):
+        """ Replaces the current extractor with <extractor>, which must
+        already be set up. """
+        self._extractor.file_extracted -= self._extracted_file
+        self._extractor.contents_listed -= self._listed_contents
+        self._extractor = extractor
+        self._extractor.file_extracted += self._extracted_file
+        self._extractor.contents_listed += self._listed_contents
 
-        files = self._extractor.get_files()
+    def _get_archive_images(self, files):
+        """ Returns the images found among the archive members in
+        C{files}, sorted according to the preferences. """
         archive_images = [image for image in files
             if self._image_re.search(image)
             # Remove MacOS meta files from image list
             and not u'__MACOSX' in os.path.normpath(image).split(os.sep)]
 
-        archive_images = self._sort_archive_images(archive_images)
+        return self._sort_archive_images(archive_images)
+
+    def _listed_contents(self, archive, files):
+
+        if not self.file_loading:
+            return
+        self.file_loading = False
+
+        archive_images = self._get_archive_images(files)
         image_files = [ os.path.join(self._tmp_dir, f)
                         for f in archive_images ]
 
@@ -359,6 +458,14 @@ class FileHandler(object):
         # to translate from file name to page index
         self._window.imagehandler._image_files = image_files
 
+        # Hand over pages that have been decoded in advance.
+        for index, path in enumerate(image_files):
+            name = self._name_table[path]
+            if name in self._restored_pixbufs:
+                self._window.imagehandler._raw_pixbufs[index] = \
+                    self._restored_pixbufs[name]
+        self._restored_pixbufs = {}
+
         # Image index may have changed after additional files were extracted.
         # This call might block due to displaying a confirmation dialog.
         current_image_index = self._get_index_for_page(self._start_page,
@@ -479,6 +586,8 @@ class FileHandler(object):
     def cleanup(self):
         """Run clean-up tasks. Should be called prior to exit."""
         self._stop_waiting = True
+        self._prefetcher.cancel()
+        self._sessions.clear()
         self._extractor.stop()
         self.thread_delete(self._tmp_dir)
         self.update_last_read_page()
@@ -560,6 +669,29 @@ class FileHandler(object):
 
         return False
 
+    def prefetch_next_archive(self):
+        """Start preparing the archive that comes directly after the
+        currently loaded archive, so that it opens instantly once the end
+        of the current archive has been reached.
+        """
+        if self.archive_type is None or not self.file_loaded:
+            return
+
+        if not (prefs['auto open next archive'] or
+            (self._window.slideshow.is_running() and
+             prefs['slideshow can go to next archive'])):
+            return
+
+        files = self._file_provider.list_files(file_provider.FileProvider.ARCHIVES)
+        absolute_path = os.path.abspath(self._base_path)
+        if absolute_path not in files: return
+        current_index = files.index(absolute_path)
+
+        if (current_index + 1 < len(files) and
+            files[current_index + 1] not in self._sessions):
+            pages = self._window.is_double_page and 2 or 1
+            self._prefetcher.prefetch(files[current_index + 1], pages)
+
     def _open_previous_archive(self, *args):
         """Open the archive that comes directly before the currently loaded
         archive in that archive's directory listing, sorted alphabetically.
@@ -4,6 +4,8 @@
 
 import os
 import re
+import stat
+import time
 
 from mcomix import image_tools
 from mcomix import archive_tools
@@ -13,6 +15,12 @@ from mcomix import preferences
 from mcomix import i18n
 from mcomix import log
 
+#: Number of directory listings that are kept in memory.
+MAX_SNAPSHOTS = 20
+
+#: Directory path => L{_DirectorySnapshot}
+_snapshots = {}
+
 def get_file_provider(filelist):
     """ Initialize a FileProvider with the files in <filelist>.
     If len(filelist) is 1, a OrderedFileProvider will be constructed, which
@@ -63,17 +71,18 @@ class FileProvider(object):
         return False
 
     @staticmethod
-    def sort_files(files):
+    def sort_files(files, get_stat=os.stat):
         """ Sorts a list of C{files} depending on the current preferences.
-        The list is sorted in-place. """
+        The list is sorted in-place. <get_stat> returns the stat result
+        of a file, and is called at most once per file. """
         if preferences.prefs['sort by'] == constants.SORT_NAME:
             tools.alphanumeric_sort(files)
         elif preferences.prefs['sort by'] == constants.SORT_LAST_MODIFIED:
             # Most recently modified file first
-            files.sort(key=lambda filename: os.path.getmtime(filename)*-1)
+            files.sort(key=lambda filename: get_stat(filename).st_mtime*-1)
         elif preferences.prefs['sort by'] == constants.SORT_SIZE:
             # Smallest file first
-            files.sort(key=lambda filename: os.stat(filename).st_size)
+            files.sort(key=lambda filename: get_stat(filename).st_size)
         # else: don't sort at all: use OS ordering.
 
         # Default is ascending.
@@ -118,25 +127,8 @@ class OrderedFileProvider(FileProvider):
         """ Lists all files in the current directory.
             Returns a list of absolute paths, already sorted. """
 
-        if mode == FileProvider.IMAGES:
-            should_accept = lambda file: image_tools.is_image_file(file)
-        elif mode == FileProvider.ARCHIVES:
-            should_accept = lambda file: \
-                archive_tools.get_supported_archive_regex().search(file, re.I) is not None
-        else:
-            should_accept = lambda file: True
-
         try:
-            files = [ os.path.join(self.base_dir, filename) for filename in
-                      # Explicitly convert all files to Unicode, even when
-                      # os.listdir returns a mixture of byte/unicode strings.
-                      # (MComix bug #3424405)
-                      [ i18n.to_unicode(fn) for fn in os.listdir(self.base_dir) ]
-                      if should_accept(os.path.join(self.base_dir, filename)) ]
-
-            FileProvider.sort_files(files)
-
-            return files
+            return list(_get_snapshot(self.base_dir).get_files(mode))
         except OSError:
             log.warning(u'! ' + _('Could not open %s: Permission denied.'), self.base_dir)
             return []
@@ -173,12 +165,100 @@ class OrderedFileProvider(FileProvider):
             already sorted. """
 
         parent_dir = os.path.dirname(dir)
-        directories = [ os.path.join(parent_dir, directory)
-                for directory in os.listdir(parent_dir)
-                if os.path.isdir(os.path.join(parent_dir, directory)) ]
+        return _get_snapshot(parent_dir).get_directories()
+
+
+class _DirectorySnapshot(object):
+    """ The contents of a directory, as listed at one point in time. Entries
+    are stat'ed at most once, when their modification time, size or type is
+    first needed, and the filtered and sorted views of the listing are
+    cached until the directory changes. Changes to the files themselves
+    (e.g. their size) do not invalidate the snapshot. """
+
+    def __init__(self, directory):
+        """ Lists <directory>. Raises OSError if it cannot be read. """
+        #: Path of the listed directory
+        self.directory = directory
+        #: Modification time of the directory when it was listed
+        self.mtime = os.stat(directory).st_mtime
+        #: Changes within the timestamp resolution of the file system would
+        #: go unnoticed, so only directories that settled are trusted.
+        self._settled = time.time() - self.mtime > 2
+        #: Paths of all entries, in the order returned by the OS
+        self._paths = []
+        #: Path => stat result, for the entries stat'ed so far
+        self._stats = {}
+        #: (mode, sort by, sort order) => list of paths
+        self._views = {}
+
+        # Explicitly convert all files to Unicode, even when os.listdir
+        # returns a mixture of byte/unicode strings. (MComix bug #3424405)
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, i18n.to_unicode(filename))
+            self._paths.append(path)
+
+    def is_current(self):
+        """ Returns True if the directory has not changed since it was
+        listed. """
+        try:
+            return self._settled and os.stat(self.directory).st_mtime == self.mtime
+        except OSError:
+            return False
+
+    def get_files(self, mode):
+        """ Returns the files accepted by <mode>, sorted depending on the
+        current preferences. The returned list must not be modified. """
+        view = (mode, preferences.prefs['sort by'],
+                preferences.prefs['sort order'])
+        if view in self._views:
+            return self._views[view]
+
+        if mode == FileProvider.IMAGES:
+            should_accept = lambda file: image_tools.is_image_file(file)
+        elif mode == FileProvider.ARCHIVES:
+            should_accept = lambda file: \
+                archive_tools.get_supported_archive_regex().search(file, re.I) is not None
+        else:
+            should_accept = lambda file: True
 
-        tools.alphanumeric_sort(directories)
-        return directories
+        files = [ path for path in self._paths if should_accept(path) ]
+        FileProvider.sort_files(files, self._get_stat)
+        self._views[view] = files
+        return files
+
+    def get_directories(self):
+        """ Returns the subdirectories, in natural order. The returned list
+        must not be modified. """
+        if 'directories' not in self._views:
+            directories = [ path for path in self._paths
+                            if stat.S_ISDIR(self._get_stat(path).st_mode) ]
+            tools.alphanumeric_sort(directories)
+            self._views['directories'] = directories
+        return self._views['directories']
+
+    def _get_stat(self, path):
+        """ Returns the stat result of the entry <path>. """
+        result = self._stats.get(path)
+        if result is None:
+            try:
+                result = os.stat(path)
+            except OSError:
+                # Broken symbolic link
+                result = os.lstat(path)
+            self._stats[path] = result
+        return result
+
+
+def _get_snapshot(directory):
+    """ Returns an up to date L{_DirectorySnapshot} of <directory>.
+    Raises OSError if the directory cannot be read. """
+    snapshot = _snapshots.get(directory)
+    if snapshot is None or not snapshot.is_current():
+        snapshot = _DirectorySnapshot(directory)
+        if len(_snapshots) >= MAX_SNAPSHOTS:
+            _snapshots.clear()
+        _snapshots[directory] = snapshot
+    return snapshot
 
 
 class PreDefinedFileProvider(FileProvider):
@@ -18,7 +18,7 @@ def draw_histogram(pixbuf, height=170, fill=170, text=True):
     one corner.
     """
     im = Image.new('RGB', (258, height - 4), (30, 30, 30))
-    hist_data = image_tools.pixbuf_to_pil(pixbuf).histogram()
+    hist_data = image_tools.get_histogram(pixbuf)
     maximum = max(hist_data[:768] + [1])
     y_scale = float(height - 6) / maximum
     r = [int(hist_data[n] * y_scale) for n in xrange(256)]
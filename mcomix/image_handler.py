@@ -1,4 +1,5 @@
 """image_handler.py - Image handler that takes care of cacheing and giving out images."""
+from __future__ import with_statement
 
 import os
 import threading
@@ -51,6 +52,12 @@ class ImageHandler:
         self._raw_pixbufs = {}
         #: How many pages to keep in cache
         self._cache_pages = prefs['max pages to cache']
+        #: Thumbnail map from (page index, width, height) > Pixbuf
+        self._thumbnails = {}
+        #: Protects the thumbnail map, thumbnails are requested from several threads
+        self._thumbnail_lock = threading.Lock()
+        #: Page index => {side: edge colours}, see L{image_tools.get_edge_colours}
+        self._edge_colours = {}
 
         #: Advance only one page instead of two in double page mode
         self.force_single_step = False
@@ -95,20 +102,28 @@ class ImageHandler:
         """ Returns an automatically calculated background color
         for the current page(s). """
 
-        pixbufs = self.get_pixbufs(number_of_bufs)
-
-        if len(pixbufs) == 1:
-            auto_bg = image_tools.get_most_common_edge_colour(pixbufs[0])
-        elif len(pixbufs) == 2:
-            left, right = pixbufs
+        if number_of_bufs == 1:
+            left = right = self._current_image_index
+        elif number_of_bufs == 2:
+            left, right = self._current_image_index, self._current_image_index + 1
             if self._window.is_manga_mode:
                 left, right = right, left
-
-            auto_bg = image_tools.get_most_common_edge_colour((left, right))
         else:
             assert False, 'Unexpected pixbuf count'
 
-        return auto_bg
+        return image_tools.get_most_common_colour((
+            self._get_edge_colours(left, 'left'),
+            self._get_edge_colours(right, 'right')))
+
+    def _get_edge_colours(self, index, side):
+        """ Returns the edge colours of <side> of the page <index>. They
+        are only computed once per page, and kept after the page's pixbuf
+        has been removed from the cache. """
+        page_colours = self._edge_colours.setdefault(index, {})
+        if side not in page_colours:
+            page_colours[side] = image_tools.get_edge_colours(
+                self._get_pixbuf(index), side)
+        return page_colours[side]
 
     def do_cacheing(self):
         """Make sure that the correct pixbufs are stored in cache. These
@@ -137,6 +152,11 @@ class ImageHandler:
         if len(orders) > 0:
             self._thread.extend_orders(orders)
 
+        # Start preparing the next archive when approaching the end.
+        pages_left = self.get_number_of_pages() - self.get_current_page()
+        if pages_left < prefs['pages left before prefetching next archive']:
+            self._window.filehandler.prefetch_next_archive()
+
     def _cache_pixbuf(self, wanted):
         priority, index = wanted
         log.debug('Caching page %u', index + 1)
@@ -288,6 +308,9 @@ class ImageHandler:
         self._current_image_index = None
         self._available_images.clear()
         self._raw_pixbufs.clear()
+        self._edge_colours.clear()
+        with self._thumbnail_lock:
+            self._thumbnails.clear()
         self._cache_pages = prefs['max pages to cache']
 
         tools.garbage_collect()
@@ -343,6 +366,9 @@ class ImageHandler:
 
         available = sorted(filepaths)
         for i, imgpath in enumerate(self._image_files):
+            # Files extracted in advance might be announced twice.
+            if i in self._available_images:
+                continue
             if tools.bin_search(available, imgpath) >= 0:
                 self.page_available(i + 1)
 
@@ -482,14 +508,57 @@ class ImageHandler:
         if path == None:
             return None
 
+        index = page - 1
+        pixbuf = self._get_cached_thumbnail(index, width, height)
+        if pixbuf is not None:
+            return pixbuf
+
         try:
-            thumbnailer = thumbnail_tools.Thumbnailer()
-            thumbnailer.set_store_on_disk(create)
-            thumbnailer.set_size(width, height)
-            return thumbnailer.thumbnail(path)
+            # Scaling down a page that is already decoded is cheaper
+            # than decoding it again.
+            source = self._raw_pixbufs.get(index)
+            if source is not None and source is not constants.MISSING_IMAGE_ICON:
+                pixbuf = image_tools.fit_in_rectangle(source, width, height)
+            else:
+                thumbnailer = thumbnail_tools.Thumbnailer()
+                thumbnailer.set_store_on_disk(create)
+                thumbnailer.set_size(width, height)
+                pixbuf = thumbnailer.thumbnail(path)
         except Exception:
             return constants.MISSING_IMAGE_ICON
 
+        if pixbuf is not None:
+            with self._thumbnail_lock:
+                self._thumbnails[(index, width, height)] = pixbuf
+        return pixbuf
+
+    def _get_cached_thumbnail(self, index, width, height):
+        """Return a thumbnail of the page at <index> that fits in
+        <width>x<height>, derived from the thumbnails created so far, or
+        None if none of them is large enough.
+        """
+        with self._thumbnail_lock:
+            if (index, width, height) in self._thumbnails:
+                return self._thumbnails[(index, width, height)]
+
+            candidates = [pixbuf for (cached_index, cached_width, cached_height), pixbuf
+                          in self._thumbnails.iteritems() if cached_index == index]
+
+        # Use the smallest thumbnail that does not need to be scaled up.
+        best = None
+        for pixbuf in candidates:
+            if pixbuf.get_width() < width and pixbuf.get_height() < height:
+                continue
+            if best is None or pixbuf.get_width() < best.get_width():
+                best = pixbuf
+        if best is None:
+            return None
+
+        pixbuf = image_tools.fit_in_rectangle(best, width, height)
+        with self._thumbnail_lock:
+            self._thumbnails[(index, width, height)] = pixbuf
+        return pixbuf
+
     def _get_forward_step_length(self):
         """Return the step length for switching pages forwards."""
         if self.force_single_step:
@@ -5,12 +5,14 @@ import os
 import operator
 import itertools
 import bisect
+import struct
 import gtk
 import PIL.Image as Image
 import PIL.ImageEnhance as ImageEnhance
-import PIL.ImageOps as ImageOps
+import PIL.ImageFilter as ImageFilter
 
 from mcomix.preferences import prefs
+from mcomix import pixbuf_array
 
 # File formats supported by PyGTK (sorted list of extensions)
 _supported_formats = sorted(
@@ -121,112 +123,109 @@ def get_most_common_edge_colour(pixbufs, edge=2):
     of <pixbuf>. The return value is a sequence, (r, g, b), with 16 bit
     values. If <pixbuf> is a tuple, the edges will be computed from
     both the left and the right image.
-
-    Note: This could be done more cleanly with subpixbuf(), but that
-    doesn't work as expected together with get_pixels().
     """
-
-    def group_colors(colors, steps=10):
-        """ This rounds a list of colors in C{colors} to the next nearest value,
-        i.e. 128, 83, 10 becomes 130, 85, 10 with C{steps}=5. This compensates for
-        dirty colors where no clear dominating color can be made out.
-
-        @return: The color that appears most often in the prominent group."""
-
-        # Start group
-        group = (0, 0, 0)
-        # List of (count, color) pairs, group contains most colors
-        colors_in_prominent_group = []
-        color_count_in_prominent_group = 0
-        # List of (count, color) pairs, current color group
-        colors_in_group = []
-        color_count_in_group = 0
-
-        for count, color in colors:
-
-            # Round color
-            rounded = [0] * len(color)
-            for i, color_value in enumerate(color):
-                if steps % 2 == 0:
-                    middle = steps // 2
-                else:
-                    middle = steps // 2 + 1
-
-                remainder = color_value % steps
-                if remainder >= middle:
-                    color_value = color_value + (steps - remainder)
-                else:
-                    color_value = color_value - remainder
-
-                rounded[i] = min(255, max(0, color_value))
-
-            # Change prominent group if necessary
-            if rounded == group:
-                # Color still fits in the previous color group
-                colors_in_group.append((count, color))
-                color_count_in_group += count
-            else:
-                # Color group changed, check if current group has more colors
-                # than last group
-                if color_count_in_group > color_count_in_prominent_group:
-                    colors_in_prominent_group = colors_in_group
-                    color_count_in_prominent_group = color_count_in_group
-
-                group = rounded
-                colors_in_group = [ (count, color) ]
-                color_count_in_group = count
-
-        # Cleanup if only one edge color group was found
-        if color_count_in_group > color_count_in_prominent_group:
-            colors_in_prominent_group = colors_in_group
-
-        colors_in_prominent_group.sort(key=operator.itemgetter(0), reverse=True)
-        # List is now sorted by color count, first color appears most often
-        return colors_in_prominent_group[0][1]
-
-    def get_edge_pixbuf(pixbuf, side, edge):
-        """ Returns a pixbuf corresponding to the side passed in <side>.
-        Valid sides are 'left', 'right', 'top', 'bottom'. """
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        edge = min(edge, width, height)
-
-        subpix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB,
-                pixbuf.get_has_alpha(), 8, edge, height)
-        if side == 'left':
-            pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
-        elif side == 'right':
-            pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
-        elif side == 'top':
-            pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
-        elif side == 'bottom':
-            pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
-        else:
-            assert False, 'Invalid edge side'
-
-        return subpix
-
     if not pixbufs:
         return (0, 0, 0)
 
     if not isinstance(pixbufs, (tuple, list)):
-        left_edge = get_edge_pixbuf(pixbufs, 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs, 'right', edge)
+        left_pixbuf = right_pixbuf = pixbufs
     else:
         assert len(pixbufs) == 2, 'Expected two pages in list'
-        left_edge = get_edge_pixbuf(pixbufs[0], 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs[1], 'right', edge)
+        left_pixbuf, right_pixbuf = pixbufs
+
+    return get_most_common_colour((
+        get_edge_colours(left_pixbuf, 'left', edge),
+        get_edge_colours(right_pixbuf, 'right', edge)))
+
+def get_edge_colours(pixbuf, side, edge=2, steps=10):
+    """ Returns the colours along the side <side> of <pixbuf>, which is
+    either 'left' or 'right', for L{get_most_common_colour}. Colours are
+    grouped by rounding them to the nearest multiple of <steps>, which
+    compensates for dirty colours where no clear dominating colour can be
+    made out.
+
+    The result is a dictionary mapping each rounded colour to a tuple
+    (number of pixels in the group, number of pixels with the most common
+    colour of the group, most common colour of the group). It is small
+    enough to be kept for each page. """
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    edge = min(edge, width, height)
+    if side == 'left':
+        x = 0
+    elif side == 'right':
+        x = width - edge
+    else:
+        assert False, 'Invalid edge side'
 
-    # Find all edge colors. Color count is separate for all four edges
-    ungrouped_colors = []
-    for edge in (left_edge, right_edge):
-        im = pixbuf_to_pil(edge)
-        ungrouped_colors.extend(im.getcolors(im.size[0] * im.size[1]))
+    if steps % 2 == 0:
+        middle = steps // 2
+    else:
+        middle = steps // 2 + 1
+
+    if pixbuf_array.is_available():
+        array = pixbuf_array.pixbuf_to_array(pixbuf)[:, x:x + edge]
+        return pixbuf_array.get_grouped_colors(array, steps, middle)
+
+    # Note: This could be done more cleanly with subpixbuf(), but that
+    # doesn't work as expected together with get_pixels().
+    subpix = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB,
+            pixbuf.get_has_alpha(), 8, edge, height)
+    pixbuf.copy_area(x, 0, edge, height, subpix, 0, 0)
+    im = pixbuf_to_pil(subpix)
+    return _group_colours(im.getcolors(im.size[0] * im.size[1]),
+                          steps, middle)
+
+def _group_colours(colours, steps, middle):
+    """ Groups <colours>, a list of (count, colour) tuples as returned by
+    Image.getcolors(), like L{pixbuf_array.get_grouped_colors}. """
+    groups = {}
+    for count, colour in sorted(colours, key=operator.itemgetter(1)):
+        rounded = []
+        for colour_value in colour:
+            remainder = colour_value % steps
+            if remainder >= middle:
+                colour_value = colour_value + (steps - remainder)
+            else:
+                colour_value = colour_value - remainder
+            rounded.append(min(255, max(0, colour_value)))
+        rounded = tuple(rounded)
+
+        total, best_count, best_colour = groups.get(rounded, (0, 0, None))
+        if count > best_count:
+            best_count, best_colour = count, colour
+        groups[rounded] = (total + count, best_count, best_colour)
+
+    return groups
+
+def get_most_common_colour(edge_colours):
+    """ Returns the most common colour as sequence (r, g, b) with 16 bit
+    values, from a list of L{get_edge_colours} results. The group with
+    the most pixels is chosen, and within it the colour that appears
+    most often along a single edge. """
+    groups = {}
+    for colours in edge_colours:
+        for rounded, (total, count, colour) in colours.iteritems():
+            if rounded not in groups:
+                groups[rounded] = (total, count, colour)
+                continue
+
+            group_total, group_count, group_colour = groups[rounded]
+            if (count > group_count or
+                (count == group_count and colour < group_colour)):
+                group_count, group_colour = count, colour
+            groups[rounded] = (group_total + total, group_count, group_colour)
+
+    if not groups:
+        return (0, 0, 0)
 
-    # Sum up colors from all edges
-    ungrouped_colors.sort(key=operator.itemgetter(1))
-    most_used = group_colors(ungrouped_colors)
-    return [color * 257 for color in most_used]
+    most_used = None
+    most_pixels = 0
+    for rounded in sorted(groups):
+        total, count, colour = groups[rounded]
+        if total > most_pixels:
+            most_used, most_pixels = colour, total
+
+    return [colour_value * 257 for colour_value in most_used]
 
 def pil_to_pixbuf(image):
     """Return a pixbuf created from the PIL <image>."""
@@ -250,6 +249,14 @@ def pixbuf_to_pil(pixbuf):
     mode = pixbuf.get_has_alpha() and 'RGBA' or 'RGB'
     return Image.frombuffer(mode, dimensions, pixels, 'raw', mode, stride, 1)
 
+def get_histogram(pixbuf):
+    """ Returns the histogram of <pixbuf> like PIL's Image.histogram(),
+    i.e. a list of 256 pixel counts per channel. """
+    if pixbuf_array.is_available():
+        return pixbuf_array.get_histogram(pixbuf_array.pixbuf_to_array(pixbuf))
+    else:
+        return pixbuf_to_pil(pixbuf).histogram()
+
 def load_pixbuf(path):
     """ Loads a pixbuf from a given image file. Works around GTK's
     slowness on Win32 by using PIL for loading instead and
@@ -262,12 +269,48 @@ def load_pixbuf(path):
 
 def load_pixbuf_size(path, width, height):
     """ Loads a pixbuf from a given image file and scale it to fit
-    inside (width, height). """
+    inside (width, height). Images are decoded at reduced resolution
+    when the format allows it (e.g. JPEG DCT scaling), which is much
+    faster than decoding the full image first. """
     try:
-        return fit_in_rectangle(load_pixbuf(path), width, height)
+        if sys.platform == 'win32' and gtk.gtk_version > (2, 18, 2):
+            pil_img = Image.open(path)
+            # Only has an effect on JPEG images, which are then decoded
+            # at the smallest scale that is still larger than requested.
+            pil_img.draft(pil_img.mode, (width, height))
+            pixbuf = pil_to_pixbuf(pil_img)
+        else:
+            pixbuf = _load_pixbuf_reduced(path, width, height)
+        return fit_in_rectangle(pixbuf, width, height)
     except:
         return None
 
+def _load_pixbuf_reduced(path, width, height):
+    """ Loads a pixbuf from a given image file, letting the pixbuf loader
+    scale it down to fit inside (width, height) while decoding. """
+
+    def size_prepared(loader, src_width, src_height):
+        if src_width <= width and src_height <= height:
+            return
+        if float(src_width) / width > float(src_height) / height:
+            loader.set_size(width, int(max(src_height * width / src_width, 1)))
+        else:
+            loader.set_size(int(max(src_width * height / src_height, 1)), height)
+
+    loader = gtk.gdk.PixbufLoader()
+    loader.connect('size-prepared', size_prepared)
+    fp = open(path, 'rb')
+    try:
+        while True:
+            data = fp.read(65536)
+            if not data:
+                break
+            loader.write(data)
+    finally:
+        fp.close()
+        loader.close()
+    return loader.get_pixbuf()
+
 def load_pixbuf_data(imgdata):
     """ Loads a pixbuf from the data passed in <imgdata>. """
     loader = gtk.gdk.PixbufLoader()
@@ -280,22 +323,159 @@ def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
     """Return a modified pixbuf from <pixbuf> where the enhancement operations
     corresponding to each argument has been performed. A value of 1.0 means
     no change. If <autocontrast> is True it overrides the <contrast> value,
-    but only if the image mode is supported by ImageOps.autocontrast (i.e.
-    it is L or RGB.)
+    but only if the image has no alpha channel, like ImageOps.autocontrast.
+
+    Brightness, contrast and autocontrast are combined into a single lookup
+    table, and sharpness is applied with a single filter, so that each is
+    one pass over the image. With NumPy, saturation is computed directly on
+    the pixels as well. The results match PIL's ImageEnhance, except that
+    contrast, saturation and sharpness may differ by one level, as the
+    greyscale conversion differs slightly between PIL versions and the
+    sharpness filter rounds only once.
     """
+    has_alpha = pixbuf.get_has_alpha()
+    autocontrast = autocontrast and not has_alpha
+    lut = None
+    if brightness != 1.0 or contrast != 1.0 or autocontrast:
+        lut = _get_enhance_lut(pixbuf, brightness, contrast, autocontrast)
+
+    if pixbuf_array.is_available():
+        array = None
+        if lut is not None:
+            array = pixbuf_array.apply_lut(
+                pixbuf_array.pixbuf_to_array(pixbuf), lut)
+        if saturation != 1.0:
+            if array is None:
+                array = pixbuf_array.pixbuf_to_array(pixbuf)
+            array = pixbuf_array.enhance_colour(array, saturation)
+        if array is not None:
+            pixbuf = pixbuf_array.array_to_pixbuf(array)
+        if sharpness != 1.0:
+            pixbuf = pil_to_pixbuf(_sharpen(pixbuf_to_pil(pixbuf), sharpness))
+        return pixbuf
+
+    if lut is None and saturation == 1.0 and sharpness == 1.0:
+        return pixbuf
+
     im = pixbuf_to_pil(pixbuf)
-    if brightness != 1.0:
-        im = ImageEnhance.Brightness(im).enhance(brightness)
-    if autocontrast and im.mode in ('L', 'RGB'):
-        im = ImageOps.autocontrast(im, cutoff=0.1)
-    elif contrast != 1.0:
-        im = ImageEnhance.Contrast(im).enhance(contrast)
+    if lut is not None:
+        im = im.point(lut)
     if saturation != 1.0:
         im = ImageEnhance.Color(im).enhance(saturation)
     if sharpness != 1.0:
-        im = ImageEnhance.Sharpness(im).enhance(sharpness)
+        im = _sharpen(im, sharpness)
     return pil_to_pixbuf(im)
 
+def _get_enhance_lut(pixbuf, brightness, contrast, autocontrast):
+    """ Returns a lookup table for Image.point() that has the same effect
+    as ImageEnhance.Brightness, followed by either ImageOps.autocontrast
+    or ImageEnhance.Contrast. The alpha band is not changed, as in PIL. """
+    bands = pixbuf.get_n_channels()
+    colour_bands = bands - 1 if pixbuf.get_has_alpha() else bands
+    brightness_lut = [_blend(0, value, brightness) for value in range(256)]
+    luts = [brightness_lut] * colour_bands
+
+    if autocontrast:
+        # Histograms of the image after adjusting the brightness.
+        histogram = get_histogram(pixbuf)
+        luts = []
+        for band in range(colour_bands):
+            band_histogram = [0] * 256
+            for value in range(256):
+                band_histogram[brightness_lut[value]] += \
+                    histogram[band * 256 + value]
+            contrast_lut = _get_autocontrast_lut(band_histogram)
+            luts.append([contrast_lut[value] for value in brightness_lut])
+    elif contrast != 1.0:
+        # ImageEnhance.Contrast blends with the mean of the greyscale image.
+        if brightness != 1.0:
+            mean = _get_mean_luma(pixbuf, _join_luts(luts, bands))
+        else:
+            mean = _get_mean_luma(pixbuf, None)
+        mean = int(mean + 0.5)
+        contrast_lut = [_blend(mean, value, contrast) for value in range(256)]
+        luts = [[contrast_lut[value] for value in brightness_lut]] * colour_bands
+
+    return _join_luts(luts, bands)
+
+def _join_luts(luts, bands):
+    """ Returns a lookup table for Image.point() with the tables in <luts>
+    for the first bands, and no change for the remaining bands. """
+    lut = []
+    for band_lut in luts:
+        lut.extend(band_lut)
+    for band in range(len(luts), bands):
+        lut.extend(range(256))
+    return lut
+
+def _get_mean_luma(pixbuf, lut):
+    """ Returns the mean of the greyscale version of <pixbuf> after
+    applying <lut>, if not None, like ImageStat of Image.convert('L'). """
+    if pixbuf_array.is_available():
+        array = pixbuf_array.pixbuf_to_array(pixbuf)
+        if lut is not None:
+            array = pixbuf_array.apply_lut(array, lut)
+        luma = pixbuf_array.get_luma(array)
+        return float(luma.sum()) / max(luma.size, 1)
+
+    im = pixbuf_to_pil(pixbuf)
+    if lut is not None:
+        im = im.point(lut)
+    histogram = im.convert('L').histogram()
+    return (sum(map(operator.mul, histogram, range(256))) /
+            float(max(sum(histogram), 1)))
+
+def _get_autocontrast_lut(histogram, cutoff=0.1):
+    """ Returns the lookup table ImageOps.autocontrast uses for a band with
+    <histogram>, ignoring <cutoff> percent of the lightest and darkest
+    pixels. """
+    histogram = list(histogram)
+    pixels = sum(histogram)
+    for values in (range(256), reversed(range(256))):
+        cut = pixels * cutoff // 100
+        for value in values:
+            if cut <= 0:
+                break
+            removed = min(cut, histogram[value])
+            histogram[value] -= removed
+            cut -= removed
+
+    used = [value for value in range(256) if histogram[value]]
+    if not used or used[-1] <= used[0]:
+        return range(256)
+
+    low, high = used[0], used[-1]
+    scale = 255.0 / (high - low)
+    offset = -low * scale
+    return [min(max(int(value * scale + offset), 0), 255)
+            for value in range(256)]
+
+def _blend(value1, value2, factor):
+    """ Returns the result of Image.blend() for two channel values. PIL
+    computes in single precision and truncates the result. """
+    factor = _float32(factor)
+    result = _float32(value1 + _float32(factor * (value2 - value1)))
+    return min(max(int(result), 0), 255)
+
+def _float32(value):
+    """ Rounds <value> to single precision. """
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+def _sharpen(im, factor):
+    """ Returns the PIL image <im> with the same effect as
+    ImageEnhance.Sharpness, which blends <im> with a smoothed copy. Both
+    steps are combined into a single filter. """
+    # Weights of ImageFilter.SMOOTH, blended with the unchanged pixel.
+    side = (1.0 - factor) / 13
+    kernel = [side] * 9
+    kernel[4] = factor + 5 * side
+    if 'A' in im.getbands():
+        alpha = im.split()[3]
+        im = im.filter(ImageFilter.Kernel((3, 3), kernel, scale=1))
+        im.putalpha(alpha)
+        return im
+    return im.filter(ImageFilter.Kernel((3, 3), kernel, scale=1))
+
 
 def get_implied_rotation(pixbuf):
     """Return the implied rotation of the pixbuf, as given by the pixbuf's
@@ -0,0 +1,134 @@
+"""indexer.py - Builds covers and thumbnails ahead of time, without GUI."""
+
+import os
+import itertools
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from mcomix.preferences import prefs
+from mcomix import i18n
+from mcomix import archive_tools
+from mcomix import image_tools
+from mcomix import thumbnail_tools
+from mcomix import log
+from mcomix.library import backend
+from mcomix.library import cover_pack
+
+
+def find_files(paths):
+    """ Returns a sorted list of all archives and images in <paths>.
+    Directories are searched recursively. """
+    archive_re = archive_tools.get_supported_archive_regex()
+    found = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    if (archive_re.search(filename) or
+                        image_tools.is_image_file(filename)):
+                        found.add(os.path.join(dirpath, filename))
+        elif os.path.isfile(path):
+            found.add(path)
+
+    return sorted(found)
+
+def get_library_files():
+    """ Returns the paths of all books in the library that exist. """
+    return sorted([path for path in _get_library_paths()
+                   if os.path.isfile(path)])
+
+def _get_library_paths():
+    """ Returns the paths of all books in the library. """
+    library = backend.LibraryBackend()
+    if not library.enabled:
+        return []
+
+    paths = [library.get_book_path(book)
+             for book in library.get_books_in_collection()]
+    return [path for path in paths if path]
+
+def index(args, jobs=None):
+    """ Creates the library cover and the normal thumbnail for every file
+    found in <args> (see L{find_files}), or for every book in the library
+    if <args> is empty, using <jobs> processes (one per CPU if None).
+    Without the multiprocessing module, files are indexed one by one.
+
+    Covers and thumbnails that are still up to date are skipped, so an
+    interrupted run resumes where it stopped. Returns the number of files
+    that could not be indexed. """
+    pool = None
+    if multiprocessing is not None and jobs != 1:
+        # The library is only opened after the worker processes have
+        # been started, so that they do not inherit its connection.
+        pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count(),
+                                    _init_worker, (dict(prefs), log.getLevel()))
+
+    failed = 0
+    try:
+        if args:
+            paths = find_files(args)
+        else:
+            paths = get_library_files()
+
+        total = len(paths)
+        if total == 0:
+            log.print_(_('Nothing to index.'))
+            return failed
+
+        if pool is None:
+            results = itertools.imap(_index_file, paths)
+        else:
+            results = pool.imap_unordered(_index_file, paths, chunksize=4)
+        for count, (path, success) in enumerate(results):
+            if not success:
+                failed += 1
+                log.warning(_('! Could not index "%s"'), path)
+            log.print_('[%d/%d] %s' % (count + 1, total, path))
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    cover_pack.CoverPack().compact(_get_library_paths())
+    return failed
+
+def _init_worker(saved_prefs, level):
+    """ Sets up a worker process with the preferences <saved_prefs> and
+    log level <level> of the main process. Worker processes are not
+    forked on all platforms, so they cannot rely on inheriting them. """
+    prefs.update(saved_prefs)
+    i18n.install_gettext()
+    log.setLevel(level)
+
+def _index_file(path):
+    """ Creates the covers and thumbnails for <path>. Runs in a worker
+    process. Returns a tuple (path, success). """
+    try:
+        success = True
+        if archive_tools.archive_mime_type(path) is not None:
+            covers = cover_pack.CoverPack()
+            if not covers.has_cover(path):
+                success = covers.get_cover(path) is not None
+
+        if prefs['create thumbnails']:
+            thumbnailer = thumbnail_tools.Thumbnailer()
+            thumbnailer.set_size(128, 128)
+            thumbnailer.set_store_on_disk(True)
+            if not thumbnailer._thumbnail_exists(path):
+                success = (thumbnailer._create_thumbnail(path) is not None
+                           and success)
+        return path, success
+
+    except Exception, ex:
+        log.debug(u'Indexing "%s" failed: %s', path, ex)
+        return path, False
+
+# vim: expandtab:sw=4:ts=4
@@ -1,14 +1,28 @@
 """library_add_progress_dialog.py - Progress bar for the library."""
 
 import gtk
+import gobject
 import pango
+import time
+import threading
+import itertools
+import multiprocessing
 
+from mcomix import archive_tools
 from mcomix import labels
+from mcomix import log
 
 _dialog = None
 # The "All books" collection is not a real collection stored in the library,
 # but is represented by this ID in the library's TreeModels.
 _COLLECTION_ALL = -1
+#: Maximum number of books written to the library in one transaction.
+BATCH_SIZE = 200
+#: Seconds between two progress updates.
+UPDATE_INTERVAL = 0.25
+#: Fewer books than this are read in-process, since starting a pool of
+#: processes would take longer than reading them.
+MIN_POOL_PATHS = 16
 
 class _AddLibraryProgressDialog(gtk.Dialog):
 
@@ -56,30 +70,96 @@ class _AddLibraryProgressDialog(gtk.Dialog):
         main_box.pack_start(added_label, False, False)
         self.show_all()
 
-        total_paths_int = len(paths)
-        total_paths_float = float(len(paths))
-        total_added = 0
-
-        for path in paths:
-
-            if library.backend.add_book(path, collection):
-                total_added += 1
-
-                number_label.set_text('%d / %d' % (total_added, total_paths_int))
-
-            added_label.set_text(_("Adding '%s'...") % path)
-            bar.set_fraction(total_added / total_paths_float)
-
-            while gtk.events_pending():
-                gtk.main_iteration(False)
-
-            if self._destroy:
-                return
-
-        self._response()
+        self._library = library
+        self._collection = collection
+        self._number_label = number_label
+        self._bar = bar
+        self._added_label = added_label
+        self._total = len(paths)
+        self.connect('destroy', self._stop)
+
+        # The pool is started here, before the import thread, since forking
+        # from a helper thread of the GTK process could deadlock.
+        pool = None
+        if len(paths) >= MIN_POOL_PATHS:
+            try:
+                pool = multiprocessing.Pool(multiprocessing.cpu_count())
+            except Exception, e:
+                log.warning(_('! Could not start worker processes: %s'), e)
+
+        thread = threading.Thread(target=self._add_books, args=(paths, pool))
+        thread.name += '-library-import'
+        thread.start()
+
+    def _add_books(self, paths, pool):
+        """ Reads the archive information for <paths>, in <pool> unless it
+        is None, and adds the books in batches to the library. Only the
+        progress display is updated in the main thread. Runs in its own
+        thread, which writes with its own library connection. """
+        backend = self._library.backend
+        try:
+            if pool is None:
+                results = itertools.imap(_get_book_info, paths)
+            else:
+                results = pool.imap_unordered(_get_book_info, paths,
+                                              chunksize=8)
+            batch = []
+            processed = added = 0
+            last_update = time.time()
+            for result in results:
+                if self._destroy:
+                    break
+                batch.append(result)
+                if (len(batch) >= BATCH_SIZE or
+                    time.time() - last_update >= UPDATE_INTERVAL):
+                    added += backend.add_books(batch, self._collection)
+                    processed += len(batch)
+                    gobject.idle_add(self._update_progress, processed, added,
+                                     batch[-1][0])
+                    batch = []
+                    last_update = time.time()
+            else:
+                if batch:
+                    added += backend.add_books(batch, self._collection)
+        except Exception, e:
+            log.error(_('! Could not read books: %s'), e)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # Always close the dialog, even if reading failed.
+            gobject.idle_add(self._response)
+
+    def _update_progress(self, processed, added, path):
+        """ Shows that <added> of <processed> books have been added so far,
+        <path> being the last one. Runs in the main thread. """
+        if self._destroy:
+            return 0
+
+        self._number_label.set_text('%d / %d' % (added, self._total))
+        self._added_label.set_text(_("Adding '%s'...") % path)
+        self._bar.set_fraction(processed / float(max(self._total, 1)))
+
+        # Remove this idle handler.
+        return 0
+
+    def _stop(self, *args):
+        self._destroy = True
 
     def _response(self, *args):
         self._destroy = True
         self.destroy()
 
+        # Remove this idle handler when called through gobject.idle_add.
+        return 0
+
+def _get_book_info(path):
+    """ Returns a tuple (path, info) for the archive at <path>, <info>
+    being the result of L{archive_tools.get_archive_info}. Runs in a
+    worker process. """
+    try:
+        return path, archive_tools.get_archive_info(path)
+    except Exception:
+        return path, None
+
 # vim: expandtab:sw=4:ts=4
@@ -1,14 +1,19 @@
 """library_backend.py - Comic book library backend using sqlite."""
 
+from __future__ import with_statement
+
 import os
+import re
 import datetime
+import threading
 
 from mcomix import archive_tools
 from mcomix import constants
-from mcomix import thumbnail_tools
 from mcomix import log
 from mcomix import callback
+from mcomix import natural_sort
 from mcomix.library import backend_types
+from mcomix.library import cover_pack
 # Only for importing legacy data from last-read module
 from mcomix import last_read_page
 
@@ -23,7 +28,14 @@ except ImportError:
 
 
 #: Identifies the 'Recent' collection that stores recently read books.
-COLLECTION_RECENT = -2
+COLLECTION_RECENT = constants.COLLECTION_RECENT
+
+#: Recursive queries (common table expressions) require SQLite 3.8.3.
+_RECURSIVE_QUERIES = (dbapi2 is not None and
+                      dbapi2.sqlite_version_info >= (3, 8, 3))
+
+#: Splits filter strings into the words looked up in the search index.
+_SEARCH_TOKEN_SPLITTER = re.compile(r'[\W_]+', re.UNICODE)
 
 
 class _LibraryBackend:
@@ -34,60 +46,119 @@ class _LibraryBackend:
 
     #: Current version of the library database structure.
     # See method _upgrade_database() for changes between versions.
-    DB_VERSION = 6
+    DB_VERSION = 8
 
     def __init__(self):
 
-        def row_factory(cursor, row):
-            """Return rows as sequences only when they have more than
-            one element.
-            """
-            if len(row) == 1:
-                return row[0]
-            return row
+        #: Holds the database connection of each thread.
+        self._local = threading.local()
+        #: Maps each thread to its database connection, for closing them.
+        self._connections = {}
+        self._connections_lock = threading.Lock()
 
         if dbapi2 is not None:
-            self._con = dbapi2.connect(constants.LIBRARY_DATABASE_PATH,
-                check_same_thread=False, isolation_level=None)
-            self._con.row_factory = row_factory
+            # With a write-ahead log, readers do not block writers and
+            # vice versa. The journal mode is stored in the database.
+            self._con.execute('pragma journal_mode = wal').fetchone()
             self.enabled = True
 
             self.watchlist = backend_types._WatchList(self)
 
             version = self._library_version()
             self._upgrade_database(version, _LibraryBackend.DB_VERSION)
+            #: True if the full-text search index 'book_fts' is available.
+            self._search_index = self._create_search_index()
         else:
-            self._con = None
             self.watchlist = None
             self.enabled = False
+            self._search_index = False
+
+    def _get_connection(self):
+        """Return the database connection of the calling thread, which
+        is opened on first use. Connections are in auto-commit mode unless
+        L{begin_transaction} has been called by the same thread.
+        """
+        if dbapi2 is None:
+            return None
+
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            # check_same_thread is disabled to allow closing connections
+            # from other threads, e.g. when they are garbage collected.
+            con = dbapi2.connect(constants.LIBRARY_DATABASE_PATH,
+                check_same_thread=False, isolation_level=None, timeout=30)
+            con.row_factory = _row_factory
+            # In WAL mode, this only risks losing the most recent
+            # transactions on power failure, never corrupts the database.
+            con.execute('pragma synchronous = normal')
+            self._local.con = con
+
+            with self._connections_lock:
+                # Close the connections of threads that have ended.
+                for thread in self._connections.keys():
+                    if not thread.isAlive():
+                        self._connections.pop(thread).close()
+                self._connections[threading.currentThread()] = con
+        return con
+
+    _con = property(_get_connection)
 
     def get_books_in_collection(self, collection=None, filter_string=None):
         """Return a sequence with all the books in <collection>, or *ALL*
         books if <collection> is None. If <filter_string> is not None, we
-        only return books where the <filter_string> occurs in the path.
+        only return books matching <filter_string> (see L{get_filter_query}).
         """
         if collection is None:
             if filter_string is None:
                 cur = self._con.execute('''select id from Book''')
             else:
+                condition, args = self.get_filter_query(filter_string)
                 cur = self._con.execute('''select id from Book
-                    where path like ?''', ("%%%s%%" % filter_string, ))
+                    where %s''' % condition, args)
 
             return cur.fetchall()
         else:
-            books = []
-            subcollections = self.get_all_collections_in_collection(collection)
-            for coll in [ collection ] + subcollections:
-                if filter_string is None:
-                    cur = self._con.execute('''select id from Book
-                        where id in (select book from Contain where collection = ?)
-                        ''', (coll,))
-                else:
-                    cur = self._con.execute('''select id from Book
-                        where id in (select book from Contain where collection = ?)
-                        and path like ?''', (coll, "%%%s%%" % filter_string))
-                books.extend(cur.fetchall())
-            return books
+            subtree, args = self.get_subcollections_query(collection)
+            sql = '''select id from Book where id in
+                (select book from Contain where collection in (%s))''' % subtree
+            if filter_string is not None:
+                condition, filter_args = self.get_filter_query(filter_string)
+                sql += ''' and %s''' % condition
+                args += filter_args
+
+            return self._con.execute(sql, args).fetchall()
+
+    def get_filter_query(self, filter_string):
+        """Return a tuple (sql, args) with a condition on the table Book
+        that selects the books matching <filter_string>.
+
+        Every word of <filter_string> must occur in the name or the path of
+        the book. With the full-text search index, words must match the
+        beginning of a word in the name or a path component.
+        """
+        words = [word.lower() for word in
+                 _SEARCH_TOKEN_SPLITTER.split(filter_string) if word]
+        if not words:
+            return ('1', ())
+
+        if self._search_index:
+            # Words without column filter match both the name and the path.
+            return ('''Book.id in (select rowid from book_fts
+                where book_fts match ?)''',
+                (' '.join([word + '*' for word in words]),))
+
+        # The name is part of the path, so only the path has to be searched.
+        return (' and '.join(['Book.path like ?'] * len(words)),
+                tuple(["%%%s%%" % word for word in words]))
+
+    def book_matches_filter(self, book, filter_string):
+        """Return True if the book with ID <book> matches <filter_string>,
+        by the same rule as L{get_filter_query}.
+        """
+        condition, args = self.get_filter_query(filter_string)
+        cur = self._con.execute('''select count(*) from Book
+            where id = ? and %s''' % condition, (book,) + tuple(args))
+        return cur.fetchone() > 0
 
     def get_book_by_path(self, path):
         """ Retrieves a book from the library, specified by C{path}.
@@ -153,16 +224,18 @@ class _LibraryBackend:
         """ Returns a pixbuf with a thumbnail of the cover of the book at <path>,
         or None, if no thumbnail could be generated. """
 
-        thumbnailer = thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH)
-        thumbnailer.set_store_on_disk(True)
-        # This is the maximum image size allowed by the library, so that thumbnails might be downscaled,
-        # but never need to be upscaled (and look ugly)
-        thumbnailer.set_size(constants.MAX_LIBRARY_COVER_SIZE, constants.MAX_LIBRARY_COVER_SIZE)
-        thumb = thumbnailer.thumbnail(path)
+        thumb = cover_pack.CoverPack().get_cover(path)
 
         if thumb is None: log.warning( _('! Could not get cover for book "%s"'), path )
         return thumb
 
+    def get_last_read_pages(self):
+        """Return a dictionary mapping the IDs of all recently read books
+        to the page that was last read.
+        """
+        cur = self._con.execute('''select book, page from Recent''')
+        return dict(cur.fetchall())
+
     def get_book_name(self, book):
         """Return the name of <book>, or None if <book> isn't in the
         library.
@@ -220,6 +293,12 @@ class _LibraryBackend:
 
         if collection is None: raise ValueError("Collection must not be <None>")
 
+        if _RECURSIVE_QUERIES:
+            subtree, args = self.get_subcollections_query(collection)
+            cur = self._con.execute('''select id from Collection
+                where id in (%s) and id != ?''' % subtree, args + (collection,))
+            return cur.fetchall()
+
         to_search = [ collection ]
         collections = [ ]
         # This assumes that the library is built like a tree, so no circular references.
@@ -231,6 +310,24 @@ class _LibraryBackend:
 
         return collections
 
+    def get_subcollections_query(self, collection):
+        """Return a tuple (sql, args) with a query that selects the IDs
+        of <collection> and all collections below it. The query is meant
+        to be used as sub-query, e.g. in C{where collection in (sql)}.
+        """
+        if _RECURSIVE_QUERIES:
+            # 'union' instead of 'union all' stops at circular references.
+            return ('''with recursive subtree(id) as (
+                select ?
+                union
+                select Collection.id from Collection
+                join subtree on Collection.supercollection = subtree.id)
+                select id from subtree''', (collection,))
+
+        collections = ([ collection ] +
+            self.get_all_collections_in_collection(collection))
+        return (', '.join(['?'] * len(collections)), tuple(collections))
+
     def get_all_collections(self):
         """Return a sequence with all collections (flattened hierarchy).
         The sequence is sorted alphabetically by collection name.
@@ -303,10 +400,30 @@ class _LibraryBackend:
         added).
         """
         path = os.path.abspath(path)
-        name = os.path.basename(path)
         info = archive_tools.get_archive_info(path)
+        return self._add_book(path, info, collection)
+
+    def add_books(self, books, collection=None):
+        """Add several books to the library in a single transaction.
+        <books> is a sequence of (path, info) tuples, <info> being the
+        result of L{archive_tools.get_archive_info} for <path>. If
+        <collection> is not None, the books are also put in it.
+        Return the number of books that were successfully added.
+        """
+        added = 0
+        self.begin_transaction()
+        try:
+            for path, info in books:
+                if self._add_book(os.path.abspath(path), info, collection):
+                    added += 1
+        finally:
+            self.end_transaction()
+        return added
+
+    def _add_book(self, path, info, collection):
         if info is None:
             return False
+        name = os.path.basename(path)
         format, pages, size = info
 
         # Thumbnail for the newly added book will be generated once it
@@ -315,18 +432,25 @@ class _LibraryBackend:
             where path = ?''', (path,)).fetchone()
         try:
             cursor = self._con.cursor()
+            sort_name = natural_sort.sort_string(name)
+            sort_path = natural_sort.sort_string(path)
             if old is not None:
                 cursor.execute('''update Book set
-                    name = ?, pages = ?, format = ?, size = ?
-                    where path = ?''', (name, pages, format, size, path))
+                    name = ?, pages = ?, format = ?, size = ?,
+                    sort_name = ?, sort_path = ?
+                    where path = ?''', (name, pages, format, size,
+                    sort_name, sort_path, path))
                 book_id = old
             else:
                 cursor.execute('''insert into Book
-                    (name, path, pages, format, size)
-                    values (?, ?, ?, ?, ?)''',
-                    (name, path, pages, format, size))
+                    (name, path, pages, format, size, sort_name, sort_path)
+                    values (?, ?, ?, ?, ?, ?, ?)''',
+                    (name, path, pages, format, size, sort_name, sort_path))
                 book_id = cursor.lastrowid
 
+            self._update_search_index(book_id, name, path)
+
+            if old is None:
                 book = backend_types._Book(book_id, name, path, pages,
                         format, size, datetime.datetime.now().isoformat())
                 self.book_added(book)
@@ -358,6 +482,15 @@ class _LibraryBackend:
         """
         pass
 
+    @callback.Callback
+    def last_read_page_changed(self, book, page):
+        """ Event that triggers when the last read page of a book is
+        stored or cleared.
+        @param book: L{_Book} instance.
+        @param page: Page number, or None if the page was cleared.
+        """
+        pass
+
 
     def add_collection(self, name):
         """Add a new collection with <name> to the library. Return True
@@ -457,10 +590,11 @@ class _LibraryBackend:
         """Remove the <book> from the library."""
         path = self.get_book_path(book)
         if path is not None:
-            thumbnailer = thumbnail_tools.Thumbnailer(dst_dir=constants.LIBRARY_COVERS_PATH)
-            thumbnailer.delete(path)
+            cover_pack.CoverPack().remove(path)
         self._con.execute('delete from Book where id = ?', (book,))
         self._con.execute('delete from Contain where book = ?', (book,))
+        if self._search_index:
+            self._con.execute('delete from book_fts where rowid = ?', (book,))
 
     def remove_collection(self, collection):
         """Remove the <collection> (sans books) from the library."""
@@ -485,24 +619,75 @@ class _LibraryBackend:
     def begin_transaction(self):
         """ Normally, the connection is in auto-commit mode. Calling
         this method will switch to transactional mode, automatically
-        starting a transaction when a DML statement is used. """
-        self._con.isolation_level = 'IMMEDIATE'
+        starting a transaction when a DML statement is used.
+        Transactions belong to the calling thread and can be nested, only
+        the outermost call to L{end_transaction} commits. """
+        depth = getattr(self._local, 'transaction_depth', 0)
+        if depth == 0:
+            self._con.isolation_level = 'IMMEDIATE'
+        self._local.transaction_depth = depth + 1
 
     def end_transaction(self):
         """ Commits any changes to the database and switches back
         to auto-commit mode. """
-        self._con.commit()
-        self._con.isolation_level = None
+        depth = self._local.transaction_depth - 1
+        self._local.transaction_depth = depth
+        if depth == 0:
+            self._con.commit()
+            self._con.isolation_level = None
 
     def close(self):
-        """Commit changes and close cleanly."""
-        if self._con is not None:
-            self._con.commit()
-            self._con.close()
+        """Commit changes and close the connections of all threads cleanly.
+        The last connection to be closed checkpoints the write-ahead log.
+        """
+        with self._connections_lock:
+            for con in self._connections.values():
+                con.commit()
+                con.close()
+            self._connections.clear()
+        self._local.con = None
 
         global _backend
         _backend = None
 
+    def _update_search_index(self, book, name, path):
+        """Store <name> and <path> of <book> in the search index."""
+        if self._search_index:
+            self._con.execute('delete from book_fts where rowid = ?', (book,))
+            self._con.execute('''insert into book_fts (rowid, name, path)
+                values (?, ?, ?)''', (book, name, path))
+
+    def _create_search_index(self):
+        """Create and fill the full-text search index for book names and
+        paths if it does not exist yet. FTS5 is preferred over FTS4.
+        Returns False if SQLite supports neither.
+
+        The index is not part of the regular database structure, since the
+        available modules depend on how SQLite was built.
+        """
+        try:
+            if self._table_exists('book_fts'):
+                return True
+        except dbapi2.Error:
+            # The index exists, but its module is not available.
+            return False
+
+        for module in ('fts5', 'fts4'):
+            try:
+                self._con.execute('''create virtual table book_fts
+                    using %s (name, path)''' % module)
+                break
+            except dbapi2.Error:
+                pass
+        else:
+            log.debug('Full-text search is not available, '
+                      'library filtering will scan all books.')
+            return False
+
+        self._con.execute('''insert into book_fts (rowid, name, path)
+            select id, name, path from Book''')
+        return True
+
     def _table_exists(self, table):
         """ Checks if C{table} exists in the database. """
         cursor = self._con.cursor()
@@ -546,6 +731,8 @@ class _LibraryBackend:
         self._create_table_info()
         self._create_table_watchlist()
         self._create_table_recent()
+        self._create_indexes()
+        self._create_book_sort_indexes()
 
     def _upgrade_database(self, from_version, to_version):
         """ Performs sequential upgrades to the database, bringing
@@ -614,6 +801,29 @@ class _LibraryBackend:
                     select id, name, supercollection from collection_old''')
                 self._con.execute('''drop table collection_old''')
 
+            if 6 in upgrades:
+                # Added indexes for looking up collection contents.
+                self._create_indexes()
+
+            if 7 in upgrades:
+                # Added fields 'sort_name' and 'sort_path' to table 'book'.
+                # Earlier upgrade steps might have re-created the table
+                # with these fields already.
+                columns = [row[1] for row in
+                           self._con.execute('pragma table_info(book)')]
+                for column in ('sort_name', 'sort_path'):
+                    if column not in columns:
+                        self._con.execute('''alter table book
+                            add column %s text''' % column)
+                books = self._con.execute('''select id, name, path from book
+                    where sort_name is null or sort_path is null''').fetchall()
+                self._con.executemany('''update book
+                    set sort_name = ?, sort_path = ? where id = ?''',
+                    [(natural_sort.sort_string(name),
+                      natural_sort.sort_string(path), id)
+                     for id, name, path in books])
+                self._create_book_sort_indexes()
+
             self._con.execute('''update info set value = ? where key = 'version' ''',
                               (str(_LibraryBackend.DB_VERSION),))
 
@@ -625,7 +835,15 @@ class _LibraryBackend:
             pages integer,
             format integer,
             size integer,
-            added datetime default current_timestamp)''')
+            added datetime default current_timestamp,
+            sort_name text,
+            sort_path text)''')
+
+    def _create_book_sort_indexes(self):
+        self._con.execute('''create index if not exists book_sort_name
+            on book (sort_name)''')
+        self._con.execute('''create index if not exists book_sort_path
+            on book (sort_path)''')
 
     def _create_table_collection(self):
         self._con.execute('''create table if not exists collection (
@@ -661,6 +879,23 @@ class _LibraryBackend:
         self._con.execute('''insert or ignore into collection (id, name)
             values (?, ?)''', (COLLECTION_RECENT, _('Recent')))
 
+    def _create_indexes(self):
+        self._con.execute('''create index if not exists contain_book
+            on contain (book)''')
+        self._con.execute('''create index if not exists collection_supercollection
+            on collection (supercollection)''')
+        self._con.execute('''create index if not exists book_added
+            on book (added)''')
+
+
+def _row_factory(cursor, row):
+    """Return rows as sequences only when they have more than
+    one element.
+    """
+    if len(row) == 1:
+        return row[0]
+    return row
+
 
 _backend = None
 
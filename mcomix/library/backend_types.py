@@ -1,11 +1,22 @@
 """ Data class for library books and collections. """
 
 import os
+import time
 import threading
 import datetime
 
+from mcomix.preferences import prefs
 from mcomix import callback
 from mcomix import archive_tools
+from mcomix import constants
+
+#: Condition on the table book that selects the books that are in the
+#: library. Books that are only in the Recent collection are not.
+_LIBRARY_BOOK_CONDITION = '''NOT EXISTS (SELECT 1 FROM contain
+                          WHERE contain.book = book.id)
+    OR EXISTS (SELECT 1 FROM contain
+               WHERE contain.book = book.id
+               AND contain.collection != %d)''' % constants.COLLECTION_RECENT
 
 
 class _BackendObject(object):
@@ -103,6 +114,7 @@ class _Book(_BackendObject):
                            (self.id, page, time))
 
         cursor.close()
+        self.get_backend().last_read_page_changed(self, page)
 
 
 class _Collection(_BackendObject):
@@ -128,31 +140,36 @@ class _Collection(_BackendObject):
         else:
             return False
 
-    def get_books(self, filter_string=None):
+    def get_books(self, filter_string=None, offset=0, limit=None):
         """ Returns all books that are part of this collection,
-        including subcollections. """
-
-        books = []
-        for collection in [ self ] + self.get_all_collections():
-            sql = '''SELECT book.id, book.name, book.path, book.pages, book.format,
-                            book.size, book.added
-                     FROM book
-                     JOIN contain ON contain.book = book.id
-                                     AND contain.collection = ?
-                  '''
-
-            sql_args = [collection.id]
-            if filter_string:
-                sql += ''' WHERE book.name LIKE '%' || ? || '%' '''
-                sql_args.append(filter_string)
-
-            cursor = self.get_backend().execute(sql, sql_args)
-            rows = cursor.fetchall()
-            cursor.close()
+        including subcollections. If C{limit} is not None, at most
+        C{limit} books are returned, starting with the book at C{offset}
+        in the current sort order. """
+
+        subtree, sql_args = self.get_backend().get_subcollections_query(self.id)
+        sql = '''SELECT book.id, book.name, book.path, book.pages, book.format,
+                        book.size, book.added
+                 FROM book
+                 WHERE book.id IN (SELECT book FROM contain
+                                   WHERE collection IN (%s))
+              ''' % subtree
 
-            books.extend([ _Book(*cols) for cols in rows ])
+        sql_args = list(sql_args)
+        if filter_string:
+            condition, filter_args = \
+                self.get_backend().get_filter_query(filter_string)
+            sql += ''' AND %s ''' % condition
+            sql_args.extend(filter_args)
+        sql += _get_order_clause()
+        if limit is not None:
+            sql += ''' LIMIT ? OFFSET ?'''
+            sql_args.extend((limit, offset))
 
-        return books
+        cursor = self.get_backend().execute(sql, sql_args)
+        rows = cursor.fetchall()
+        cursor.close()
+
+        return [ _Book(*cols) for cols in rows ]
 
     def get_collections(self):
         """ Returns a list of all direct subcollections of this instance. """
@@ -200,8 +217,9 @@ class _DefaultCollection(_Collection):
         self.name = _("All books")
         self.supercollection = None
 
-    def get_books(self, filter_string=None):
-        """ Returns all books in the library """
+    def get_books(self, filter_string=None, offset=0, limit=None):
+        """ Returns all books in the library, or the C{limit} books
+        starting at C{offset} if C{limit} is not None. """
         sql = '''SELECT book.id, book.name, book.path, book.pages, book.format,
                         book.size, book.added
                  FROM book
@@ -209,8 +227,14 @@ class _DefaultCollection(_Collection):
 
         sql_args = []
         if filter_string:
-            sql += ''' WHERE book.name LIKE '%' || ? || '%' '''
-            sql_args.append(filter_string)
+            condition, filter_args = \
+                self.get_backend().get_filter_query(filter_string)
+            sql += ''' WHERE %s ''' % condition
+            sql_args.extend(filter_args)
+        sql += _get_order_clause()
+        if limit is not None:
+            sql += ''' LIMIT ? OFFSET ?'''
+            sql_args.extend((limit, offset))
 
         cursor = self.get_backend().execute(sql, sql_args)
         rows = cursor.fetchall()
@@ -298,22 +322,36 @@ class _WatchList(object):
         else:
             raise ValueError("Watchlist entry doesn't exist")
 
-    def scan_for_new_files(self):
+    def scan_for_new_files(self, report_empty=True):
         """ Begins scanning for new files in the watched directories.
         When the scan finishes, L{new_files_found} will be called
-        asynchronously. """
-        thread = threading.Thread(target=self._scan_for_new_files_thread)
+        asynchronously. If C{report_empty} is False, it is only called
+        for directories that contain new files. """
+        thread = threading.Thread(target=self._scan_for_new_files_thread,
+                                  args=(report_empty,))
         thread.name += '-scan_for_new_files'
         thread.start()
 
-    def _scan_for_new_files_thread(self):
+    def _scan_for_new_files_thread(self, report_empty):
         """ Executes the actual scanning operation in a new thread. """
-        existing_books = [book.path for book in DefaultCollection.get_books()
-                          # Also add book if it was only found in Recent collection
-                          if book.get_collections() != [-2]]
+        # Also add book if it was only found in Recent collection
+        cursor = self.backend.execute('''SELECT path FROM book
+            WHERE %s''' % _LIBRARY_BOOK_CONDITION)
+        existing_books = cursor.fetchall()
+        cursor.close()
         for entry in self.get_watchlist():
             new_files = entry.get_new_files(existing_books)
-            self.new_files_found(new_files, entry)
+            if new_files or report_empty:
+                self.new_files_found(new_files, entry)
+
+    def is_new_file(self, path):
+        """ Returns True if the book at C{path} is not in the library yet,
+        by the same rule as L{scan_for_new_files}. """
+        cursor = self.backend.execute('''SELECT 1 FROM book
+            WHERE path = ? AND (%s)''' % _LIBRARY_BOOK_CONDITION, (path,))
+        found = cursor.fetchone()
+        cursor.close()
+        return found is None
 
     def _result_row_to_watchlist_entry(self, row):
         """ Converts the result of a SELECT statement to a WatchListEntry. """
@@ -352,21 +390,9 @@ class _WatchListEntry(_BackendObject):
             return []
 
         old_files = frozenset([os.path.abspath(path) for path in filelist])
+        available_files = list_archives(self.directory, self.recursive)
 
-        if not self.recursive:
-            available_files = frozenset([os.path.join(self.directory, filename)
-                for filename in os.listdir(self.directory)
-                if archive_tools.get_supported_archive_regex().search(filename)])
-        else:
-            available_files = []
-            for dirpath, dirnames, filenames in os.walk(self.directory):
-                for filename in filter(archive_tools.get_supported_archive_regex().search, filenames):
-                    path = os.path.join(dirpath, filename)
-                    available_files.append(path)
-
-            available_files = frozenset(available_files)
-
-        return list(available_files.difference(old_files))
+        return [path for path in available_files if path not in old_files]
 
     def is_valid(self):
         """ Check if the watched directory is a valid directory and exists. """
@@ -401,4 +427,90 @@ class _WatchListEntry(_BackendObject):
             self.recursive = recursive
 
 
+#: (directory path, recursive) => (modification time, archive paths,
+#: subdirectory paths) as found when the directory was last listed.
+_directory_cache = {}
+
+def list_archives(directory, recursive, directories=None):
+    """ Returns the paths of all supported archives in C{directory}, and
+    in its subdirectories if C{recursive} is True. Directories that have
+    not been modified since they were last listed are not listed again.
+    If C{directories} is a list, all visited directories are appended. """
+    archive_regex = archive_tools.get_supported_archive_regex()
+    archives = []
+    to_scan = [ directory ]
+    while len(to_scan) > 0:
+        dirpath = to_scan.pop()
+        entry = _list_directory(dirpath, archive_regex, recursive)
+        if entry is None:
+            continue
+        if directories is not None:
+            directories.append(dirpath)
+        archives.extend(entry[1])
+        if recursive:
+            to_scan.extend(entry[2])
+
+    return archives
+
+def _list_directory(dirpath, archive_regex, recursive):
+    """ Returns the cache entry for C{dirpath}, listing the directory
+    if it changed. Subdirectories are only looked for if C{recursive} is
+    True, otherwise entries are not stat'ed at all. Returns None if the
+    directory cannot be read. """
+    key = (dirpath, recursive)
+    try:
+        mtime = os.stat(dirpath).st_mtime
+    except OSError:
+        _directory_cache.pop(key, None)
+        return None
+
+    entry = _directory_cache.get(key)
+    if entry is not None and entry[0] == mtime:
+        return entry
+
+    try:
+        filenames = os.listdir(dirpath)
+    except OSError:
+        _directory_cache.pop(key, None)
+        return None
+
+    archives, subdirectories = [], []
+    for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        if not recursive:
+            if archive_regex.search(filename):
+                archives.append(path)
+        elif os.path.isdir(path):
+            # Like os.walk, symbolic links to directories are not
+            # followed, as they might lead back to a parent directory.
+            if not os.path.islink(path):
+                subdirectories.append(path)
+        elif archive_regex.search(filename):
+            archives.append(path)
+
+    entry = (mtime, archives, subdirectories)
+    # Changes within the timestamp resolution of the file system would
+    # go unnoticed, so only remember directories that settled.
+    if time.time() - mtime > 2:
+        _directory_cache[key] = entry
+    else:
+        _directory_cache.pop(key, None)
+    return entry
+
+
+def _get_order_clause():
+    """ Returns an ORDER BY clause matching the library sort preferences.
+    Names and paths are sorted in natural order by their sort keys. """
+    columns = { constants.SORT_NAME : 'book.sort_name',
+                constants.SORT_PATH : 'book.sort_path',
+                constants.SORT_SIZE : 'book.size',
+                constants.SORT_LAST_MODIFIED : 'book.added' }
+    column = columns.get(prefs['lib sort key'], 'book.id')
+    # Ties are broken by ID, so that the order is stable between queries.
+    if prefs['lib sort order'] == constants.SORT_DESCENDING:
+        return ' ORDER BY %s DESC, book.id' % column
+    else:
+        return ' ORDER BY %s, book.id' % column
+
+
 # vim: expandtab:sw=4:ts=4
@@ -18,14 +18,16 @@ from mcomix import i18n
 from mcomix import status
 from mcomix import log
 from mcomix import message_dialog
-from mcomix import tools
-from mcomix.library.pixbuf_cache import get_pixbuf_cache
+from mcomix import natural_sort
+from mcomix.library.pixbuf_cache import get_pixbuf_cache, get_cache_size
 
 _dialog = None
 
 # The "All books" collection is not a real collection stored in the library, but is represented by this ID in the
 # library's TreeModels.
 _COLLECTION_ALL = -1
+#: Number of books loaded at once when the library is scrolled.
+PAGE_SIZE = 500
 
 
 class _BookArea(gtk.ScrolledWindow):
@@ -39,22 +41,33 @@ class _BookArea(gtk.ScrolledWindow):
 
         self._library = library
         self._cache = get_pixbuf_cache()
+        #: Paths of the displayed books that have been read completely.
+        self._finished_books = set()
+        #: IDs of the books in the ListStore.
+        self._book_ids = set()
+        #: Collection whose remaining books are loaded while scrolling,
+        #: or None if all books have been loaded.
+        self._collection = None
+        #: Number of books loaded from the displayed collection.
+        self._books_loaded = 0
+        #: True if loading the next page of books is scheduled.
+        self._page_pending = False
 
         self._library.backend.book_added_to_collection += self._new_book_added
+        self._library.backend.last_read_page_changed += \
+            self._last_read_page_changed
 
         self.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
 
         # Store Cover, book ID, book path, book size, date added to library,
-        # is thumbnail loaded?
+        # is thumbnail loaded?, sort value
 
-        # The SORT_ constants must correspond to the correct column here,
-        # i.e. SORT_SIZE must be 3, since 3 is the size column in the ListStore.
+        # Books are added in the order returned by the library backend,
+        # the ListStore itself is not sorted.
         self._liststore = gtk.ListStore(gtk.gdk.Pixbuf,
                 gobject.TYPE_INT, gobject.TYPE_STRING, gobject.TYPE_INT64,
-                gobject.TYPE_STRING, gobject.TYPE_BOOLEAN)
-        self._liststore.set_sort_func(constants.SORT_NAME, self._sort_by_name, None)
-        self._liststore.set_sort_func(constants.SORT_PATH, self._sort_by_path, None)
-        self.set_sort_order()
+                gobject.TYPE_STRING, gobject.TYPE_BOOLEAN,
+                gobject.TYPE_PYOBJECT)
         self._liststore.connect('row-inserted', self._icon_added)
         self._iconview = thumbnail_view.ThumbnailIconView(self._liststore)
         self._iconview.set_pixbuf_column(0)
@@ -63,6 +76,7 @@ class _BookArea(gtk.ScrolledWindow):
         self._iconview.generate_thumbnail = self._get_pixbuf
         self._iconview.get_file_path_from_model = lambda model, iter: \
                 model.get_value(iter, 2).decode('utf-8')
+        self._iconview.connect('expose-event', self._update_cache_viewport)
         self._iconview.connect('item_activated', self._book_activated)
         self._iconview.connect('selection_changed', self._selection_changed)
         self._iconview.connect_after('drag_begin', self._drag_begin)
@@ -220,14 +234,29 @@ class _BookArea(gtk.ScrolledWindow):
         # Temporarily detach model to speed up updates
         self._iconview.set_model(None)
         self._liststore.clear()
+        self._finished_books = set()
+        self._book_ids = set()
 
-        collection = self._library.backend.get_collection_by_id(collection_id)
-        books = collection.get_books(self._library.filter_string)
-        self.add_books(books)
+        self._collection = self._library.backend.get_collection_by_id(collection_id)
+        self._books_loaded = 0
+        self._load_page()
 
         # Re-attach model here
         self._iconview.set_model(self._liststore)
 
+    def _load_page(self):
+        """ Adds the next PAGE_SIZE books of the displayed collection. """
+        if self._collection is None:
+            return
+
+        books = self._collection.get_books(self._library.filter_string,
+                                           self._books_loaded, PAGE_SIZE)
+        self._books_loaded += len(books)
+        if len(books) < PAGE_SIZE:
+            # Everything has been loaded.
+            self._collection = None
+        self.add_books(books)
+
     def stop_update(self):
         """Signal that the updating of book covers should stop."""
         self._iconview.stop_update()
@@ -236,12 +265,74 @@ class _BookArea(gtk.ScrolledWindow):
         """ Adds new book covers to the icon view.
         @param books: List of L{_Book} instances. """
         filler = self._get_empty_thumbnail()
+        last_read_pages = self._library.backend.get_last_read_pages()
 
         for book in books:
+            # A book inserted by _insert_book may be loaded again with
+            # the next page.
+            if book.id in self._book_ids:
+                continue
+            self._book_ids.add(book.id)
+            if book.pages and last_read_pages.get(book.id) == book.pages:
+                self._finished_books.add(book.path)
             # Fill the liststore with a filler pixbuf.
-            self._liststore.append([filler, book.id,
-                book.path.encode('utf-8'), book.size, book.added, False])
+            self._liststore.append(self._get_row(book, filler))
+
+        self._iconview.draw_thumbnails_on_screen()
+
+    def _get_row(self, book, filler):
+        """ Returns the ListStore row for <book>. """
+        return [filler, book.id, book.path.encode('utf-8'), book.size,
+                book.added, False, self._get_sort_value(book)]
+
+    def _get_sort_value(self, book):
+        """ Returns the value of <book> the library is currently sorted
+        by, matching the order of L{backend_types._get_order_clause}. """
+        sort_key = prefs['lib sort key']
+        if sort_key == constants.SORT_NAME:
+            return natural_sort.sort_string(book.name)
+        elif sort_key == constants.SORT_PATH:
+            return natural_sort.sort_string(book.path)
+        elif sort_key == constants.SORT_SIZE:
+            return book.size
+        elif sort_key == constants.SORT_LAST_MODIFIED:
+            return book.added
+        else:
+            return None
+
+    def _insert_book(self, book):
+        """ Inserts a single new book at its sorted position. Books that
+        would be placed behind the loaded books are left to a later page. """
+        descending = prefs['lib sort order'] == constants.SORT_DESCENDING
+        value = self._get_sort_value(book)
+
+        def is_before(row):
+            # Ties are broken by ascending ID, as in the database query.
+            if row[6] == value:
+                return row[1] < book.id
+            elif descending:
+                return row[6] > value
+            else:
+                return row[6] < value
+
+        low, high = 0, len(self._liststore)
+        while low < high:
+            middle = (low + high) // 2
+            if is_before(self._liststore[middle]):
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(self._liststore) and self._collection is not None:
+            return
 
+        if book.pages and book.get_last_read_page() == book.pages:
+            self._finished_books.add(book.path)
+        self._book_ids.add(book.id)
+        self._liststore.insert(low,
+            self._get_row(book, self._get_empty_thumbnail()))
+        # Keep the offset of the next page in line with the database.
+        self._books_loaded += 1
         self._iconview.draw_thumbnails_on_screen()
 
     def _new_book_added(self, book, collection):
@@ -257,9 +348,32 @@ class _BookArea(gtk.ScrolledWindow):
                 return
 
             # If the current view is filtered, only draw new books that match the filter
-            if not (self._library.filter_string and 
-                    self._library.filter_string.lower() not in book.name.lower()):
-                self.add_books([book])
+            if not (self._library.filter_string and
+                    not self._library.backend.book_matches_filter(book.id,
+                        self._library.filter_string)):
+                self._insert_book(book)
+
+    def _last_read_page_changed(self, book, page):
+        """ Callback function for L{LibraryBackend.last_read_page_changed}.
+        Adds or removes the finished reading indicator of <book>. """
+        finished = bool(book.pages) and page == book.pages
+        if finished == (book.path in self._finished_books):
+            return
+
+        if finished:
+            self._finished_books.add(book.path)
+        else:
+            self._finished_books.discard(book.path)
+
+        for row in self._liststore:
+            if row[1] == book.id:
+                # The indicator is drawn onto the cached cover, which is
+                # recreated in the background once the row is queued
+                # again.
+                self._cache.invalidate(book.path)
+                row[5] = False
+                self._iconview.draw_thumbnails_on_screen()
+                break
 
     def is_book_displayed(self, book):
         """ Returns True when the current view contains the book passed.
@@ -267,11 +381,7 @@ class _BookArea(gtk.ScrolledWindow):
         if not book:
             return False
 
-        for row in self._liststore:
-            if row[1] == book.id:
-                return True
-
-        return False
+        return book.id in self._book_ids
 
     def remove_book_at_path(self, path):
         """Remove the book at <path> from the ListStore (and thus from
@@ -279,8 +389,11 @@ class _BookArea(gtk.ScrolledWindow):
         """
         iterator = self._liststore.get_iter(path)
         filepath = self._liststore.get_value(iterator, 2)
+        self._book_ids.discard(self._liststore.get_value(iterator, 1))
         self._liststore.remove(iterator)
         self._cache.invalidate(filepath)
+        # The book is no longer part of the pages still to be loaded.
+        self._books_loaded = max(self._books_loaded - 1, 0)
 
     def get_book_at_path(self, path):
         """Return the book ID corresponding to the IconView <path>."""
@@ -306,17 +419,6 @@ class _BookArea(gtk.ScrolledWindow):
             return
         self._book_activated(self._iconview, selected, True)
 
-    def set_sort_order(self):
-        """ Orders the list store based on the key passed in C{sort_key}.
-        Should be one of the C{SORT_} constants from L{constants}.
-        """
-        if prefs['lib sort order'] == constants.SORT_ASCENDING:
-            sortorder = gtk.SORT_ASCENDING
-        else:
-            sortorder = gtk.SORT_DESCENDING
-
-        self._liststore.set_sort_column_id(prefs['lib sort key'], sortorder)
-
     def _sort_changed(self, old, current):
         """ Called whenever the sorting options changed. """
         name = current.get_name()
@@ -334,30 +436,9 @@ class _BookArea(gtk.ScrolledWindow):
         elif name == 'descending':
             prefs['lib sort order'] = constants.SORT_DESCENDING
 
-        self.set_sort_order()
-
-    def _sort_by_name(self, treemodel, iter1, iter2, user_data):
-        """ Compares two books based on their file name without the
-        path component. """
-        path1 = self._liststore.get_value(iter1, 2)
-        path2 = self._liststore.get_value(iter2, 2)
-
-        # Catch None values from liststore
-        if path1 is None:
-            return 1
-        elif path2 is None:
-            return -1
-
-        name1 = os.path.split(path1.decode('utf-8'))[1].lower()
-        name2 = os.path.split(path2.decode('utf-8'))[1].lower()
-
-        return tools.alphanumeric_compare(name1, name2)
-
-    def _sort_by_path(self, treemodel, iter1, iter2, user_data):
-        """ Compares two books based on their full path, in natural order. """
-        path1 = self._liststore.get_value(iter1, 2)
-        path2 = self._liststore.get_value(iter2, 2)
-        return tools.alphanumeric_compare(path1, path2)
+        # Reload the books in the new order.
+        collection = self._library.collection_area.get_current_collection()
+        gobject.idle_add(self.display_covers, collection)
 
     def _icon_added(self, model, path, iter, *args):
         """ Justifies the alignment of all cell renderers when new data is
@@ -410,21 +491,46 @@ class _BookArea(gtk.ScrolledWindow):
 
         if prefs['library cover size'] != old_size:
             self._cache.invalidate_all()
+            self._cache.cachesize = get_cache_size(prefs['library cover size'])
             collection = self._library.collection_area.get_current_collection()
             gobject.idle_add(self.display_covers, collection)
 
+    def _update_cache_viewport(self, *args):
+        """ Tells the pixbuf cache which covers are visible, so that the
+        covers around them are kept when scrolling back and forth. """
+        visible = self._iconview.get_visible_range()
+        if visible:
+            first, last = visible[0][0], visible[1][0]
+            margin = last - first + 1
+            self._cache.set_viewport(first - margin, last + margin)
+
+            # Load more books before the end of the loaded books is visible.
+            if (self._collection is not None and not self._page_pending and
+                last + 2 * margin >= len(self._liststore)):
+                self._page_pending = True
+                gobject.idle_add(self._load_next_page)
+        return False
+
+    def _load_next_page(self):
+        self._page_pending = False
+        self._load_page()
+        # Remove this idle handler.
+        return 0
+
     def _get_pixbuf(self, path, model_path):
-        """ Get or create the thumbnail for the selected book at <path>. """
-        if self._cache.exists(path):
-            pixbuf = self._cache.get(path)
-        else:
+        """ Get or create the thumbnail for the selected book at <path>.
+        Runs in a worker thread of the icon view, which queues the rows
+        around the visible area and inserts the result in the main
+        thread. """
+        pixbuf = self._cache.get(path, model_path)
+        if pixbuf is None:
             pixbuf = self._library.backend.get_book_thumbnail(path) or constants.MISSING_IMAGE_ICON
             # The ratio (0.67) is just above the normal aspect ratio for books.
             pixbuf = image_tools.fit_in_rectangle(pixbuf,
                 int(0.67 * prefs['library cover size']),
                 prefs['library cover size'], True)
             pixbuf = image_tools.add_border(pixbuf, 1, 0xFFFFFFFF)
-            self._cache.add(path, pixbuf)
+            self._cache.add(path, pixbuf, model_path)
 
         # Display indicator of having finished reading the book.
         # This information isn't cached in the pixbuf cache, as it changes frequently.
@@ -433,13 +539,9 @@ class _BookArea(gtk.ScrolledWindow):
         if prefs['library cover size'] < 50:
             return pixbuf
 
-        book = self._library.backend.get_book_by_path(path)
-        last_read_page = book.get_last_read_page()
-
-        if last_read_page is None or last_read_page != book.pages:
+        if path not in self._finished_books:
             return pixbuf
-        if last_read_page == book.pages:
-            book_pixbuf = self.render_icon(gtk.STOCK_APPLY, gtk.ICON_SIZE_LARGE_TOOLBAR)
+        book_pixbuf = self.render_icon(gtk.STOCK_APPLY, gtk.ICON_SIZE_LARGE_TOOLBAR)
 
         # Composite icon on the lower right corner of the book cover pixbuf.
         translation_x = pixbuf.get_width() - book_pixbuf.get_width() - 1
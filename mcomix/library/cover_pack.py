@@ -0,0 +1,188 @@
+"""cover_pack.py - Stores all library covers in a single database file."""
+
+import os
+import threading
+import gtk
+import gobject
+
+from mcomix import constants
+from mcomix import thumbnail_tools
+from mcomix import log
+
+try:
+    from sqlite3 import dbapi2
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2
+    except ImportError:
+        dbapi2 = None
+
+
+class _CoverPack(object):
+
+    """ The CoverPack keeps the covers of library books as PNG data in one
+    SQLite database, instead of one PNG file per book. Loading the covers
+    of a large library thus does not require opening thousands of files.
+
+    Covers are created at C{constants.MAX_LIBRARY_COVER_SIZE}, and are
+    re-created when the modification time of their book changes. Covers
+    stored as individual files by earlier versions are moved into the pack
+    when they are first requested. """
+
+    def __init__(self, path):
+        #: Path of the database file.
+        self.path = path
+        #: Holds the database connection of each thread.
+        self._local = threading.local()
+        #: False if covers are stored as individual files.
+        self.enabled = dbapi2 is not None
+
+        if self.enabled:
+            self._con.execute('pragma journal_mode = wal').fetchone()
+            self._con.execute('''create table if not exists cover (
+                path text primary key,
+                mtime integer,
+                data blob)''')
+
+    def _get_connection(self):
+        """ Returns the database connection of the calling thread. """
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = dbapi2.connect(self.path,
+                check_same_thread=False, isolation_level=None, timeout=30)
+            con.text_factory = str
+            con.execute('pragma synchronous = normal')
+            self._local.con = con
+        return con
+
+    _con = property(_get_connection)
+
+    def get_cover(self, path):
+        """ Returns a pixbuf with the cover of the book at <path>, creating
+        it if necessary. Returns None if no cover could be created. """
+        thumbnailer = thumbnail_tools.Thumbnailer(
+            dst_dir=constants.LIBRARY_COVERS_PATH)
+        thumbnailer.set_size(constants.MAX_LIBRARY_COVER_SIZE,
+                             constants.MAX_LIBRARY_COVER_SIZE)
+        if not self.enabled:
+            thumbnailer.set_store_on_disk(True)
+            return thumbnailer.thumbnail(path)
+
+        pixbuf = self._load(path)
+        if pixbuf is not None:
+            return pixbuf
+
+        # Re-uses a cover file of earlier versions if it is still valid.
+        thumbnailer.set_store_on_disk(False)
+        pixbuf = thumbnailer.thumbnail(path)
+        if pixbuf is not None:
+            self._store(path, pixbuf)
+            thumbnailer.delete(path)
+        return pixbuf
+
+    def has_cover(self, path):
+        """ Returns True if an up to date cover for <path> is stored. """
+        if not self.enabled:
+            thumbnailer = thumbnail_tools.Thumbnailer(
+                dst_dir=constants.LIBRARY_COVERS_PATH)
+            thumbnailer.set_size(constants.MAX_LIBRARY_COVER_SIZE,
+                                 constants.MAX_LIBRARY_COVER_SIZE)
+            return thumbnailer._thumbnail_exists(path)
+
+        mtime = self._con.execute('''select mtime from cover
+            where path = ?''', (self._key(path),)).fetchone()
+        return mtime is not None and mtime[0] == _get_mtime(path, mtime[0])
+
+    def remove(self, path):
+        """ Removes the cover for <path>. """
+        thumbnail_tools.Thumbnailer(
+            dst_dir=constants.LIBRARY_COVERS_PATH).delete(path)
+        if self.enabled:
+            self._con.execute('delete from cover where path = ?',
+                              (self._key(path),))
+
+    def compact(self, library_paths):
+        """ Removes the covers of books that no longer exist and are not in
+        <library_paths>, the paths of all library books, and shrinks the
+        pack if a significant part of it is unused. Covers of library books
+        are kept, as their files might only be temporarily unavailable. """
+        if not self.enabled:
+            return
+
+        library_paths = frozenset([self._key(path) for path in library_paths])
+        paths = self._con.execute('select path from cover').fetchall()
+        orphans = [(path,) for path, in paths
+                   if path not in library_paths and
+                   not os.path.isfile(path.decode('utf-8'))]
+        if orphans:
+            self._con.executemany('delete from cover where path = ?', orphans)
+
+        free = self._con.execute('pragma freelist_count').fetchone()[0]
+        total = self._con.execute('pragma page_count').fetchone()[0]
+        if free * 4 > total:
+            log.debug(u'Compacting cover pack (%u of %u pages unused)',
+                      free, total)
+            self._con.execute('vacuum')
+
+    def _load(self, path):
+        """ Returns the stored cover for <path>, or None if there is no
+        up to date cover. """
+        row = self._con.execute('''select mtime, data from cover
+            where path = ?''', (self._key(path),)).fetchone()
+        if row is None:
+            return None
+
+        mtime, data = row
+        if mtime != _get_mtime(path, mtime):
+            return None
+
+        try:
+            loader = gtk.gdk.PixbufLoader('png')
+            loader.write(str(data))
+            loader.close()
+            return loader.get_pixbuf()
+        except gobject.GError, ex:
+            log.debug(u'Invalid cover for "%s": %s', path, ex)
+            return None
+
+    def _store(self, path, pixbuf):
+        """ Stores <pixbuf> as cover for <path>. """
+        chunks = []
+        pixbuf.save_to_callback(chunks.append, 'png')
+        try:
+            self._con.execute('''insert or replace into cover
+                (path, mtime, data) values (?, ?, ?)''',
+                (self._key(path), _get_mtime(path, 0),
+                 dbapi2.Binary(''.join(chunks))))
+        except dbapi2.Error, ex:
+            log.warning(_('! Could not save cover for "%(path)s": %(error)s'),
+                { 'path' : path, 'error' : ex })
+
+    def _key(self, path):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return os.path.abspath(path)
+
+
+def _get_mtime(path, default):
+    """ Returns the modification time of <path>, or <default> if the file
+    does not exist (e.g. on a disconnected drive). """
+    try:
+        return long(os.stat(path).st_mtime)
+    except OSError:
+        return default
+
+
+_cover_pack = None
+
+
+def CoverPack():
+    """ Returns the singleton instance of the cover pack stored at
+    C{constants.LIBRARY_COVERS_PACK_PATH}. """
+    global _cover_pack
+    if (_cover_pack is None or
+        _cover_pack.path != constants.LIBRARY_COVERS_PACK_PATH):
+        _cover_pack = _CoverPack(constants.LIBRARY_COVERS_PACK_PATH)
+    return _cover_pack
+
+# vim: expandtab:sw=4:ts=4
@@ -14,6 +14,7 @@ from mcomix.library import book_area as library_book_area
 from mcomix.library import collection_area as library_collection_area
 from mcomix.library import control_area as library_control_area
 from mcomix.library import add_progress_dialog as library_add_progress_dialog
+from mcomix.library import watchlist_monitor
 
 _dialog = None
 # The "All books" collection is not a real collection stored in the library,
@@ -46,6 +47,9 @@ class _LibraryDialog(gtk.Window):
         self.collection_area = library_collection_area._CollectionArea(self)
 
         self.backend.watchlist.new_files_found += self._new_files_found
+        self._watchlist_monitor = watchlist_monitor.WatchListMonitor(
+            self.backend.watchlist)
+        self._watchlist_monitor.start()
 
         table = gtk.Table(2, 2, False)
         table.attach(self.collection_area, 0, 1, 0, 1, gtk.FILL,
@@ -83,6 +87,8 @@ class _LibraryDialog(gtk.Window):
         if len(self.backend.watchlist.get_watchlist()) > 0:
             self.set_status_message(_("Scanning for new books..."))
             self.backend.watchlist.scan_for_new_files()
+        # The watch list might have changed.
+        self._watchlist_monitor.start()
 
     def _new_files_found(self, filelist, watchentry):
         """ Called after the scan for new files finished. """
@@ -124,6 +130,7 @@ class _LibraryDialog(gtk.Window):
         """Close the library and do required cleanup tasks."""
         prefs['lib window width'], prefs['lib window height'] = self.get_size()
         self.backend.watchlist.new_files_found -= self._new_files_found
+        self._watchlist_monitor.stop()
         self.book_area.stop_update()
         self.book_area.close()
         file_chooser_library_dialog.close_library_filechooser_dialog()
@@ -4,59 +4,172 @@
 from __future__ import with_statement
 import threading
 
+from mcomix.preferences import prefs
+from mcomix import log
+
 __all__ = ["get_pixbuf_cache"]
 
+#: Upper limit for the memory used by cached covers, in bytes.
+MAX_CACHE_SIZE = 128 * 1024 * 1024
+#: Number of covers to keep if they fit into MAX_CACHE_SIZE.
+MAX_COVERS = 2000
+
 class _PixbufCache(object):
 
     """ Pixbuf cache for the library window. Instead of loading book covers
     from disk again after switching collection or using filtering, this class
     stores a pre-defined amount of pixbufs in memory, evicting older pixbufs
     as necessary.
+
+    The cache is limited by the memory used by its pixbufs. When it is
+    full, the least recently used covers are evicted first, except for
+    covers close to the part of the library that is currently displayed,
+    which are only evicted if nothing else is left.
     """
 
     def __init__(self, size):
-        #: Cache size, in images
+        #: Cache size, in bytes
         assert size > 0
         self.cachesize = size
-        #: Store book id => pixbuf
+        #: Store book id => [prev, next, id, pixbuf, bytes, position]
         self._cache = {}
+        #: Sentinel of the circular list that links the entries, least
+        #: recently used first
+        self._root = root = []
+        root[:] = [root, root, None, None, 0, None]
+        #: Memory used by the cached pixbufs, in bytes
+        self._used = 0
+        #: Positions (first, last) of the covers near the visible area
+        self._viewport = None
+        #: Number of successful and failed lookups
+        self.hits = self.misses = 0
         #: Ensure thread safety
         self._lock = threading.RLock()
 
-    def add(self, id, pixbuf):
+    def add(self, id, pixbuf, position=None):
         """ Adds a cache object with <id> and associates it with the
-        passed pixbuf. """
+        passed pixbuf. <position> is the index of the cover in the
+        library display, if known. """
 
+        size = pixbuf.get_rowstride() * pixbuf.get_height()
         with self._lock:
-            if len(self._cache) > self.cachesize:
-                first = self._cache.items()[0]
-                self.invalidate(first[0])
-
-            self._cache[id] = pixbuf
+            self.invalidate(id)
+            entry = [None, None, id, pixbuf, size, position]
+            self._cache[id] = entry
+            self._link(entry)
+            self._used += size
+            self._evict(id)
 
     def exists(self, id):
         """ Checks if there is an entry for the given id in the cache. """
-        return id in self._cache
+        with self._lock:
+            return id in self._cache
 
-    def get(self, id):
+    def get(self, id, position=None):
         """ Returns the pixbuf for the given cache id, or None, if such
-        an entry does not exist. """
-        if id in self._cache:
-            return self._cache[id]
-        else:
-            return None
+        an entry does not exist. <position> is the index of the cover in
+        the library display, if known. """
+        with self._lock:
+            entry = self._cache.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Move the entry to the end, as it is now the most recently used.
+            self._unlink(entry)
+            self._link(entry)
+            if position is not None:
+                entry[5] = position
+            return entry[3]
+
+    def set_viewport(self, first, last):
+        """ Marks the covers between the positions <first> and <last> as
+        being close to the visible part of the library, so that they are
+        evicted last. """
+        with self._lock:
+            self._viewport = (first, last)
 
     def invalidate(self, id):
         """ Invalidates the object with the specified cache ID. """
         with self._lock:
-            if id in self._cache:
-                del self._cache[id]
+            entry = self._cache.pop(id, None)
+            if entry is not None:
+                self._unlink(entry)
+                self._used -= entry[4]
 
     def invalidate_all(self):
         """ Invalidates all cached objects. """
         with self._lock:
+            if self.hits or self.misses:
+                log.debug('Library cover cache: %d hits, %d misses, '
+                          '%d covers using %d KiB', self.hits, self.misses,
+                          len(self._cache), self._used // 1024)
             self._cache.clear()
-
+            root = self._root
+            root[0] = root[1] = root
+            self._used = 0
+            self.hits = self.misses = 0
+
+    def _evict(self, keep):
+        """ Evicts entries until the cache fits into its size, never
+        evicting the entry <keep>. """
+        if self._used <= self.cachesize:
+            return
+
+        def is_near(position):
+            return (self._viewport is not None and position is not None and
+                    self._viewport[0] <= position <= self._viewport[1])
+
+        # Evict the least recently used entries far from the viewport
+        # first. Entries near the viewport are only evicted if the cache
+        # is still too large after all others are gone.
+        evicted = []
+        near = []
+        used = self._used
+        entry = self._root[1]
+        while entry is not self._root:
+            prev, entry, id, pixbuf, size, position = entry
+            if used <= self.cachesize:
+                break
+            if id == keep:
+                continue
+            if is_near(position):
+                near.append((id, size))
+            else:
+                evicted.append(id)
+                used -= size
+
+        for id, size in near:
+            if used <= self.cachesize:
+                break
+            evicted.append(id)
+            used -= size
+
+        for id in evicted:
+            self.invalidate(id)
+
+    def _link(self, entry):
+        """ Appends <entry> to the end of the list of entries, as most
+        recently used one. """
+        root = self._root
+        last = root[0]
+        entry[0], entry[1] = last, root
+        last[1] = root[0] = entry
+
+    def _unlink(self, entry):
+        """ Removes <entry> from the list of entries. """
+        prev, next = entry[0], entry[1]
+        prev[1], next[0] = next, prev
+        entry[0] = entry[1] = None
+
+
+def get_cache_size(cover_size):
+    """ Returns the cache size in bytes for covers with a height of
+    <cover_size> pixels. """
+    # The ratio (0.67) is just above the normal aspect ratio for books.
+    cover_bytes = int(0.67 * cover_size + 2) * (cover_size + 2) * 4
+    return min(MAX_CACHE_SIZE, MAX_COVERS * cover_bytes)
 
 _cache = None
 
@@ -66,9 +179,7 @@ def get_pixbuf_cache():
     if _cache:
         return _cache
     else:
-        # 500 items is about 130 MB of RAM with 500px thumbnails,
-        # and about 35 MB at 250px.
-        _cache = _PixbufCache(500)
+        _cache = _PixbufCache(get_cache_size(prefs['library cover size']))
         return _cache
 
 # vim: expandtab:sw=4:ts=4
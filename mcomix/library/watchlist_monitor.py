@@ -0,0 +1,171 @@
+"""watchlist_monitor.py - Detects new books in watched directories."""
+
+import os
+import threading
+import gobject
+
+try:
+    import gio
+except ImportError:
+    gio = None
+
+from mcomix import archive_tools
+from mcomix import log
+from mcomix.library import backend_types
+
+#: Seconds between two scans when file monitors are not available.
+POLL_INTERVAL = 60
+#: Seconds without changes before new files are reported.
+CHANGE_DELAY = 2
+
+
+class WatchListMonitor(object):
+
+    """ Watches the directories of the watch list while the library is open,
+    and reports new books through L{backend_types._WatchList.new_files_found}
+    as soon as they appear.
+
+    File monitors (inotify on Linux) are used if PyGTK provides gio, so that
+    only actual changes have to be examined. Otherwise, the watch list is
+    scanned every POLL_INTERVAL seconds, which is cheap for directories that
+    have not been modified since the last scan. """
+
+    def __init__(self, watchlist):
+        #: The L{backend_types._WatchList} to monitor.
+        self._watchlist = watchlist
+        #: Watch list entries being monitored, as (path, recursive) tuples.
+        self._entries = None
+        #: Directory => gio.FileMonitor
+        self._monitors = {}
+        #: Changed path => watch list entry, waiting to be examined.
+        self._changes = {}
+        #: Event source ID for processing changes.
+        self._changes_id = None
+        #: Event source ID for polling.
+        self._poll_id = None
+
+    def start(self):
+        """ Starts monitoring the current watch list. Nothing happens if it
+        is already being monitored. """
+        watchlist = self._watchlist.get_watchlist()
+        entries = [(entry.directory, entry.recursive) for entry in watchlist]
+        if entries == self._entries:
+            return
+
+        self.stop()
+        self._entries = entries
+        if gio is None:
+            self._poll_id = gobject.timeout_add_seconds(POLL_INTERVAL,
+                                                        self._poll)
+        else:
+            thread = threading.Thread(target=self._list_directories,
+                                      args=(watchlist, entries))
+            thread.name += '-watchlist_monitor'
+            thread.start()
+
+    def stop(self):
+        """ Stops monitoring. """
+        self._entries = None
+        for monitor in self._monitors.itervalues():
+            monitor.cancel()
+        self._monitors = {}
+        self._changes = {}
+        if self._changes_id is not None:
+            gobject.source_remove(self._changes_id)
+            self._changes_id = None
+        if self._poll_id is not None:
+            gobject.source_remove(self._poll_id)
+            self._poll_id = None
+
+    def _poll(self):
+        self._watchlist.scan_for_new_files(report_empty=False)
+        # Keep polling.
+        return 1
+
+    def _list_directories(self, watchlist, entries):
+        """ Finds the directories to monitor. Runs in its own thread. """
+        directories = []
+        for entry in watchlist:
+            if entry.is_valid():
+                found = []
+                backend_types.list_archives(entry.directory, entry.recursive,
+                                            found)
+                directories.extend([(directory, entry) for directory in found])
+
+        gobject.idle_add(self._create_monitors, entries, directories)
+
+    def _create_monitors(self, entries, directories):
+        if entries == self._entries:
+            for directory, entry in directories:
+                self._monitor(directory, entry)
+
+        # Remove this idle handler.
+        return 0
+
+    def _monitor(self, directory, entry):
+        if directory in self._monitors:
+            return
+        try:
+            monitor = gio.File(directory).monitor_directory()
+        except gio.Error, e:
+            log.debug('Cannot monitor directory "%s": %s', directory, e)
+            return
+
+        monitor.connect('changed', self._directory_changed, entry)
+        self._monitors[directory] = monitor
+
+    def _directory_changed(self, monitor, file, other_file, event_type, entry):
+        """ Called by gio when a file in a monitored directory changed. """
+        if event_type not in (gio.FILE_MONITOR_EVENT_CREATED,
+                              gio.FILE_MONITOR_EVENT_CHANGED,
+                              gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT):
+            return
+
+        path = file.get_path()
+        if os.path.isdir(path):
+            # Symbolic links to directories are not followed when listing.
+            if not entry.recursive or os.path.islink(path):
+                return
+            self._monitor(path, entry)
+        elif not archive_tools.get_supported_archive_regex().search(path):
+            return
+
+        self._changes[path] = entry
+        # Wait until files have been written completely.
+        if self._changes_id is not None:
+            gobject.source_remove(self._changes_id)
+        self._changes_id = gobject.timeout_add_seconds(CHANGE_DELAY,
+            self._process_changes)
+
+    def _process_changes(self):
+        """ Reports the changed paths that are new books. """
+        changes = self._changes
+        self._changes = {}
+        self._changes_id = None
+
+        new_files = {}
+        seen = set()
+        for path, entry in changes.iteritems():
+            if os.path.isdir(path):
+                # A directory has been moved in.
+                paths = backend_types.list_archives(path, True)
+            elif os.path.isfile(path):
+                paths = [ path ]
+            else:
+                continue
+
+            for path in paths:
+                if path in seen:
+                    continue
+                seen.add(path)
+                if self._watchlist.is_new_file(path):
+                    new_files.setdefault(entry.directory,
+                                         (entry, []))[1].append(path)
+
+        for entry, paths in new_files.itervalues():
+            self._watchlist.new_files_found(paths, entry)
+
+        # Remove this timeout handler.
+        return 0
+
+# vim: expandtab:sw=4:ts=4
@@ -11,7 +11,7 @@ from logging import DEBUG, INFO, WARNING, ERROR
 
 from mcomix import i18n
 
-__all__ = ['debug', 'info', 'warning', 'error', 'setLevel',
+__all__ = ['debug', 'info', 'warning', 'error', 'setLevel', 'getLevel',
            'DEBUG', 'INFO', 'WARNING', 'ERROR']
 
 def print_(*args, **options):
@@ -92,6 +92,7 @@ info = __logger.info
 warning = __logger.warning
 error = __logger.error
 setLevel = __logger.setLevel
+getLevel = __logger.getEffectiveLevel
 
 
 # vim: expandtab:sw=4:ts=4
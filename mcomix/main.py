@@ -22,6 +22,7 @@ from mcomix import ui
 from mcomix import slideshow
 from mcomix import status
 from mcomix import thumbbar
+from mcomix import thumbnail_tools
 from mcomix import clipboard
 from mcomix import pageselect
 from mcomix import osd
@@ -350,7 +351,12 @@ class MainWindow(gtk.Window):
                     pixbufs[i] = pixbufs[i].flip(horizontal=True)
                 if prefs['vertical flip']: # 2D only
                     pixbufs[i] = pixbufs[i].flip(horizontal=False)
-                pixbufs[i] = self.enhancer.enhance(pixbufs[i])
+                pixbufs[i] = self.enhancer.enhance(pixbufs[i],
+                    (self.imagehandler.get_path_to_page(
+                        self.imagehandler.get_current_page() + i),
+                     scaled_sizes[i], rotations[i], prefs['scaling quality'],
+                     prefs['checkered bg for transparent images'],
+                     prefs['horizontal flip'], prefs['vertical flip']))
 
             for i in range(n):
                 self.images[i].set_from_pixbuf(pixbufs[i])
@@ -765,6 +771,7 @@ class MainWindow(gtk.Window):
         self._clear_main_area()
         self.set_title(constants.APPNAME)
         self.statusbar.set_message('')
+        self.enhancer.clear_cache()
         enhance_dialog.clear_histogram()
 
     def _clear_main_area(self):
@@ -1026,6 +1033,7 @@ class MainWindow(gtk.Window):
         self.filehandler.cleanup()
         self.imagehandler.cleanup()
         self.thumbnailsidebar.clear()
+        thumbnail_tools.cleanup()
         if main_dialog._dialog is not None:
             main_dialog._dialog.close()
         backend.LibraryBackend().close()
@@ -0,0 +1,67 @@
+"""natural_sort.py - Sorting strings in natural order (i.e. 1 before 10)."""
+
+import re
+
+#: Splits strings into numbers and other characters.
+NUMERIC_REGEXP = re.compile(r"\d+|\D+")
+#: The key cache is emptied when it grows beyond this many strings.
+MAX_CACHED_KEYS = 100000
+
+#: String => sort key
+_keys = {}
+
+
+def key(s):
+    """ Returns the natural sort key for the string <s>. Numbers within
+    <s> are compared by their value, everything else case-insensitively.
+    Keys are cached, so repeatedly sorting the same strings only splits
+    each string once. """
+    try:
+        return _keys[s]
+    except KeyError:
+        pass
+
+    parts = NUMERIC_REGEXP.findall(s.lower())
+    for i, part in enumerate(parts):
+        if part.isdigit():
+            parts[i] = int(part)
+    sort_key = tuple(parts)
+
+    if len(_keys) >= MAX_CACHED_KEYS:
+        _keys.clear()
+    _keys[s] = sort_key
+    return sort_key
+
+def sort(strings):
+    """ Sorts the list <strings> in place, in natural order. """
+    strings.sort(key=key)
+
+def compare(s1, s2):
+    """ Compares two strings by their natural order and returns a result
+    comparable to the cmp function. None is sorted after all strings. """
+    if s1 is None:
+        return 1
+    elif s2 is None:
+        return -1
+
+    return cmp(key(s1), key(s2))
+
+def sort_string(s):
+    """ Returns a string that sorts like key(<s>) when compared as plain
+    string, e.g. by SQLite. Numbers are stored with their length, so
+    that shorter numbers come first. Markers make numbers sort before
+    text, and text before any longer text it is a prefix of. """
+    parts = []
+    for part in key(s):
+        if isinstance(part, (int, long)):
+            digits = str(part)
+            parts.append(u'\x02%03d%s' % (len(digits), digits))
+        else:
+            parts.append(u'\x03%s\x01' % part)
+    return u''.join(parts)
+
+def clear_cache():
+    """ Forgets all cached sort keys. """
+    _keys.clear()
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,155 @@
+"""pixbuf_array.py - Access to the pixels of pixbufs as NumPy arrays.
+
+NumPy is optional. Use is_available() before calling any other function
+of this module; image_tools falls back to PIL if NumPy is missing.
+"""
+
+import gtk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def is_available():
+    """ Returns True if NumPy could be imported. """
+    return numpy is not None
+
+def pixbuf_to_array(pixbuf):
+    """ Returns the pixels of <pixbuf> as array of shape (height, width,
+    channels). If PyGTK was built with NumPy support, the array is a view
+    on the pixbuf's own memory, and no pixels are copied. Otherwise, the
+    pixels are copied once. """
+    try:
+        return numpy.asarray(pixbuf.get_pixels_array())
+    except (RuntimeError, ImportError):
+        # PyGTK without NumPy support.
+        pass
+
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    channels = pixbuf.get_n_channels()
+    pixels = numpy.frombuffer(pixbuf.get_pixels(), numpy.uint8)
+    # Rows may be padded, the row stride is kept instead of copying rows.
+    return numpy.lib.stride_tricks.as_strided(pixels,
+        (height, width, channels), (pixbuf.get_rowstride(), channels, 1))
+
+def array_to_pixbuf(array):
+    """ Returns a new pixbuf with the pixels of <array>, which must have
+    the shape (height, width, 3 or 4). If PyGTK was built with NumPy
+    support, the pixels are copied into the new pixbuf directly. Otherwise,
+    they are copied twice. """
+    height, width, channels = array.shape
+    pixbuf = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, channels == 4, 8,
+                            width, height)
+    try:
+        numpy.asarray(pixbuf.get_pixels_array())[...] = array
+        return pixbuf
+    except (RuntimeError, ImportError):
+        # PyGTK without NumPy support.
+        pass
+
+    array = numpy.ascontiguousarray(array, numpy.uint8)
+    return gtk.gdk.pixbuf_new_from_data(array.tostring(),
+        gtk.gdk.COLORSPACE_RGB, channels == 4, 8, width, height,
+        width * channels)
+
+def apply_lut(array, lut):
+    """ Returns a new array with each channel of <array> mapped through
+    <lut>, a lookup table as used by PIL's Image.point(). """
+    channels = array.shape[-1]
+    lut = numpy.asarray(lut, numpy.uint8).reshape(channels, 256)
+    result = numpy.empty(array.shape, numpy.uint8)
+    for channel in range(channels):
+        result[..., channel] = lut[channel].take(array[..., channel])
+    return result
+
+def get_luma(array):
+    """ Returns the greyscale values of the RGB(A) pixels in <array>, as
+    computed by Pillow's Image.convert('L'). """
+    rgb = array[..., :3].astype(numpy.uint32)
+    luma = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471
+    return (luma >> 16).astype(numpy.uint8)
+
+def blend(array1, array2, factor):
+    """ Returns a new array interpolating between <array1> and <array2>
+    like PIL's Image.blend(), which computes in single precision and
+    truncates the result. """
+    array1 = array1.astype(numpy.float32)
+    result = array1 + numpy.float32(factor) * (array2 - array1)
+    return numpy.clip(result, 0, 255).astype(numpy.uint8)
+
+def enhance_colour(array, factor):
+    """ Returns a new array with the saturation of <array> changed like
+    ImageEnhance.Color, i.e. blended with its greyscale version. The alpha
+    channel is not changed. """
+    result = numpy.array(array, numpy.uint8)
+    luma = get_luma(array)[..., numpy.newaxis]
+    result[..., :3] = blend(luma, array[..., :3], factor)
+    return result
+
+def get_histogram(array):
+    """ Returns the histogram of <array> like PIL's Image.histogram(),
+    i.e. a list of 256 pixel counts per channel. """
+    histogram = []
+    for channel in range(array.shape[-1]):
+        histogram.extend(numpy.bincount(array[..., channel].ravel(),
+                                        minlength=256).tolist())
+    return histogram
+
+def get_grouped_colors(array, steps, middle):
+    """ Groups the colours in <array> by rounding each channel to a multiple
+    of <steps>, rounding up from a remainder of <middle>. Returns a
+    dictionary mapping each rounded colour to (pixel count of the group,
+    pixel count of its most common colour, most common colour). """
+    channels = array.shape[-1]
+    pixels = array.reshape(-1, channels).astype(numpy.int32)
+    if len(pixels) == 0:
+        return {}
+
+    remainders = pixels % steps
+    rounded = numpy.where(remainders >= middle,
+                          pixels + (steps - remainders), pixels - remainders)
+    rounded = numpy.clip(rounded, 0, 255)
+
+    # Combine the channels of each pixel into a single integer.
+    groups = _combine_channels(rounded)
+    colors = _combine_channels(pixels)
+
+    # Count identical colours, ordered by group and colour.
+    order = numpy.lexsort((colors, groups))
+    groups, colors = groups[order], colors[order]
+    changed = (numpy.diff(groups) != 0) | (numpy.diff(colors) != 0)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(changed) + 1))
+    counts = numpy.diff(numpy.concatenate((starts, [len(colors)])))
+    groups, colors = groups[starts], colors[starts]
+
+    # Sum up each group, and find its most common colour. Sorting is
+    # stable, so that the smallest colour wins ties.
+    group_starts = numpy.concatenate(([0],
+        numpy.flatnonzero(numpy.diff(groups)) + 1))
+    totals = numpy.add.reduceat(counts, group_starts)
+    by_count = numpy.lexsort((-counts, groups))
+    best = by_count[group_starts]
+
+    result = {}
+    for group, total, count, color in zip(groups[group_starts].tolist(),
+            totals.tolist(), counts[best].tolist(), colors[best].tolist()):
+        result[_split_channels(group, channels)] = \
+            (total, count, _split_channels(color, channels))
+    return result
+
+def _combine_channels(pixels):
+    """ Returns an array with the channels of each pixel in <pixels>
+    combined into a single integer. """
+    combined = numpy.zeros(len(pixels), numpy.uint32)
+    for channel in range(pixels.shape[1]):
+        combined = (combined << 8) | pixels[:, channel].astype(numpy.uint32)
+    return combined
+
+def _split_channels(value, channels):
+    """ Splits an integer created by _combine_channels into a colour. """
+    return tuple([(value >> (8 * shift)) & 0xFF
+                  for shift in reversed(range(channels))])
+
+# vim: expandtab:sw=4:ts=4
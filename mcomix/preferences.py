@@ -76,6 +76,9 @@ prefs = {
     'sharpness': 1.0,
     'auto contrast': False,
     'max pages to cache': 7,
+    'pages left before prefetching next archive': 5,
+    'max archive sessions': 3,
+    'archive session cache size': 256,
     'window height': 600,
     'window width': 500,
     'pageselector height': -1,
@@ -406,6 +406,35 @@ class _PreferencesDialog(gtk.Dialog):
             _('Set the max number of pages to cache. A value of -1 will cache the entire archive.'))
         page.add_row(label, cache_spinner)
 
+        label = gtk.Label(_('Pages left before preparing the next archive:'))
+        adjustment = gtk.Adjustment(
+            prefs['pages left before prefetching next archive'], 0, 100, 1, 5)
+        prefetch_spinner = gtk.SpinButton(adjustment, digits=0)
+        prefetch_spinner.connect('value-changed', self._spinner_cb,
+                                 'pages left before prefetching next archive')
+        prefetch_spinner.set_tooltip_text(
+            _('When "Automatically open the next archive" is enabled, start extracting the next archive once fewer pages than this are left. A value of 0 disables this.'))
+        page.add_row(label, prefetch_spinner)
+
+        label = gtk.Label(_('Number of recently closed archives to keep:'))
+        adjustment = gtk.Adjustment(prefs['max archive sessions'], 0, 20, 1, 3)
+        sessions_spinner = gtk.SpinButton(adjustment, digits=0)
+        sessions_spinner.connect('value-changed', self._spinner_cb,
+                                 'max archive sessions')
+        sessions_spinner.set_tooltip_text(
+            _('Keep the extracted files and cached pages of recently closed archives, so that they can be opened again instantly. A value of 0 disables this.'))
+        page.add_row(label, sessions_spinner)
+
+        label = gtk.Label(_('Memory for recently closed archives (MiB):'))
+        adjustment = gtk.Adjustment(prefs['archive session cache size'],
+                                    0, 4096, 16, 64)
+        session_size_spinner = gtk.SpinButton(adjustment, digits=0)
+        session_size_spinner.connect('value-changed', self._spinner_cb,
+                                     'archive session cache size')
+        session_size_spinner.set_tooltip_text(
+            _('Maximum amount of memory used by the cached pages and thumbnails of recently closed archives.'))
+        page.add_row(label, session_size_spinner)
+
         page.new_section(_('Magnifying Lens'))
 
         label = gtk.Label(_('Magnifying lens size (in pixels):'))
@@ -892,6 +921,13 @@ class _PreferencesDialog(gtk.Dialog):
         elif preference == 'max extract threads':
             prefs[preference] = int(value)
 
+        elif preference == 'pages left before prefetching next archive':
+            prefs[preference] = int(value)
+
+        elif preference in ('max archive sessions',
+                            'archive session cache size'):
+            prefs[preference] = int(value)
+
 
     def _entry_cb(self, entry, event=None):
         """Callback for entry-type preferences."""
@@ -50,6 +50,14 @@ def parse_arguments(argv):
     parser.add_option('-v', '--version', action='callback', callback=print_version,
             help=_('Show the version number and exit.'))
 
+    indexopts = optparse.OptionGroup(parser, _('Indexing'))
+    indexopts.add_option('--index', dest='index', action='store_true',
+            help=_('Create covers and thumbnails for all archives and images in PATH, '
+                   'or for all books in the library if no PATH is given, and exit.'))
+    indexopts.add_option('-j', '--jobs', dest='jobs', action='store', type='int',
+            metavar='N', help=_('Number of processes used for indexing.'))
+    parser.add_option_group(indexopts)
+
     viewmodes = optparse.OptionGroup(parser, _('View modes'))
     viewmodes.add_option('-f', '--fullscreen', dest='fullscreen', action='store_true',
             help=_('Start the application in fullscreen mode.'))
@@ -165,6 +173,12 @@ from mcomix import log
 def run():
     """Run the program."""
 
+    # The indexer's worker processes in frozen executables are started
+    # with this argument, which the command line parser does not know.
+    if '--multiprocessing-fork' in sys.argv:
+        import multiprocessing
+        multiprocessing.freeze_support()
+
     open_path = None
     open_page = 1
     argv = portability.get_commandline_args()
@@ -176,6 +190,11 @@ def run():
     if not os.path.exists(constants.CONFIG_DIR):
         os.makedirs(constants.CONFIG_DIR, 0700)
 
+    if opts.index:
+        from mcomix import indexer
+        log.setLevel(opts.loglevel)
+        sys.exit(indexer.index(args, opts.jobs) and 1 or 0)
+
     icons.load_icons()
 
     if len(args) == 1:
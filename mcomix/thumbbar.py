@@ -9,6 +9,7 @@ from mcomix.preferences import prefs
 from mcomix import image_tools
 from mcomix import tools
 from mcomix import constants
+from mcomix import thumbnail_atlas
 from mcomix import thumbnail_view
 
 
@@ -25,6 +26,12 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
         #: Selected page in treeview
         self._currently_selected_page = 0
         self._selection_is_forced = False
+        #: Key of the thumbnail atlas for the loaded archive, or None
+        self._atlas_key = None
+        #: Archive member names of the loaded pages
+        self._atlas_names = []
+        #: Number of thumbnails restored from the atlas
+        self._atlas_count = 0
 
         self.set_policy(gtk.POLICY_NEVER, gtk.POLICY_ALWAYS)
         self.get_vadjustment().step_increment = 15
@@ -139,6 +146,7 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
         """Clear the ThumbnailSidebar of any loaded thumbnails."""
 
         self._treeview.stop_update()
+        self._save_atlas()
         self._thumbnail_liststore.clear()
         self.hide()
         self._loaded = False
@@ -154,6 +162,25 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
 
         self._load()
 
+    def get_thumbnails(self):
+        """Return the thumbnails that have already been generated, as a
+        dictionary mapping page indices to pixbufs.
+        """
+        thumbnails = {}
+        for index, row in enumerate(self._thumbnail_liststore):
+            if row[2]:
+                thumbnails[index] = row[1]
+        return thumbnails
+
+    def set_thumbnails(self, thumbnails):
+        """Use the pixbufs in <thumbnails>, a dictionary mapping page
+        indices to thumbnails as returned by get_thumbnails(), instead of
+        generating them again.
+        """
+        for index, pixbuf in thumbnails.items():
+            if index < len(self._thumbnail_liststore):
+                self._thumbnail_liststore[index] = [index + 1, pixbuf, True]
+
     def resize(self):
         """Reload the thumbnails with the size specified by in the
         preferences.
@@ -219,6 +246,7 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
             self._thumbnail_liststore.append(
                 [len(self._thumbnail_liststore) + 1, filler, False])
 
+        self._load_atlas()
         self._loaded = True
 
         # Re-attach model
@@ -234,6 +262,45 @@ class ThumbnailSidebar(gtk.ScrolledWindow):
         self.update_layout_size()
         self.update_select()
 
+    def _load_atlas(self):
+        """ Fill in the thumbnails stored in the atlas of the opened
+        archive, if there is one. """
+        filehandler = self._window.filehandler
+        if (filehandler.archive_type is None or
+            not prefs['create thumbnails'] or not prefs['show thumbnails']):
+            return
+
+        self._atlas_key = thumbnail_atlas.get_atlas_key(
+            filehandler.get_path_to_base(), prefs['thumbnail size'])
+        if self._atlas_key is None:
+            return
+
+        self._atlas_names = [filehandler._name_table.get(
+            self._window.imagehandler.get_path_to_page(index + 1))
+            for index in range(len(self._thumbnail_liststore))]
+        atlas = thumbnail_atlas.load_atlas(self._atlas_key)
+        thumbnails = {}
+        for index, name in enumerate(self._atlas_names):
+            if name in atlas:
+                thumbnails[index] = atlas[name]
+        self.set_thumbnails(thumbnails)
+        self._atlas_count = len(thumbnails)
+
+    def _save_atlas(self):
+        """ Store the generated thumbnails in the atlas of the opened
+        archive, unless no new thumbnails have been generated. """
+        thumbnails = self.get_thumbnails()
+        if self._atlas_key is not None and len(thumbnails) > self._atlas_count:
+            atlas = {}
+            for index, pixbuf in thumbnails.iteritems():
+                if index < len(self._atlas_names) and self._atlas_names[index]:
+                    atlas[self._atlas_names[index]] = pixbuf
+            thumbnail_atlas.save_atlas(self._atlas_key, atlas)
+
+        self._atlas_key = None
+        self._atlas_names = []
+        self._atlas_count = 0
+
     def _generate_thumbnail(self, file_path, path):
         """ Generate the pixbuf for C{path} at demand. """
         if isinstance(path, tuple):
@@ -0,0 +1,149 @@
+"""thumbnail_atlas.py - Stores the page thumbnails of an archive in a
+single file, so that they can be restored with one read when the archive
+is opened again.
+
+An atlas is a PNG image containing all thumbnails side by side. A text
+chunk of the image maps archive member names to their position, so that
+image and index are always written and replaced together.
+"""
+
+import os
+import sys
+import math
+import json
+import tempfile
+import threading
+import gtk
+from urllib import pathname2url
+
+try:  # The md5 module is deprecated as of Python 2.5, replaced by hashlib.
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from mcomix import constants
+from mcomix import portability
+from mcomix import i18n
+from mcomix import log
+
+#: Number of atlases that are kept on disk.
+MAX_ATLASES = 500
+#: PNG text chunk holding the position of each thumbnail.
+INDEX_OPTION = 'tEXt::MComix::Atlas::Index'
+
+
+def get_atlas_key(path, size):
+    """ Returns the key identifying the atlas of thumbnails with
+    <size> for the archive at <path>, or None if <path> cannot be read.
+    The key changes whenever the archive is modified. """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    uri = portability.uri_prefix() + pathname2url(i18n.to_utf8(os.path.normpath(path)))
+    return md5('%s:%d:%d:%d' % (uri, long(stat.st_mtime), stat.st_size,
+                                size)).hexdigest()
+
+def load_atlas(key):
+    """ Returns the thumbnails stored in the atlas <key> as a
+    dictionary mapping archive member names to pixbufs. If there is no
+    such atlas, an empty dictionary is returned. """
+    image_path = _get_atlas_path(key)
+    if not os.path.isfile(image_path):
+        return {}
+
+    try:
+        atlas = gtk.gdk.pixbuf_new_from_file(image_path)
+        cells = json.loads(atlas.get_option(INDEX_OPTION))
+
+        thumbnails = {}
+        for name, (x, y, width, height) in cells.iteritems():
+            thumbnails[name] = atlas.subpixbuf(x, y, width, height)
+        return thumbnails
+
+    except Exception, ex:
+        log.debug(u'Could not load thumbnail atlas "%s": %s', image_path, ex)
+        return {}
+
+def save_atlas(key, thumbnails):
+    """ Writes <thumbnails>, a dictionary mapping archive member names to
+    pixbufs, to the atlas <key>. Writing is done in a new thread. """
+    if not thumbnails:
+        return
+
+    thread = threading.Thread(target=_write_atlas, args=(key, thumbnails))
+    thread.name += '-atlas'
+    thread.start()
+
+def _write_atlas(key, thumbnails):
+    names = sorted(thumbnails.keys())
+    cell_width = max([thumbnails[name].get_width() for name in names])
+    cell_height = max([thumbnails[name].get_height() for name in names])
+    columns = int(math.ceil(math.sqrt(len(names))))
+    rows = int(math.ceil(len(names) / float(columns)))
+
+    atlas = gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB, True, 8,
+                           columns * cell_width, rows * cell_height)
+    atlas.fill(0)
+    cells = {}
+    for i, name in enumerate(names):
+        pixbuf = thumbnails[name]
+        x = (i % columns) * cell_width
+        y = (i // columns) * cell_height
+        pixbuf.copy_area(0, 0, pixbuf.get_width(), pixbuf.get_height(),
+                         atlas, x, y)
+        cells[name] = (x, y, pixbuf.get_width(), pixbuf.get_height())
+
+    image_path = _get_atlas_path(key)
+    try:
+        if not os.path.isdir(constants.THUMBNAIL_ATLAS_PATH):
+            os.makedirs(constants.THUMBNAIL_ATLAS_PATH, 0700)
+
+        tmp_fd, tmp_image_path = tempfile.mkstemp(suffix='.tmp',
+            dir=constants.THUMBNAIL_ATLAS_PATH)
+        os.close(tmp_fd)
+        try:
+            atlas.save(tmp_image_path, 'png', {INDEX_OPTION: json.dumps(cells)})
+            _replace(tmp_image_path, image_path)
+        except:
+            if os.path.exists(tmp_image_path):
+                os.remove(tmp_image_path)
+            raise
+
+    except Exception, ex:
+        log.warning(_('! Could not save thumbnail atlas "%(path)s": %(error)s'),
+            { 'path' : image_path, 'error' : ex })
+        return
+
+    log.debug(u'Saved %u thumbnails to atlas "%s"', len(names), image_path)
+    _prune_atlases()
+
+def _get_atlas_path(key):
+    return os.path.join(constants.THUMBNAIL_ATLAS_PATH, key + '.png')
+
+def _replace(src, dst):
+    """ Renames <src> to <dst>, atomically replacing <dst> if it exists.
+    Windows cannot rename over an existing file, so <dst> is removed
+    first there. """
+    if sys.platform == 'win32' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def _prune_atlases():
+    """ Removes the least recently written atlases if there are more
+    than MAX_ATLASES. """
+    try:
+        atlases = [os.path.join(constants.THUMBNAIL_ATLAS_PATH, filename)
+                   for filename in os.listdir(constants.THUMBNAIL_ATLAS_PATH)
+                   if filename.endswith('.png')]
+        if len(atlases) <= MAX_ATLASES:
+            return
+
+        atlases.sort(key=os.path.getmtime)
+        for image_path in atlases[:-MAX_ATLASES]:
+            os.remove(image_path)
+    except OSError, ex:
+        log.debug(u'Could not prune thumbnail atlases: %s', ex)
+
+# vim: expandtab:sw=4:ts=4
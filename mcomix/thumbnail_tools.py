@@ -1,6 +1,7 @@
 """thumbnail.py - Thumbnail module for MComix implementing (most of) the
 freedesktop.org "standard" at http://jens.triq.net/thumbnail-spec/
 """
+from __future__ import with_statement
 
 import os
 import re
@@ -27,13 +28,20 @@ from mcomix import portability
 from mcomix import i18n
 from mcomix import callback
 from mcomix import log
+from mcomix.worker_thread import WorkerThread
 
 
 class Thumbnailer(object):
     """ The Thumbnailer class is responsible for managing MComix
     internal thumbnail creation. Depending on its settings,
     it either stores thumbnails on disk and retrieves them later,
-    or simply creates new thumbnails each time it is called. """
+    or simply creates new thumbnails each time it is called.
+
+    Thumbnails in the default directory are stored in the fixed size
+    tiers of the freedesktop.org standard (see C{constants.THUMBNAIL_TIERS}).
+    Any requested size is served from the nearest larger tier, so that
+    changing the thumbnail size does not require re-creating thumbnails
+    from the source files. """
 
     def __init__(self, dst_dir=constants.THUMBNAIL_PATH):
 
@@ -69,6 +77,10 @@ class Thumbnailer(object):
         both normal image files and archives. If a thumbnail file already exists,
         it is re-used. Otherwise, a new thumbnail is created from <filepath>.
 
+        Asynchronous requests are queued in a shared pool of worker threads,
+        in the order they were made. Identical requests that are still
+        pending are merged.
+
         Returns None if thumbnail creation failed, or if the thumbnail creation
         is run asynchrounosly. """
 
@@ -77,22 +89,26 @@ class Thumbnailer(object):
             self.width = prefs['thumbnail size']
             self.height = prefs['thumbnail size']
 
-        thumbpath = self._path_to_thumbpath(filepath)
-        if self._thumbnail_exists(filepath):
-            pixbuf = image_tools.load_pixbuf(thumbpath)
+        thumbpath = self._find_thumbnail(filepath)
+        if thumbpath is not None:
+            pixbuf = self._fit_to_size(image_tools.load_pixbuf(thumbpath))
             self.thumbnail_finished(filepath, pixbuf)
             return pixbuf
 
         else:
             if async:
-                thread = threading.Thread(target=self._create_thumbnail, args=(filepath,))
-                thread.name += '-thumbnailer'
-                thread.setDaemon(True)
-                thread.start()
+                _get_pool().add_request(self, filepath)
                 return None
             else:
                 return self._create_thumbnail(filepath)
 
+    def cancel(self):
+        """ Cancels all pending asynchronous requests of this thumbnailer.
+        Thumbnails that are being created already will not be reported
+        through thumbnail_finished. """
+        if _pool is not None:
+            _pool.cancel_requests(self)
+
     @callback.Callback
     def thumbnail_finished(self, filepath, pixbuf):
         """ Called every time a thumbnail has been completed.
@@ -102,18 +118,49 @@ class Thumbnailer(object):
         pass
 
     def delete(self, filepath):
-        """ Deletes the thumbnail for <filepath> (if it exists) """
-        thumbpath = self._path_to_thumbpath(filepath)
-        if os.path.isfile(thumbpath):
-            try:
-                os.remove(thumbpath)
-            except IOError, error:
-                log.error(_("! Could not remove file \"%s\""), thumbpath)
-                log.error(error)
+        """ Deletes the thumbnails for <filepath> (if they exist) """
+        if self.dst_dir == constants.THUMBNAIL_PATH:
+            dst_dirs = [tier_dir for tier_size, tier_dir in constants.THUMBNAIL_TIERS]
+        else:
+            dst_dirs = [self.dst_dir]
+
+        for dst_dir in dst_dirs:
+            thumbpath = self._path_to_thumbpath(filepath, dst_dir)
+            if os.path.isfile(thumbpath):
+                try:
+                    os.remove(thumbpath)
+                    _thumbnail_index.remove(thumbpath)
+                except IOError, error:
+                    log.error(_("! Could not remove file \"%s\""), thumbpath)
+                    log.error(error)
+
+    def _get_tiers(self):
+        """ Returns a list of (size, directory) tuples of the stored
+        thumbnails that can serve the requested size, smallest first. """
+        size = max(self.width, self.height)
+        if self.dst_dir == constants.THUMBNAIL_PATH:
+            tiers = [(tier_size, tier_dir)
+                     for tier_size, tier_dir in constants.THUMBNAIL_TIERS
+                     if tier_size >= size]
+            if tiers:
+                return tiers
+            # Sizes above the largest tier are stored at their exact size.
+            return [(size, constants.THUMBNAIL_TIERS[-1][1])]
+        else:
+            return [(size, self.dst_dir)]
+
+    def _fit_to_size(self, pixbuf):
+        """ Downscales <pixbuf>, taken from a larger tier, to the requested
+        size. """
+        if (pixbuf is not None and
+            (pixbuf.get_width() > self.width or pixbuf.get_height() > self.height)):
+            return image_tools.fit_in_rectangle(pixbuf, self.width, self.height)
+        return pixbuf
 
-    def _create_thumbnail_pixbuf(self, filepath):
-        """ Creates a thumbnail pixbuf from <filepath>, and returns it as a
-        tuple along with a file metadata dictionary: (pixbuf, tEXt_data) """
+    def _create_thumbnail_pixbuf(self, filepath, width, height):
+        """ Creates a thumbnail pixbuf with at most <width> x <height>
+        pixels from <filepath>, and returns it as a tuple along with a file
+        metadata dictionary: (pixbuf, tEXt_data) """
 
         mime = archive_tools.archive_mime_type(filepath)
         if mime is not None:
@@ -138,7 +185,7 @@ class Thumbnailer(object):
                 if not os.path.isfile(image_path):
                     return None, None
 
-                pixbuf = image_tools.load_pixbuf_size(image_path, self.width, self.height)
+                pixbuf = image_tools.load_pixbuf_size(image_path, width, height)
                 tEXt_data = self._get_text_data(image_path)
                 # Use the archive's mTime instead of the extracted file's mtime
                 tEXt_data['tEXt::Thumb::MTime'] = str(long(os.stat(filepath).st_mtime))
@@ -149,7 +196,7 @@ class Thumbnailer(object):
                     fn()
 
         elif image_tools.is_image_file(filepath):
-            pixbuf = image_tools.load_pixbuf_size(filepath, self.width, self.height)
+            pixbuf = image_tools.load_pixbuf_size(filepath, width, height)
             tEXt_data = self._get_text_data(filepath)
 
             return pixbuf, tEXt_data
@@ -160,15 +207,37 @@ class Thumbnailer(object):
         """ Creates the thumbnail pixbuf for <filepath>, and saves the pixbuf
         to disk if necessary. Returns the created pixbuf, or None, if creation failed. """
 
-        pixbuf, tEXt_data = self._create_thumbnail_pixbuf(filepath)
+        pixbuf = self._make_thumbnail(filepath)
         self.thumbnail_finished(filepath, pixbuf)
+        return pixbuf
+
+    def _make_thumbnail(self, filepath):
+        """ Does the actual work of _create_thumbnail(), without calling
+        thumbnail_finished. """
+
+        if self.store_on_disk:
+            # Create the thumbnail for the smallest tier that is large enough.
+            tier_size, tier_dir = self._get_tiers()[0]
+            pixbuf, tEXt_data = self._create_thumbnail_pixbuf(filepath,
+                tier_size, tier_size)
 
-        if pixbuf and self.store_on_disk:
-            thumbpath = self._path_to_thumbpath(filepath)
-            self._save_thumbnail(pixbuf, thumbpath, tEXt_data)
+            if pixbuf:
+                thumbpath = self._path_to_thumbpath(filepath, tier_dir)
+                self._save_thumbnail(pixbuf, thumbpath, tEXt_data)
+
+            pixbuf = self._fit_to_size(pixbuf)
+        else:
+            pixbuf, tEXt_data = self._create_thumbnail_pixbuf(filepath,
+                self.width, self.height)
 
         return pixbuf
 
+    def _get_request_key(self, filepath):
+        """ Returns a key identifying requests for <filepath> that result
+        in the same thumbnail. """
+        return (filepath, self.width, self.height, self.dst_dir,
+                self.store_on_disk, self.force_recreation)
+
     def _get_text_data(self, filepath):
         """ Creates a tEXt dictionary for <filepath>. """
         mime = mimetypes.guess_type(filepath)[0] or "unknown/mime"
@@ -207,49 +276,60 @@ class Thumbnailer(object):
 
             pixbuf.save(thumbpath, 'png', tEXt_data)
             os.chmod(thumbpath, 0600)
+            _thumbnail_index.add(thumbpath,
+                long(tEXt_data['tEXt::Thumb::MTime']),
+                max(pixbuf.get_width(), pixbuf.get_height()),
+                max(int(tEXt_data['tEXt::Thumb::Image::Width']),
+                    int(tEXt_data['tEXt::Thumb::Image::Height'])))
 
         except Exception, ex:
             log.warning( _('! Could not save thumbnail "%(thumbpath)s": %(error)s'),
                 { 'thumbpath' : thumbpath, 'error' : ex } )
 
     def _thumbnail_exists(self, filepath):
-        """ Checks if the thumbnail for <filepath> already exists.
-        This function will return False if the thumbnail exists
-        and it's mTime doesn't match the mTime of <filepath>,
-        it's size is different from the one specified in the thumbnailer,
+        """ Checks if a thumbnail for <filepath> already exists. """
+        return self._find_thumbnail(filepath) is not None
+
+    def _find_thumbnail(self, filepath):
+        """ Returns the path to the stored thumbnail for <filepath> of
+        the nearest tier, or None if there is none.
+        Thumbnails are ignored if their mTime doesn't match the mTime of
+        <filepath>, if their size doesn't match the size of their tier,
         or if <force_recreation> is True. """
 
-        if not self.force_recreation:
-            thumbpath = self._path_to_thumbpath(filepath)
+        if self.force_recreation:
+            return None
 
-            if os.path.isfile(thumbpath):
-                # Check the thumbnail's stored mTime
-                try:
-                    img = Image.open(thumbpath)
-                except IOError:
-                    return False
+        file_mtime = None
+        for tier_size, tier_dir in self._get_tiers():
+            thumbpath = self._path_to_thumbpath(filepath, tier_dir)
 
-                info = img.info
-                stored_mtime = long(info['Thumb::MTime'])
+            info = _thumbnail_index.lookup(thumbpath)
+            if info is None:
+                continue
+
+            # Check the thumbnail's stored mTime
+            stored_mtime, thumb_size, source_size = info
+            if file_mtime is None:
                 # The source file might no longer exist
                 file_mtime = os.path.isfile(filepath) and long(os.stat(filepath).st_mtime) or stored_mtime
-                return stored_mtime == file_mtime and \
-                    max(*img.size) == max(self.width, self.height)
-            else:
-                return False
-        else:
-            return False
+            # Images smaller than the tier are not scaled up.
+            if stored_mtime == file_mtime and (thumb_size == tier_size or
+                0 < source_size == thumb_size < tier_size):
+                return thumbpath
+
+        return None
 
-    def _path_to_thumbpath(self, filepath):
+    def _path_to_thumbpath(self, filepath, dst_dir):
         """ Converts <path> to an URI for the thumbnail in <dst_dir>. """
         uri = portability.uri_prefix() + pathname2url(i18n.to_utf8(os.path.normpath(filepath)))
-        return self._uri_to_thumbpath(uri)
+        return self._uri_to_thumbpath(uri, dst_dir)
 
-    def _uri_to_thumbpath(self, uri):
+    def _uri_to_thumbpath(self, uri, dst_dir):
         """ Return the full path to the thumbnail for <uri> with <dst_dir>
         being the base thumbnail directory. """
         md5hash = md5(uri).hexdigest()
-        thumbpath = os.path.join(self.dst_dir, md5hash + '.png')
+        thumbpath = os.path.join(dst_dir, md5hash + '.png')
         return thumbpath
 
     def _guess_cover(self, files):
@@ -280,4 +360,146 @@ class Thumbnailer(object):
 
         return None
 
+
+class _ThumbnailIndex(object):
+    """ Remembers the source mTime and size of the thumbnails stored on
+    disk, so that checking whether a thumbnail is still valid does not
+    require reading the PNG file every time.
+
+    Entries are keyed by thumbnail path, and are only trusted as long as
+    the thumbnail file's own mTime does not change, i.e. thumbnails that
+    have been replaced by other programs are read again. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        #: Thumbnail path => (thumbnail mTime, source mTime, thumbnail size,
+        #: source image size)
+        self._entries = {}
+
+    def lookup(self, thumbpath):
+        """ Returns a tuple (source mTime, thumbnail size, source image
+        size) for the thumbnail stored as <thumbpath>, or None if there is
+        no readable thumbnail. Sizes are the larger of width and height,
+        the source image size is 0 if unknown. """
+        try:
+            thumb_mtime = os.stat(thumbpath).st_mtime
+        except OSError:
+            self.remove(thumbpath)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(thumbpath)
+
+        if entry is not None and entry[0] == thumb_mtime:
+            return entry[1:]
+
+        try:
+            img = Image.open(thumbpath)
+            stored_mtime = long(img.info['Thumb::MTime'])
+            thumb_size = max(*img.size)
+        except (IOError, KeyError, ValueError):
+            return None
+
+        try:
+            source_size = max(int(img.info['Thumb::Image::Width']),
+                              int(img.info['Thumb::Image::Height']))
+        except (KeyError, ValueError):
+            source_size = 0
+
+        self._set(thumbpath, thumb_mtime, stored_mtime, thumb_size, source_size)
+        return stored_mtime, thumb_size, source_size
+
+    def add(self, thumbpath, stored_mtime, thumb_size, source_size):
+        """ Registers the thumbnail that has just been written to
+        <thumbpath>. """
+        try:
+            thumb_mtime = os.stat(thumbpath).st_mtime
+        except OSError:
+            return
+
+        self._set(thumbpath, thumb_mtime, stored_mtime, thumb_size, source_size)
+
+    def remove(self, thumbpath):
+        """ Forgets about the thumbnail stored as <thumbpath>. """
+        with self._lock:
+            self._entries.pop(thumbpath, None)
+
+    def _set(self, thumbpath, thumb_mtime, stored_mtime, thumb_size,
+             source_size):
+        with self._lock:
+            self._entries[thumbpath] = (thumb_mtime, stored_mtime,
+                                        thumb_size, source_size)
+
+#: Shared by all Thumbnailer instances.
+_thumbnail_index = _ThumbnailIndex()
+
+
+class _ThumbnailPool(object):
+    """ Creates the thumbnails requested asynchronously by any
+    Thumbnailer, using a bounded number of worker threads. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        #: Request key => list of (thumbnailer, filepath) waiting for it
+        self._requests = {}
+        self._thread = WorkerThread(self._create_thumbnail,
+                                    name='thumbnailer',
+                                    max_threads=prefs['max threads'])
+
+    def add_request(self, thumbnailer, filepath):
+        """ Queues the creation of the thumbnail for <filepath> by
+        <thumbnailer>. """
+        key = thumbnailer._get_request_key(filepath)
+        with self._lock:
+            if key in self._requests:
+                self._requests[key].append(thumbnailer)
+                return
+            self._requests[key] = [thumbnailer]
+        self._thread.append_order(key)
+
+    def cancel_requests(self, thumbnailer):
+        """ Forgets about all requests made by <thumbnailer>. """
+        with self._lock:
+            for key, waiting in self._requests.items():
+                waiting[:] = [t for t in waiting if t is not thumbnailer]
+
+    def stop(self):
+        """ Stops the worker threads and drops all pending requests. """
+        self._thread.stop()
+        with self._lock:
+            self._requests.clear()
+
+    def _create_thumbnail(self, key):
+        filepath = key[0]
+        with self._lock:
+            waiting = self._requests.get(key)
+            if not waiting:
+                # All requests for this thumbnail have been cancelled.
+                self._requests.pop(key, None)
+                return
+            thumbnailer = waiting[0]
+
+        try:
+            pixbuf = thumbnailer._make_thumbnail(filepath)
+        finally:
+            with self._lock:
+                waiting = self._requests.pop(key, [])
+
+        for thumbnailer in waiting:
+            thumbnailer.thumbnail_finished(filepath, pixbuf)
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = _ThumbnailPool()
+    return _pool
+
+def cleanup():
+    """ Stops creating thumbnails requested asynchronously. Should be
+    called prior to exit. """
+    if _pool is not None:
+        _pool.stop()
+
 # vim: expandtab:sw=4:ts=4
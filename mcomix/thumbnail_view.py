@@ -31,6 +31,12 @@ class ThumbnailViewBase(object):
                                     name='thumbview',
                                     unique_orders=True,
                                     max_threads=prefs["max threads"])
+        #: Visible range (first row, last row) at the last scheduling.
+        self._scheduled_range = None
+        #: Rows that have been examined for the current read-ahead area.
+        self._window = set()
+        #: Row => order for all rows waiting for their thumbnail.
+        self._queued = {}
 
     def generate_thumbnail(self, file_path, model, path):
         """ This function must return the thumbnail for C{file_path}.
@@ -50,30 +56,80 @@ class ThumbnailViewBase(object):
         """ Stops generation of pixbufs. """
         self._updates_stopped = True
         self._thread.stop()
+        self._scheduled_range = None
+        self._window.clear()
+        self._queued.clear()
 
     def draw_thumbnails_on_screen(self, *args):
         """ Prepares valid thumbnails for currently displayed icons.
-        This method is supposed to be called from the expose-event
-        callback function. """
+        This method re-examines all rows around the visible range, it
+        should be called when thumbnails might have become available. """
+        self._scheduled_range = None
+        self._schedule_thumbnails()
 
+    def _expose_event(self, *args):
+        """ Called on every expose-event. Only rows that have scrolled into
+        the read-ahead area since the last call are scheduled. """
+        self._schedule_thumbnails()
+
+    def _schedule_thumbnails(self):
         visible = self.get_visible_range()
         if not visible:
             # No valid paths available
             return
 
-        # Flush current pixmap generation orders.
-        self._thread.clear_orders()
-
-        pixbufs_needed = []
         start = visible[0][0]
         end = visible[1][0]
-        # Read ahead/back and start caching a few more icons. Currently invisible
-        # icons are always cached only after the visible icons have been completed.
+        if self._scheduled_range == (start, end):
+            # Nothing scrolled into view.
+            return
+
+        # Read ahead/back and start caching a few more icons. Currently
+        # invisible icons are always cached only after the visible icons
+        # have been completed. Read ahead further in scroll direction when
+        # scrolling fast.
         additional = (end - start) // 2
-        required = range(start, end + additional + 1) + \
-                   range(max(0, start - additional), start)
+        if self._scheduled_range is None:
+            velocity = 0
+        else:
+            velocity = start - self._scheduled_range[0]
+        ahead = min(max(additional, 2 * abs(velocity)), 4 * (end - start + 1))
+        if velocity < 0:
+            required = range(end, start - 1, -1) + \
+                       range(start - 1, max(-1, start - 1 - ahead), -1) + \
+                       range(end + 1, end + 1 + additional // 2)
+        elif velocity > 0:
+            required = range(start, end + ahead + 1) + \
+                       range(max(0, start - additional // 2), start)
+        else:
+            required = range(start, end + additional + 1) + \
+                       range(max(0, start - additional), start)
+
+        jumped = (self._scheduled_range is None or
+            any([path not in self._window for path in range(start, end + 1)]))
+        self._scheduled_range = (start, end)
+
+        if jumped:
+            # Visible rows have not been examined yet, so queue everything
+            # again to process these rows first.
+            self._thread.clear_orders()
+            self._window.clear()
+            self._queued.clear()
+        else:
+            # Drop orders for rows that have scrolled out of range.
+            wanted = set(required)
+            self._window.intersection_update(wanted)
+            stale = [path for path in self._queued if path not in wanted]
+            if stale:
+                self._thread.remove_orders(set([self._queued.pop(path)
+                                                for path in stale]))
+
+        orders = []
         model = self.get_model()
         for path in required:
+            if path in self._window:
+                continue
+            self._window.add(path)
             try:
                 iter = model.get_iter(path)
             except ValueError:
@@ -84,11 +140,13 @@ class ThumbnailViewBase(object):
                 not model.get_value(iter, self.status_column)):
 
                 file_path = self.get_file_path_from_model(model, iter)
-                pixbufs_needed.append((file_path, path))
+                order = (file_path, path)
+                self._queued[path] = order
+                orders.append(order)
 
-        if len(pixbufs_needed) > 0:
+        if len(orders) > 0:
             self._updates_stopped = False
-            self._thread.extend_orders(pixbufs_needed)
+            self._thread.extend_orders(orders)
 
     def _pixbuf_worker(self, order):
         """ Run by a worker thread to generate the thumbnail for a path."""
@@ -105,6 +163,7 @@ class ThumbnailViewBase(object):
         if self._updates_stopped:
             return 0
 
+        self._queued.pop(path, None)
         model = self.get_model()
         iter = model.get_iter(path)
         model.set(iter, self.pixbuf_column, pixbuf)
@@ -120,7 +179,7 @@ class ThumbnailIconView(gtk.IconView, ThumbnailViewBase):
         ThumbnailViewBase.__init__(self, model)
 
         # Connect events
-        self.connect('expose-event', self.draw_thumbnails_on_screen)
+        self.connect('expose-event', self._expose_event)
 
     def get_visible_range(self):
         return gtk.IconView.get_visible_range(self)
@@ -131,7 +190,7 @@ class ThumbnailTreeView(gtk.TreeView, ThumbnailViewBase):
         ThumbnailViewBase.__init__(self, model)
 
         # Connect events
-        self.connect('expose-event', self.draw_thumbnails_on_screen)
+        self.connect('expose-event', self._expose_event)
 
     def get_visible_range(self):
         return gtk.TreeView.get_visible_range(self)
@@ -2,13 +2,14 @@
 
 import os
 import sys
-import re
 import gc
 import bisect
 import operator
 
+from mcomix import natural_sort
 
-NUMERIC_REGEXP = re.compile(r"\d+|\D+")  # Split into numerics and characters
+
+NUMERIC_REGEXP = natural_sort.NUMERIC_REGEXP  # Split into numerics and characters
 
 
 def alphanumeric_sort(filenames):
@@ -16,33 +17,13 @@ def alphanumeric_sort(filenames):
     such that for an example "1.jpg", "2.jpg", "10.jpg" is a sorted
     ordering.
     """
-    def _format_substring(s):
-        if s.isdigit():
-            return int(s)
-
-        return s.lower()
-
-    filenames.sort(key=lambda s: map(_format_substring, NUMERIC_REGEXP.findall(s)))
+    natural_sort.sort(filenames)
 
 def alphanumeric_compare(s1, s2):
     """ Compares two strings by their natural order (i.e. 1 before 10)
     and returns a result comparable to the cmp function.
     @return: 0 if identical, -1 if s1 < s2, +1 if s1 > s2. """
-    if s1 is None:
-        return 1
-    elif s2 is None:
-        return -1
-
-    stringparts1 = NUMERIC_REGEXP.findall(s1.lower())
-    stringparts2 = NUMERIC_REGEXP.findall(s2.lower())
-    for i, part in enumerate(stringparts1):
-        if part.isdigit():
-            stringparts1[i] = int(part)
-    for i, part in enumerate(stringparts2):
-        if part.isdigit():
-            stringparts2[i] = int(part)
-
-    return cmp(stringparts1, stringparts2)
+    return natural_sort.compare(s1, s2)
 
 def bin_search(lst, value):
     """ Binary search for sorted list C{lst}, looking for C{value}.
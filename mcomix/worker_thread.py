@@ -111,6 +111,14 @@ class WorkerThread:
             self._condition.notifyAll()
             self._start(nb_threads=nb_added)
 
+    def remove_orders(self, orders):
+        """Remove the work orders in the set <orders> from the thread
+        orders queue. Orders that are already being processed are not
+        affected."""
+        with self._condition:
+            self._waiting_orders = [order for order in self._waiting_orders
+                                    if order not in orders]
+
     def stop(self):
         """Stop the worker threads and flush the orders queue."""
         self._stop = True
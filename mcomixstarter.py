@@ -18,5 +18,6 @@
 # along with this program; if not, write to the Free Software
 # -------------------------------------------------------------------------
 
-import mcomix.run
-mcomix.run.run()
+if __name__ == '__main__':
+    import mcomix.run
+    mcomix.run.run()
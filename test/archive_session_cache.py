@@ -0,0 +1,109 @@
+import unittest
+
+from mcomix.preferences import prefs
+from mcomix import archive_session_cache
+
+
+class DummyPixbuf(object):
+
+    def __init__(self, size):
+        self.size = size
+
+    def get_rowstride(self):
+        return self.size
+
+    def get_height(self):
+        return 1
+
+class DummyExtractor(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class DummyFileHandler(object):
+
+    def __init__(self):
+        self.deleted = []
+
+    def thread_delete(self, path):
+        self.deleted.append(path)
+
+
+class ArchiveSessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_prefs = (prefs['max archive sessions'],
+                          prefs['archive session cache size'])
+        prefs['max archive sessions'] = 2
+        prefs['archive session cache size'] = 1
+        self.filehandler = DummyFileHandler()
+        self.cache = archive_session_cache.ArchiveSessionCache(self.filehandler)
+
+    def tearDown(self):
+        (prefs['max archive sessions'],
+         prefs['archive session cache size']) = self.old_prefs
+
+    def create_session(self, path, size=0):
+        pixbufs = {}
+        if size:
+            pixbufs['page'] = DummyPixbuf(size)
+        return archive_session_cache.ArchiveSession(path, DummyExtractor(),
+            None, path + '-tmp', pixbufs=pixbufs)
+
+    def test_evicts_least_recently_used(self):
+        first = self.create_session(u'first')
+        self.cache.store(first)
+        self.cache.store(self.create_session(u'second'))
+        self.cache.store(self.create_session(u'third'))
+
+        self.assertFalse(u'first' in self.cache)
+        self.assertTrue(u'second' in self.cache)
+        self.assertTrue(u'third' in self.cache)
+        self.assertTrue(first.extractor.closed)
+        self.assertEqual(self.filehandler.deleted, [u'first-tmp'])
+
+    def test_take_removes_session(self):
+        session = self.create_session(u'first')
+        self.cache.store(session)
+
+        self.assertTrue(self.cache.take(u'first') is session)
+        self.assertFalse(u'first' in self.cache)
+        self.assertEqual(self.cache.take(u'first'), None)
+        # A taken session is in use again and must not be closed.
+        self.assertFalse(session.extractor.closed)
+
+    def test_memory_budget(self):
+        old = self.create_session(u'old', 768 * 1024)
+        new = self.create_session(u'new', 768 * 1024)
+        self.cache.store(old)
+        self.cache.store(new)
+
+        # The older session is evicted to stay within 1 MiB.
+        self.assertFalse(u'old' in self.cache)
+        self.assertTrue(u'new' in self.cache)
+
+    def test_memory_budget_keeps_newest_session(self):
+        session = self.create_session(u'huge', 2 * 1024 * 1024)
+        self.cache.store(session)
+
+        # The newest session keeps its extracted files, but not its pixbufs.
+        self.assertTrue(u'huge' in self.cache)
+        self.assertEqual(session.pixbufs, {})
+        self.assertFalse(session.extractor.closed)
+
+    def test_disabled(self):
+        prefs['max archive sessions'] = 0
+        self.assertFalse(self.cache.is_enabled())
+
+    def test_clear(self):
+        session = self.create_session(u'first')
+        self.cache.store(session)
+        self.cache.clear()
+
+        self.assertFalse(u'first' in self.cache)
+        self.assertTrue(session.extractor.closed)
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,42 @@
+import unittest
+import tempfile
+import os
+
+from mcomix.library import cover_pack
+
+
+class CoverPackTest(unittest.TestCase):
+
+    def setUp(self):
+        fp, self.path = tempfile.mkstemp('.db', 'mcomix-test')
+        os.close(fp)
+        self.pack = cover_pack._CoverPack(self.path)
+
+        self.existing = os.path.abspath('test/files/archives/01-ZIP-Normal.zip')
+        self.unavailable = os.path.abspath('test/files/unavailable.zip')
+        self.removed = os.path.abspath('test/files/removed.zip')
+        for path in (self.existing, self.unavailable, self.removed):
+            self.pack._con.execute('''insert into cover (path, mtime, data)
+                values (?, 0, '')''', (path,))
+
+    def tearDown(self):
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def get_paths(self):
+        return sorted(self.pack._con.execute('select path from cover').fetchall())
+
+    def test_compact(self):
+        # Covers of missing files are only removed if their book is
+        # not in the library.
+        self.pack.compact([self.unavailable])
+        self.assertEqual(self.get_paths(),
+                         sorted([(self.existing,), (self.unavailable,)]))
+
+    def test_remove(self):
+        self.pack.remove(self.removed)
+        self.assertEqual(self.get_paths(),
+                         sorted([(self.existing,), (self.unavailable,)]))
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from mcomix.preferences import prefs
+from mcomix import constants
+from mcomix import file_provider
+
+
+class DirectorySnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(u'mcomix-test')
+        for name, size in ((u'page 10.zip', 1), (u'page 9.zip', 2)):
+            with open(os.path.join(self.directory, name), 'wb') as fp:
+                fp.write('x' * size)
+        os.mkdir(os.path.join(self.directory, u'sub'))
+
+        self.old_prefs = (prefs['sort by'], prefs['sort order'])
+        prefs['sort order'] = constants.SORT_ASCENDING
+        self.snapshot = file_provider._DirectorySnapshot(self.directory)
+
+    def tearDown(self):
+        prefs['sort by'], prefs['sort order'] = self.old_prefs
+        shutil.rmtree(self.directory)
+
+    def get_names(self, paths):
+        return [os.path.basename(path) for path in paths]
+
+    def test_sort_by_name_without_stat(self):
+        prefs['sort by'] = constants.SORT_NAME
+        files = self.snapshot.get_files(file_provider.FileProvider.ARCHIVES)
+        self.assertEqual(self.get_names(files), [u'page 9.zip', u'page 10.zip'])
+        self.assertEqual(self.snapshot._stats, {})
+
+    def test_sort_by_size(self):
+        prefs['sort by'] = constants.SORT_SIZE
+        files = self.snapshot.get_files(file_provider.FileProvider.ARCHIVES)
+        self.assertEqual(self.get_names(files), [u'page 10.zip', u'page 9.zip'])
+
+    def test_directories(self):
+        self.assertEqual(self.get_names(self.snapshot.get_directories()),
+                         [u'sub'])
+
+# vim: expandtab:sw=4:ts=4
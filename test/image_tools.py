@@ -0,0 +1,173 @@
+import unittest
+import random
+
+import PIL.Image as Image
+import PIL.ImageEnhance as ImageEnhance
+import PIL.ImageOps as ImageOps
+
+from mcomix import image_tools
+from mcomix import pixbuf_array
+
+
+class FakePixbuf(object):
+
+    """ Stands in for a pixbuf with the pixels of a PIL image. Rows are
+    padded with <padding> bytes, as pixbufs often are. """
+
+    def __init__(self, im, padding=0):
+        self.im = im
+        self.channels = len(im.getbands())
+        width = im.size[0] * self.channels
+        self.rowstride = width + padding
+        data = im.tobytes()
+        self.pixels = ''.join([data[start:start + width] + '\0' * padding
+                               for start in range(0, len(data), width)])
+
+    def get_width(self):
+        return self.im.size[0]
+
+    def get_height(self):
+        return self.im.size[1]
+
+    def get_n_channels(self):
+        return self.channels
+
+    def get_has_alpha(self):
+        return self.channels == 4
+
+    def get_rowstride(self):
+        return self.rowstride
+
+    def get_pixels(self):
+        return self.pixels
+
+    def get_pixels_array(self):
+        raise RuntimeError('PyGTK without NumPy support')
+
+
+def create_image(mode, low=0, high=255, size=(32, 24), seed=0):
+    """ Returns an image with random pixel values between <low> and
+    <high>. """
+    rand = random.Random(seed)
+    count = size[0] * size[1] * len(mode)
+    return Image.frombytes(mode, size, ''.join([chr(rand.randint(low, high))
+                                                for i in range(count)]))
+
+def max_difference(im1, im2):
+    """ Returns the largest difference of a channel value of two images. """
+    return max([abs(value1 - value2)
+                for pixel1, pixel2 in zip(im1.getdata(), im2.getdata())
+                for value1, value2 in zip(pixel1, pixel2)])
+
+
+class EnhanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.numpy = pixbuf_array.numpy
+
+    def tearDown(self):
+        pixbuf_array.numpy = self.numpy
+
+    def get_enhanced(self, im, brightness=1.0, contrast=1.0,
+                     autocontrast=False):
+        lut = image_tools._get_enhance_lut(FakePixbuf(im, 3), brightness,
+                                           contrast, autocontrast)
+        return im.point(lut)
+
+    def run_without_numpy(self, test):
+        test()
+        pixbuf_array.numpy = None
+        test()
+
+    def test_brightness(self):
+        def test():
+            for mode in ('RGB', 'RGBA'):
+                im = create_image(mode)
+                for factor in (0.3, 0.7, 1.3, 2.3):
+                    self.assertEqual(
+                        list(self.get_enhanced(im, factor).getdata()),
+                        list(ImageEnhance.Brightness(im).enhance(factor).getdata()))
+        self.run_without_numpy(test)
+
+    def test_autocontrast(self):
+        def test():
+            im = create_image('RGB', 40, 200)
+            for brightness in (1.0, 0.7, 1.3):
+                expected = ImageOps.autocontrast(
+                    ImageEnhance.Brightness(im).enhance(brightness), cutoff=0.1)
+                self.assertEqual(
+                    list(self.get_enhanced(im, brightness, 1.0, True).getdata()),
+                    list(expected.getdata()))
+        self.run_without_numpy(test)
+
+    def test_contrast(self):
+        # The mean of the greyscale image may differ by one level between
+        # PIL versions.
+        def test():
+            for mode in ('RGB', 'RGBA'):
+                im = create_image(mode, 20, 230)
+                for brightness in (1.0, 1.2):
+                    for contrast in (0.5, 1.5, 2.0):
+                        expected = ImageEnhance.Contrast(
+                            ImageEnhance.Brightness(im).enhance(brightness)
+                        ).enhance(contrast)
+                        self.assertTrue(max_difference(
+                            self.get_enhanced(im, brightness, contrast),
+                            expected) <= 1)
+        self.run_without_numpy(test)
+
+    @unittest.skipUnless(pixbuf_array.is_available(), 'NumPy is not available')
+    def test_saturation(self):
+        for mode in ('RGB', 'RGBA'):
+            im = create_image(mode)
+            for factor in (0.0, 0.5, 1.5, 3.0):
+                enhanced = pixbuf_array.enhance_colour(
+                    pixbuf_array.numpy.asarray(im), factor)
+                self.assertTrue(max_difference(
+                    Image.frombytes(mode, im.size, enhanced.tostring()),
+                    ImageEnhance.Color(im).enhance(factor)) <= 1)
+
+    def test_sharpness(self):
+        # The filter rounds once instead of twice.
+        for mode in ('RGB', 'RGBA'):
+            im = create_image(mode)
+            for factor in (0.0, 0.5, 2.0, 3.0):
+                self.assertTrue(max_difference(image_tools._sharpen(im, factor),
+                    ImageEnhance.Sharpness(im).enhance(factor)) <= 1)
+
+
+@unittest.skipUnless(pixbuf_array.is_available(), 'NumPy is not available')
+class EdgeColourTest(unittest.TestCase):
+
+    def get_pil_colours(self, im, box, steps=10):
+        """ Returns the result of the PIL implementation of
+        get_edge_colours for the part <box> of <im>. """
+        im = im.crop(box)
+        middle = steps // 2 + steps % 2
+        return image_tools._group_colours(im.getcolors(im.size[0] * im.size[1]),
+                                          steps, middle)
+
+    def test_ties(self):
+        # Both groups have two colours that appear equally often, the
+        # smaller colour is chosen.
+        im = Image.new('RGB', (2, 5))
+        im.putdata([(10, 10, 10), (12, 12, 12), (12, 12, 12), (10, 10, 10),
+                    (99, 0, 0), (104, 0, 0), (104, 0, 0), (99, 0, 0),
+                    (95, 0, 0), (255, 255, 255)])
+        colours = image_tools.get_edge_colours(FakePixbuf(im, 2), 'left')
+        self.assertEqual(colours[(10, 10, 10)], (4, 2, (10, 10, 10)))
+        self.assertEqual(colours[(100, 0, 0)], (5, 2, (99, 0, 0)))
+        self.assertEqual(colours, self.get_pil_colours(im, (0, 0, 2, 5)))
+
+    def test_random_edges(self):
+        for mode in ('RGB', 'RGBA'):
+            for seed in range(3):
+                im = create_image(mode, 100, 140, (8, 30), seed)
+                for side, box in (('left', (0, 0, 2, 30)),
+                                  ('right', (6, 0, 8, 30))):
+                    for steps in (10, 5):
+                        self.assertEqual(image_tools.get_edge_colours(
+                            FakePixbuf(im, 1), side, steps=steps),
+                            self.get_pil_colours(im, box, steps))
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,212 @@
+import unittest
+import tempfile
+import threading
+import os
+
+from mcomix.preferences import prefs
+from mcomix import constants
+from mcomix.library import backend
+from mcomix.library import backend_types
+
+try:
+    from sqlite3 import dbapi2
+except ImportError:
+    from pysqlite2 import dbapi2
+
+
+#: Library structure of database version 6.
+VERSION_6_SCHEMA = '''
+create table book (
+    id integer primary key,
+    name text,
+    path text unique,
+    pages integer,
+    format integer,
+    size integer,
+    added datetime default current_timestamp);
+create table collection (
+    id integer primary key,
+    name text unique,
+    supercollection integer);
+create table contain (
+    collection integer not null,
+    book integer not null,
+    primary key (collection, book));
+create table info (
+    key text primary key,
+    value text);
+create table watchlist (
+    path text primary key,
+    collection integer references collection (id) on delete set null,
+    recursive boolean not null);
+create table recent (
+    book integer primary key,
+    page integer,
+    time_set datetime);
+insert into info (key, value) values ('version', '6');
+insert into collection (id, name) values (-2, 'Recent');
+'''
+
+def create_database():
+    """ Returns the path to a new, empty database file, which is also set
+    as library database path. """
+    fp, db = tempfile.mkstemp('.db', 'mcomix-test')
+    os.close(fp)
+    constants.LIBRARY_DATABASE_PATH = db
+    return db
+
+def remove_database(db):
+    for path in (db, db + '-wal', db + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+class LibraryUpgradeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = create_database()
+
+        con = dbapi2.connect(self.db)
+        con.executescript(VERSION_6_SCHEMA)
+        # Collections: 1 > 2 > 3, book 1 is in 1, book 2 in 3.
+        con.executemany('''insert into collection (id, name, supercollection)
+            values (?, ?, ?)''', [(1, u'Top', None), (2, u'Middle', 1),
+                                  (3, u'Bottom', 2)])
+        con.executemany('''insert into book (id, name, path, pages, format, size)
+            values (?, ?, ?, 10, 0, 100)''', [(1, u'Book 10.zip', u'/a/Book 10.zip'),
+                                              (2, u'Book 9.zip', u'/b/Book 9.zip')])
+        con.executemany('''insert into contain (collection, book)
+            values (?, ?)''', [(1, 1), (3, 2)])
+        con.commit()
+        con.close()
+
+        # Never reuse a backend that another test did not close.
+        backend._backend = None
+        self.library = backend.LibraryBackend()
+
+    def tearDown(self):
+        self.library.close()
+        backend._backend = None
+        remove_database(self.db)
+
+    def get_indexes(self, table):
+        return [row[1] for row in
+                self.library.execute('pragma index_list(%s)' % table).fetchall()]
+
+    def test_version(self):
+        self.assertEqual(self.library._library_version(),
+                         backend._LibraryBackend.DB_VERSION)
+
+    def test_indexes(self):
+        self.assertTrue('contain_book' in self.get_indexes('contain'))
+        self.assertTrue('collection_supercollection' in
+                        self.get_indexes('collection'))
+        self.assertTrue('book_added' in self.get_indexes('book'))
+
+    def test_books_in_subcollections(self):
+        top = self.library.get_collection_by_id(1)
+        self.assertEqual(sorted([book.id for book in top.get_books()]), [1, 2])
+        self.assertEqual(sorted(self.library.get_books_in_collection(1)), [1, 2])
+        self.assertEqual(self.library.get_books_in_collection(2), [2])
+        self.assertEqual(sorted(self.library.get_all_collections_in_collection(1)),
+                         [2, 3])
+
+    def test_books_in_subcollections_without_recursive_queries(self):
+        recursive_queries = backend._RECURSIVE_QUERIES
+        backend._RECURSIVE_QUERIES = False
+        try:
+            self.test_books_in_subcollections()
+        finally:
+            backend._RECURSIVE_QUERIES = recursive_queries
+
+    def test_sort_keys(self):
+        self.assertEqual(self.library.execute('''select count(*) from book
+            where sort_name is null or sort_path is null''').fetchone(), 0)
+
+    def get_sorted_books(self, sort_key, sort_order, offset=0, limit=None):
+        old_prefs = (prefs['lib sort key'], prefs['lib sort order'])
+        prefs['lib sort key'], prefs['lib sort order'] = sort_key, sort_order
+        try:
+            return [book.id for book in backend_types.DefaultCollection.get_books(
+                offset=offset, limit=limit)]
+        finally:
+            prefs['lib sort key'], prefs['lib sort order'] = old_prefs
+
+    def test_natural_sort_order(self):
+        self.assertEqual(self.get_sorted_books(constants.SORT_NAME,
+            constants.SORT_ASCENDING), [2, 1])
+        self.assertEqual(self.get_sorted_books(constants.SORT_NAME,
+            constants.SORT_DESCENDING), [1, 2])
+        self.assertEqual(self.get_sorted_books(constants.SORT_PATH,
+            constants.SORT_ASCENDING), [1, 2])
+        self.assertEqual(self.get_sorted_books(constants.SORT_NAME,
+            constants.SORT_ASCENDING, 1, 1), [1])
+
+    def test_write_ahead_log(self):
+        self.assertEqual(self.library.execute('pragma journal_mode').fetchone(),
+                         'wal')
+
+    def test_thread_connections(self):
+        connections = []
+        def update_book():
+            connections.append(self.library._con)
+            self.library.execute('update book set pages = 20 where id = 1')
+        thread = threading.Thread(target=update_book)
+        thread.start()
+        thread.join()
+
+        self.assertFalse(connections[0] is self.library._con)
+        self.assertEqual(self.library.execute('''select pages from book
+            where id = 1''').fetchone(), 20)
+
+        # Closing the library closes the connections of all threads, and
+        # the last one writes the log back into the database.
+        self.library.close()
+        self.assertRaises(dbapi2.ProgrammingError, connections[0].execute,
+                          'select 1')
+        self.assertFalse(os.path.exists(self.db + '-wal'))
+
+    def get_filtered_books(self, filter_string):
+        condition, args = self.library.get_filter_query(filter_string)
+        return sorted(self.library.execute('select id from Book where %s'
+                                           % condition, args).fetchall())
+
+    def test_filter(self):
+        self.assertEqual(self.get_filtered_books(u'book'), [1, 2])
+        self.assertEqual(self.get_filtered_books(u'10'), [1])
+        self.assertEqual(self.get_filtered_books(u'book 9'), [2])
+        # Directories in the path are searched as well.
+        self.assertEqual(self.get_filtered_books(u'a'), [1])
+        self.assertEqual(self.get_filtered_books(u'b 9'), [2])
+        self.assertEqual(self.get_filtered_books(u''), [1, 2])
+        self.assertTrue(self.library.book_matches_filter(2, u'book 9'))
+        self.assertFalse(self.library.book_matches_filter(2, u'10'))
+
+    def test_filter_without_search_index(self):
+        self.library._search_index = False
+        self.test_filter()
+
+    def test_new_files(self):
+        # A book that is only in the Recent collection is new.
+        self.library.execute('''insert into book (id, name, path)
+            values (3, 'Recent.zip', '/c/Recent.zip')''')
+        self.library.execute('''insert into contain (collection, book)
+            values (-2, 3)''')
+
+        watchlist = self.library.watchlist
+        self.assertFalse(watchlist.is_new_file(u'/a/Book 10.zip'))
+        self.assertTrue(watchlist.is_new_file(u'/c/Recent.zip'))
+        self.assertTrue(watchlist.is_new_file(u'/c/Other.zip'))
+
+    def test_last_read_page_changed(self):
+        changes = []
+        def page_changed(book, page):
+            changes.append((book.id, page))
+        self.library.last_read_page_changed += page_changed
+
+        book = self.library.get_book_by_id(1)
+        book.set_last_read_page(10)
+        book.set_last_read_page(None)
+        self.assertEqual(changes, [(1, 10), (1, None)])
+
+# vim: expandtab:sw=4:ts=4
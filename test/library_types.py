@@ -1,5 +1,6 @@
 import unittest
 import tempfile
+import shutil
 import os
 
 from mcomix import constants
@@ -15,6 +16,10 @@ class CollectionTest(unittest.TestCase):
 
         # Initialize library (path must be patched for testing)
         constants.LIBRARY_DATABASE_PATH = self.db
+        # Covers of removed books are removed from the cover pack.
+        fp, self.covers = tempfile.mkstemp('.db', 'mcomix-test')
+        os.close(fp)
+        constants.LIBRARY_COVERS_PACK_PATH = self.covers
         self.library = backend.LibraryBackend()
 
         # Initialize database
@@ -43,6 +48,9 @@ class CollectionTest(unittest.TestCase):
         # Remove singleton instance
         backend._backend = None
         os.unlink(self.db)
+        for path in (self.covers, self.covers + '-wal', self.covers + '-shm'):
+            if os.path.exists(path):
+                os.unlink(path)
 
     def test_get_books_default(self):
         default_col = backend_types.DefaultCollection
@@ -149,4 +157,19 @@ class WatchListEntryTest(unittest.TestCase):
         self.assertIsInstance(new_files, list)
         self.assertEqual(new_files, others)
 
+    def test_linked_parent_dir(self):
+        directory = tempfile.mkdtemp(u'mcomix-test')
+        try:
+            subdirectory = os.path.join(directory, u'sub')
+            os.mkdir(subdirectory)
+            archive = os.path.join(subdirectory, u'book.zip')
+            open(archive, 'wb').close()
+            # A link back to the watched directory must not be followed.
+            os.symlink(directory, os.path.join(subdirectory, u'parent'))
+
+            entry = backend_types._WatchListEntry(directory, True, None)
+            self.assertEqual(entry.get_new_files([]), [archive])
+        finally:
+            shutil.rmtree(directory)
+
 # vim: expandtab:sw=4:ts=4
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import re
+import random
+import timeit
+import unittest
+
+from mcomix import natural_sort
+
+
+# Implementation of tools.alphanumeric_sort and tools.alphanumeric_compare
+# before natural_sort was introduced, used as reference.
+NUMERIC_REGEXP = re.compile(r"\d+|\D+")
+
+def legacy_sort(filenames):
+    def _format_substring(s):
+        if s.isdigit():
+            return int(s)
+
+        return s.lower()
+
+    filenames.sort(key=lambda s: map(_format_substring, NUMERIC_REGEXP.findall(s)))
+
+def legacy_compare(s1, s2):
+    if s1 is None:
+        return 1
+    elif s2 is None:
+        return -1
+
+    stringparts1 = NUMERIC_REGEXP.findall(s1.lower())
+    stringparts2 = NUMERIC_REGEXP.findall(s2.lower())
+    for i, part in enumerate(stringparts1):
+        if part.isdigit():
+            stringparts1[i] = int(part)
+    for i, part in enumerate(stringparts2):
+        if part.isdigit():
+            stringparts2[i] = int(part)
+
+    return cmp(stringparts1, stringparts2)
+
+
+def make_filenames(count, seed=0):
+    rnd = random.Random(seed)
+    names = []
+    for i in xrange(count):
+        names.append(u'%s Vol.%d - Chapter %d (%s) p%03d.jpg' % (
+            rnd.choice([u'Batman', u'batman', u'Ōkami', u'X-Men']),
+            rnd.randint(1, 30), rnd.randint(1, 300),
+            rnd.choice([u'scan', u'Digital', u'c2c']), rnd.randint(0, 999)))
+    return names
+
+
+class NaturalSortTest(unittest.TestCase):
+
+    def setUp(self):
+        natural_sort.clear_cache()
+
+    def test_natural_order(self):
+        names = [u'10.jpg', u'2.jpg', u'1.jpg', u'B.jpg', u'a.jpg']
+        natural_sort.sort(names)
+        self.assertEqual([u'1.jpg', u'2.jpg', u'10.jpg', u'a.jpg', u'B.jpg'],
+                         names)
+
+    def test_sort_matches_legacy(self):
+        names = make_filenames(2000)
+        expected = names[:]
+        legacy_sort(expected)
+        natural_sort.sort(names)
+        self.assertEqual(expected, names)
+
+    def test_compare_matches_legacy(self):
+        names = make_filenames(200) + [None]
+        for s1 in names[::7]:
+            for s2 in names:
+                self.assertEqual(legacy_compare(s1, s2),
+                                 natural_sort.compare(s1, s2))
+
+    def test_sort_string_matches_key(self):
+        names = make_filenames(2000) + [u'a', u'a1', u'ab', u'1', u'01', u'']
+        by_key = sorted(names, key=natural_sort.key)
+        by_string = sorted(names, key=natural_sort.sort_string)
+        self.assertEqual([natural_sort.key(name) for name in by_key],
+                         [natural_sort.key(name) for name in by_string])
+
+    def test_cache_limit(self):
+        old_limit = natural_sort.MAX_CACHED_KEYS
+        natural_sort.MAX_CACHED_KEYS = 10
+        try:
+            for name in make_filenames(100):
+                natural_sort.key(name)
+            self.assertTrue(len(natural_sort._keys) <= 10)
+        finally:
+            natural_sort.MAX_CACHED_KEYS = old_limit
+
+
+def benchmark(count=20000, repeat=3):
+    """ Prints the time needed for sorting <count> file names with the
+    legacy implementation and with natural_sort. """
+    names = make_filenames(count)
+
+    def run(sort):
+        return min(timeit.repeat(lambda: sort(names[:]), number=1,
+                                 repeat=repeat))
+
+    def run_compare(compare):
+        return min(timeit.repeat(lambda: sorted(names, cmp=compare),
+                                 number=1, repeat=repeat))
+
+    natural_sort.clear_cache()
+    print 'Sorting %d names:' % count
+    print '  legacy sort           %.3fs' % run(legacy_sort)
+    natural_sort.clear_cache()
+    print '  natural_sort, cold    %.3fs' % min(timeit.repeat(
+        lambda: (natural_sort.clear_cache(), natural_sort.sort(names[:])),
+        number=1, repeat=repeat))
+    print '  natural_sort, cached  %.3fs' % run(natural_sort.sort)
+    print '  legacy compare        %.3fs' % run_compare(legacy_compare)
+    print '  natural_sort.compare  %.3fs' % run_compare(natural_sort.compare)
+
+if __name__ == '__main__':
+    benchmark()
+
+# vim: expandtab:sw=4:ts=4
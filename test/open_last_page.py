@@ -14,6 +14,10 @@ class OpenLastPageBasicTest(unittest.TestCase):
         fp, self.db = tempfile.mkstemp('.db', 'mcomix-test')
         os.close(fp)
         constants.LIBRARY_DATABASE_PATH = self.db
+        # Covers of removed books are removed from the cover pack.
+        fp, self.covers = tempfile.mkstemp('.db', 'mcomix-test')
+        os.close(fp)
+        constants.LIBRARY_COVERS_PACK_PATH = self.covers
 
         # Dummy archive (files are checked for existance)
         self.archive1 = os.path.abspath(u'test/files/archives/01-ZIP-Normal.zip')
@@ -28,6 +32,9 @@ class OpenLastPageBasicTest(unittest.TestCase):
     def tearDown(self):
         self.backend.close()
         os.unlink(self.db)
+        for path in (self.covers, self.covers + '-wal', self.covers + '-shm'):
+            if os.path.exists(path):
+                os.unlink(path)
 
     def test_init(self):
         self.assertEqual(0, self.lastread.count())
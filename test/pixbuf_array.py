@@ -0,0 +1,34 @@
+import unittest
+import random
+
+from mcomix import pixbuf_array
+
+from test.image_tools import FakePixbuf, create_image
+
+
+@unittest.skipUnless(pixbuf_array.is_available(), 'NumPy is not available')
+class PixbufArrayTest(unittest.TestCase):
+
+    def test_padded_rows(self):
+        for mode in ('RGB', 'RGBA'):
+            im = create_image(mode, size=(5, 3))
+            array = pixbuf_array.pixbuf_to_array(FakePixbuf(im, 3))
+            self.assertEqual(array.shape, (3, 5, len(mode)))
+            self.assertEqual(array.tostring(), im.tobytes())
+
+    def test_histogram(self):
+        for mode in ('RGB', 'RGBA'):
+            im = create_image(mode)
+            array = pixbuf_array.pixbuf_to_array(FakePixbuf(im, 1))
+            self.assertEqual(pixbuf_array.get_histogram(array), im.histogram())
+
+    def test_apply_lut(self):
+        rand = random.Random(0)
+        for mode in ('RGB', 'RGBA'):
+            im = create_image(mode)
+            lut = [rand.randint(0, 255) for i in range(256 * len(mode))]
+            array = pixbuf_array.pixbuf_to_array(FakePixbuf(im, 2))
+            self.assertEqual(pixbuf_array.apply_lut(array, lut).tostring(),
+                             im.point(lut).tobytes())
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,50 @@
+import unittest
+
+from mcomix.library import pixbuf_cache
+
+
+class DummyPixbuf(object):
+
+    def get_rowstride(self):
+        return 100
+
+    def get_height(self):
+        return 1
+
+
+class PixbufCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        # Room for three covers.
+        self.cache = pixbuf_cache._PixbufCache(300)
+
+    def add(self, *ids):
+        for id in ids:
+            self.cache.add(id, DummyPixbuf(), id)
+
+    def get_ids(self):
+        return sorted([id for id in range(10) if self.cache.exists(id)])
+
+    def test_evicts_least_recently_used(self):
+        self.add(0, 1, 2)
+        self.cache.get(0)
+        self.add(3)
+        self.assertEqual(self.get_ids(), [0, 2, 3])
+
+    def test_keeps_viewport(self):
+        self.cache.set_viewport(0, 1)
+        self.add(0, 1, 2, 3, 4)
+        self.assertEqual(self.get_ids(), [0, 1, 4])
+
+    def test_evicts_viewport_last(self):
+        self.cache.set_viewport(0, 3)
+        self.add(0, 1, 2, 3)
+        self.assertEqual(self.get_ids(), [1, 2, 3])
+
+    def test_invalidate(self):
+        self.add(0, 1)
+        self.cache.invalidate(0)
+        self.add(2, 3)
+        self.assertEqual(self.get_ids(), [1, 2, 3])
+
+# vim: expandtab:sw=4:ts=4
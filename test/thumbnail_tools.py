@@ -0,0 +1,31 @@
+import unittest
+
+from mcomix import constants
+from mcomix import thumbnail_tools
+
+
+class ThumbnailTierTest(unittest.TestCase):
+
+    def get_tiers(self, size, dst_dir=constants.THUMBNAIL_PATH):
+        thumbnailer = thumbnail_tools.Thumbnailer(dst_dir)
+        thumbnailer.set_size(size, size)
+        return thumbnailer._get_tiers()
+
+    def test_smallest_tier_first(self):
+        self.assertEqual(self.get_tiers(100), list(constants.THUMBNAIL_TIERS))
+        self.assertEqual(self.get_tiers(128), list(constants.THUMBNAIL_TIERS))
+
+    def test_larger_tiers_only(self):
+        self.assertEqual(self.get_tiers(200), list(constants.THUMBNAIL_TIERS[1:]))
+        self.assertEqual(self.get_tiers(500), list(constants.THUMBNAIL_TIERS[2:]))
+
+    def test_above_largest_tier(self):
+        # Stored at the exact size, instead of not being stored at all.
+        largest_dir = constants.THUMBNAIL_TIERS[-1][1]
+        self.assertEqual(self.get_tiers(1000), [(1000, largest_dir)])
+
+    def test_custom_directory(self):
+        self.assertEqual(self.get_tiers(300, u'/tmp/covers'),
+                         [(300, u'/tmp/covers')])
+
+# vim: expandtab:sw=4:ts=4